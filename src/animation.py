@@ -1,39 +1,130 @@
 # animations.py
 
-import tkinter as tk
-from tkinter import ttk
-import threading
+import logging
 import time
 import math
+import random
+from collections import deque
 from typing import Callable, Optional
 from config import config
 from utils import get_random_emoji
+from eventlog import get_logger, log_event
+
+_log = get_logger("notify")
+
+# Tk is imported on first use, headless runs never pay for it
+tk = ttk = None
+
+def _load_tk():
+    global tk, ttk
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as themed
+        tk, ttk = tkinter, themed
+
+class _Popup:
+    """A pooled notification window; hidden with withdraw() instead of destroyed"""
+
+    def __init__(self, root):
+        self.window = tk.Toplevel(root)
+        self.window.overrideredirect(True)
+        self.window.attributes("-topmost", True)
+        self.window.withdraw()
+        self.canvas = tk.Canvas(self.window, highlightthickness=0, width=300, height=150)
+        self.canvas.pack()
+        self.circle = self.canvas.create_oval(10, 10, 50, 50, outline="")
+        self.square = self.canvas.create_rectangle(250, 100, 290, 140, outline="")
+        self.text = self.canvas.create_text(150, 60, font=("Segoe UI", 12, "bold"), width=280)
+        self.particles = [self.canvas.create_oval(0, 0, 0, 0, outline="", state="hidden")
+                          for _ in range(15)]
+
+class _Animation:
+    def __init__(self, popup, slot, duration, static):
+        self.popup = popup
+        self.slot = slot
+        self.duration = duration
+        self.static = static
+        self.start = time.monotonic()
+        self.velocities = [(random.uniform(-4, 4), random.uniform(-5, 1)) for _ in popup.particles]
 
 class Animator:
+    """Runs every popup animation from a single after()-driven tick on the Tk main loop.
+
+    show_animation() may be called from any thread; it only queues a request.
+    Popup windows are pooled, at most MAX_POPUPS are shown at once, and when
+    the backlog grows past ANIMATION_BACKLOG_LIMIT the oldest requests are
+    dropped and the rest are shown without effects.
+    """
+
+    FADE_TIME = 0.5
+    FLOAT_PERIOD = 2.0
+    FLOAT_AMPLITUDE = 5
+    PARTICLE_TIME = 0.6
+
     def __init__(self):
         self.active_animations = []
         self.root = None
+        self._pending = deque()
+        self._pool = []
 
     def init_root(self, root):
+        _load_tk()
         self.root = root
+        self.root.after(self._frame_ms(), self._tick)
+
+    def _frame_ms(self) -> int:
+        return max(1, int(1000 / config.ANIMATION_FPS))
 
     def show_animation(self, animation_type="success", message=None, duration=2.5):
         if not self.root:
             return
-
-        thread = threading.Thread(
-            target=self._run_animation,
-            args=(animation_type, message, duration),
-            daemon=True
-        )
-        thread.start()
-
-    def _run_animation(self, animation_type, message, duration):
-        popup = tk.Toplevel(self.root)
-        popup.overrideredirect(True)
-        popup.attributes("-alpha", 0.0)
-        popup.attributes("-topmost", True)
-
+        self._pending.append((animation_type, message, duration))
+
+    def _tick(self):
+        try:
+            self._admit_pending()
+        except tk.TclError as e:
+            if not self._root_alive():
+                return
+            _log.exception(f"⚠️ Failed to show a notification: {str(e)}")
+        now = time.monotonic()
+        for anim in list(self.active_animations):
+            try:
+                if not self._step(anim, now - anim.start):
+                    self._finish(anim)
+            except tk.TclError as e:
+                if not self._root_alive():
+                    return
+                # Drop only this popup, a broken window must not go back to the pool
+                _log.exception(f"⚠️ Notification animation failed: {str(e)}")
+                self.active_animations.remove(anim)
+
+        # Idle ticks are cheap but there's no point running them at full rate
+        delay = self._frame_ms() if self.active_animations or self._pending else 100
+        self.root.after(delay, self._tick)
+
+    def _root_alive(self) -> bool:
+        try:
+            return bool(self.root.winfo_exists())
+        except tk.TclError:
+            # The interpreter is gone with the root
+            return False
+
+    def _admit_pending(self):
+        overloaded = len(self._pending) > config.ANIMATION_BACKLOG_LIMIT
+        while len(self._pending) > config.ANIMATION_BACKLOG_LIMIT:
+            self._pending.popleft()
+
+        while self._pending and len(self.active_animations) < config.MAX_POPUPS:
+            animation_type, message, duration = self._pending.popleft()
+            slot = min(set(range(config.MAX_POPUPS)) - {a.slot for a in self.active_animations})
+            popup = self._pool.pop() if self._pool else _Popup(self.root)
+            self._prepare(popup, slot, animation_type, message)
+            self.active_animations.append(
+                _Animation(popup, slot, duration, static=overloaded or bool(self._pending))
+            )
+
+    def _prepare(self, popup, slot, animation_type, message):
         # Default messages per animation type
         if not message:
             message = {
@@ -54,74 +145,67 @@ class Animator:
         }
 
         colors = color_scheme.get(animation_type, {"bg": "#f5f5f5", "fg": "#424242"})
-        bg_color = colors["bg"]
-        fg_color = colors["fg"]
-
-        canvas = tk.Canvas(popup, bg=bg_color, highlightthickness=0, width=300, height=150)
-        canvas.pack()
-
-        canvas.create_oval(10, 10, 50, 50, fill=fg_color, outline="")
-        canvas.create_rectangle(250, 100, 290, 140, fill=fg_color, outline="")
-
-        text_id = canvas.create_text(
-            150, 60,
-            text=message,
-            font=("Segoe UI", 12, "bold"),
-            fill=fg_color,
-            width=280
-        )
-
-        self._fade_in(popup)
-        self._float_effect(canvas, text_id)
-        self._particle_effect(canvas, fg_color)
-
-        time.sleep(duration)
-        self._fade_out(popup)
-
-    def _fade_in(self, window, duration=0.5):
-        for i in range(1, 11):
-            window.attributes("-alpha", i / 10)
-            time.sleep(duration / 10)
-
-    def _fade_out(self, window, duration=0.5):
-        for i in range(9, -1, -1):
-            window.attributes("-alpha", i / 10)
-            time.sleep(duration / 10)
-        window.destroy()
-
-    def _float_effect(self, canvas, text_id, amplitude=5, period=2):
-        start_time = time.time()
-        original_y = canvas.coords(text_id)[1]
-
-        while time.time() - start_time < period:
-            elapsed = time.time() - start_time
-            offset = amplitude * math.sin(2 * math.pi * elapsed / period)
-            canvas.coords(text_id, 150, original_y + offset)
-            canvas.update()
-            time.sleep(0.02)
-
-        canvas.coords(text_id, 150, original_y)
-
-    def _particle_effect(self, canvas, color, count=15):
-        particles = []
-        for _ in range(count):
-            x, y = 150, 75
-            size = 3
-            dx = (0.5 - (1 / 10)) * 10
-            dy = (0.5 - (1 / 10)) * 10
-            particle = canvas.create_oval(x, y, x + size, y + size, fill=color, outline="")
-            particles.append((particle, dx, dy))
-
-        for _ in range(20):
-            for i, (particle, dx, dy) in enumerate(particles):
-                canvas.move(particle, dx, dy)
-                dy += 0.2
-                particles[i] = (particle, dx, dy)
-            canvas.update()
-            time.sleep(0.03)
-
-        for particle, _, _ in particles:
-            canvas.delete(particle)
+        canvas = popup.canvas
+        canvas.configure(bg=colors["bg"])
+        canvas.itemconfig(popup.circle, fill=colors["fg"])
+        canvas.itemconfig(popup.square, fill=colors["fg"])
+        canvas.itemconfig(popup.text, text=message, fill=colors["fg"])
+        canvas.coords(popup.text, 150, 60)
+        for particle in popup.particles:
+            canvas.coords(particle, 150, 75, 153, 78)
+            canvas.itemconfig(particle, fill=colors["fg"], state="hidden")
+
+        x = self.root.winfo_rootx() + 20
+        y = self.root.winfo_rooty() + 20 + slot * 160
+        popup.window.geometry(f"300x150+{x}+{y}")
+        popup.window.attributes("-alpha", 0.0)
+        popup.window.deiconify()
+
+    def _step(self, anim, elapsed) -> bool:
+        """Advance one animation to `elapsed` seconds, False once it has finished"""
+        popup = anim.popup
+        total = anim.duration + 2 * self.FADE_TIME
+        if elapsed >= total:
+            return False
+
+        if anim.static:
+            popup.window.attributes("-alpha", 1.0)
+            return True
+
+        if elapsed < self.FADE_TIME:
+            alpha = elapsed / self.FADE_TIME
+        elif elapsed > total - self.FADE_TIME:
+            alpha = (total - elapsed) / self.FADE_TIME
+        else:
+            alpha = 1.0
+        popup.window.attributes("-alpha", round(alpha, 2))
+
+        float_time = elapsed - self.FADE_TIME
+        if 0 <= float_time < self.FLOAT_PERIOD:
+            offset = self.FLOAT_AMPLITUDE * math.sin(2 * math.pi * float_time / self.FLOAT_PERIOD)
+            popup.canvas.coords(popup.text, 150, 60 + offset)
+
+        particle_time = elapsed - self.FADE_TIME - self.FLOAT_PERIOD
+        if 0 <= particle_time < self.PARTICLE_TIME:
+            for particle, (dx, dy) in zip(popup.particles, anim.velocities):
+                # Closed-form ballistic path, so dropped frames don't slow the effect
+                t = particle_time / 0.03
+                x = 150 + dx * t
+                y = 75 + dy * t + 0.1 * t * t
+                popup.canvas.coords(particle, x, y, x + 3, y + 3)
+                popup.canvas.itemconfig(particle, state="normal")
+        elif particle_time >= self.PARTICLE_TIME:
+            for particle in popup.particles:
+                popup.canvas.itemconfig(particle, state="hidden")
+        return True
+
+    def _finish(self, anim):
+        self.active_animations.remove(anim)
+        anim.popup.window.withdraw()
+        if len(self._pool) < config.MAX_POPUPS:
+            self._pool.append(anim.popup)
+        else:
+            anim.popup.window.destroy()
 
     def show_loading(self, message="Processing...", callback=None):
         popup = tk.Toplevel(self.root)
@@ -209,5 +293,8 @@ def show_connection_animation(message):
         animator.show_animation("connection", message)
 
 def show_chat_notification(message):
+    # Headless runs have no popups, so the log is where notifications end up
+    level = logging.WARNING if message.startswith(("⚠️", "💥")) else logging.DEBUG
+    log_event(_log, level, message, kind="notification")
     if animator.root:
         animator.show_animation("notification", message, duration=2.0)
@@ -0,0 +1,504 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from typing import Dict, Any, List, Optional, Tuple
+from config import config, DEFAULT_CONFIG
+from protocol import tune_socket
+
+# ======================
+# WORKLOADS
+# ======================
+
+BUFFER_SIZES = [16384, 65536, 262144, 1048576]
+
+def build_workloads(scale: float) -> Dict[str, Dict[str, Any]]:
+    """Workload name -> file count, file size and content type"""
+    return {
+        "huge-random": {"count": 1, "size": int(256 * 1024 * 1024 * scale), "data": "random"},
+        "huge-text": {"count": 1, "size": int(256 * 1024 * 1024 * scale), "data": "text"},
+        "tiny-random": {"count": max(1, int(2000 * scale)), "size": 4096, "data": "random"},
+        "tiny-text": {"count": max(1, int(2000 * scale)), "size": 4096, "data": "text"},
+    }
+
+def _write_data(path: str, size: int, kind: str):
+    with open(path, 'wb') as f:
+        remaining = size
+        if kind == "random":
+            while remaining:
+                block = os.urandom(min(remaining, 1 << 20))
+                f.write(block)
+                remaining -= len(block)
+        else:
+            line = b"The quick brown fox jumps over the lazy dog. 0123456789\n"
+            block = line * ((1 << 20) // len(line) + 1)
+            while remaining:
+                f.write(block[:remaining])
+                remaining -= min(remaining, len(block))
+
+def generate_dataset(workdir: str, name: str, spec: Dict[str, Any]) -> List[str]:
+    """Create (or reuse) the files for a workload, deterministic in size and content type"""
+    folder = os.path.join(workdir, name)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(spec["count"]):
+        path = os.path.join(folder, f"{name}_{i:05d}.bin")
+        if not os.path.exists(path) or os.path.getsize(path) != spec["size"]:
+            _write_data(path, spec["size"], spec["data"])
+        paths.append(path)
+    return paths
+
+# ======================
+# TRANSPORTS
+# ======================
+
+class LatencyProxy:
+    """Local TCP proxy that delays every forwarded chunk, for WAN-like runs without netem"""
+
+    def __init__(self, target: Tuple[str, int], delay_ms: float):
+        self.target = target
+        self.delay = delay_ms / 1000
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.address = self.listener.getsockname()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(self.target)
+            # Nagle would hold each delayed chunk for the peer's ACK, adding
+            # a round trip of its own on top of the simulated one
+            tune_socket(client)
+            tune_socket(upstream)
+            for src, dst in ((client, upstream), (upstream, client)):
+                threading.Thread(target=self._pipe, args=(src, dst), daemon=True).start()
+
+    def _pipe(self, src: socket.socket, dst: socket.socket):
+        # A reader queues chunks with their release time so the delay adds
+        # latency without also capping throughput
+        pending = []
+        cond = threading.Condition()
+
+        def writer():
+            while True:
+                with cond:
+                    while not pending:
+                        cond.wait()
+                    release, data = pending.pop(0)
+                time.sleep(max(0.0, release - time.monotonic()))
+                try:
+                    if data is None:
+                        dst.shutdown(socket.SHUT_WR)
+                        return
+                    dst.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=writer, daemon=True).start()
+        while True:
+            try:
+                data = src.recv(1 << 16)
+            except OSError:
+                data = b""
+            with cond:
+                pending.append((time.monotonic() + self.delay, data or None))
+                cond.notify()
+            if not data:
+                return
+
+    def close(self):
+        self.listener.close()
+
+class LossyUdpProxy:
+    """Local UDP relay that delays and randomly drops datagrams in both directions.
+
+    Lets the UDP transport be measured on loopback as if over a lossy
+    long-haul link. It can't do the same for TCP, which needs loss below
+    the socket (tc netem) to be comparable.
+    """
+
+    def __init__(self, target: Tuple[str, int], delay_ms: float, loss_pct: float, seed: int = 1):
+        self.delay = delay_ms / 1000
+        self.loss = loss_pct / 100
+        self.random = random.Random(seed)
+        self.client = None
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.front.bind(('127.0.0.1', 0))
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.back.connect(target)
+        for sock in (self.front, self.back):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+            sock.settimeout(0.5)
+        self.address = self.front.getsockname()
+        self.closed = False
+        threading.Thread(target=self._relay, args=(True,), daemon=True).start()
+        threading.Thread(target=self._relay, args=(False,), daemon=True).start()
+
+    def _relay(self, outbound: bool):
+        pending = []
+        cond = threading.Condition()
+
+        def writer():
+            while not self.closed:
+                with cond:
+                    while not pending:
+                        cond.wait()
+                    release, data = pending.pop(0)
+                time.sleep(max(0.0, release - time.monotonic()))
+                try:
+                    if outbound:
+                        self.back.send(data)
+                    elif self.client:
+                        self.front.sendto(data, self.client)
+                except OSError:
+                    pass
+
+        threading.Thread(target=writer, daemon=True).start()
+        while not self.closed:
+            try:
+                if outbound:
+                    data, self.client = self.front.recvfrom(65535)
+                else:
+                    data = self.back.recv(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.closed:
+                    return
+                continue
+            if self.random.random() < self.loss:
+                continue
+            with cond:
+                pending.append((time.monotonic() + self.delay, data))
+                cond.notify()
+
+    def close(self):
+        self.closed = True
+        self.front.close()
+        self.back.close()
+
+class _Closing:
+    """Closes several helper objects as one"""
+
+    def __init__(self, *objects):
+        self.objects = [obj for obj in objects if obj]
+
+    def close(self):
+        for obj in self.objects:
+            obj.close()
+
+def _open_udp(latency_ms: float, loss_pct: float):
+    import udp_transport
+    listener = udp_transport.UdpListener(0, '127.0.0.1')
+    target = ('127.0.0.1', listener.port)
+    proxy = None
+    if latency_ms or loss_pct:
+        proxy = LossyUdpProxy(target, latency_ms, loss_pct)
+        target = proxy.address
+    sender = udp_transport.connect(target, timeout=config.SOCKET_TIMEOUT)
+    receiver, _ = listener.accept(timeout=config.SOCKET_TIMEOUT)
+    return sender, receiver, _Closing(proxy, listener)
+
+def open_transport(kind: str, latency_ms: float = 0, loss_pct: float = 0) -> Tuple[Any, Any, Any]:
+    """Return (sender, receiver, cleanup object) connected by the given transport"""
+    if kind == "socketpair":
+        sender, receiver = socket.socketpair()
+        return sender, receiver, None
+    if kind == "udp":
+        return _open_udp(latency_ms, loss_pct)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    proxy = None
+    target = listener.getsockname()
+    if latency_ms:
+        proxy = LatencyProxy(target, latency_ms)
+        target = proxy.address
+    sender = socket.create_connection(target)
+    receiver, _ = listener.accept()
+    listener.close()
+    return sender, receiver, proxy
+
+# ======================
+# MEASUREMENT
+# ======================
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def run_transfer_case(paths: List[str], transport: str, buffer_size: int,
+                      latency_ms: float = 0, loss_pct: float = 0, fec: int = 0) -> Dict[str, Any]:
+    """Send every file through file_transfer and measure the run"""
+    import file_transfer
+
+    DEFAULT_CONFIG['BUFFER_SIZE'] = buffer_size
+    DEFAULT_CONFIG['UDP_FEC_GROUP'] = fec
+    dest = tempfile.mkdtemp(prefix="p2p-bench-")
+    sender, receiver, proxy = open_transport(transport, latency_ms, loss_pct)
+    done_times, failures = [], []
+
+    def on_received(message):
+        if message.startswith("✨"):
+            done_times.append(time.perf_counter())
+        elif message.startswith("⚠️"):
+            failures.append(message)
+
+    recv_thread = threading.Thread(
+        target=file_transfer.receive_loop, args=(receiver, on_received, dest), daemon=True
+    )
+    recv_thread.start()
+
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    start_times = []
+    cpu_start = _cpu_seconds()
+    wall_start = time.perf_counter()
+    for path in paths:
+        start_times.append(time.perf_counter())
+        success, message = file_transfer.send_file(sender, path)
+        if not success:
+            failures.append(message)
+            break
+
+    sender.shutdown(socket.SHUT_WR)
+    recv_thread.join()
+    wall = time.perf_counter() - wall_start
+    cpu = _cpu_seconds() - cpu_start
+
+    sender.close()
+    receiver.close()
+    if proxy:
+        proxy.close()
+    shutil.rmtree(dest, ignore_errors=True)
+
+    latencies = [(done - start) * 1000 for start, done in zip(start_times, done_times)]
+    return {
+        "files": len(paths),
+        "bytes": total_bytes,
+        "completed": len(done_times),
+        "failures": failures[:5],
+        "seconds": round(wall, 4),
+        "throughput_mb_s": round(total_bytes / wall / (1 << 20), 2) if wall else 0,
+        "latency_p50_ms": round(_percentile(latencies, 50), 3),
+        "latency_p99_ms": round(_percentile(latencies, 99), 3),
+        "cpu_seconds": round(cpu, 3),
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+def run_chat_case(messages: int) -> Dict[str, Any]:
+    """Push chat messages between two ChatHandlers over loopback"""
+    import chat
+    from history import history
+
+    history.db_path = os.path.join(tempfile.mkdtemp(prefix="p2p-bench-"), "history.db")
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        DEFAULT_CONFIG['CHAT_PORT'] = probe.getsockname()[1]
+
+    latencies = []
+    finished = threading.Event()
+
+    def on_message(msg, timestamp):
+        if "Peer: bench " in msg:
+            sent_at = float(msg.rsplit(" ", 1)[1])
+            latencies.append((time.time() - sent_at) * 1000)
+            if len(latencies) >= messages:
+                finished.set()
+
+    server = {}
+    server_thread = threading.Thread(
+        target=lambda: server.setdefault("handler", chat.ChatHandler(True, None, on_message)),
+        daemon=True
+    )
+    server_thread.start()
+    time.sleep(0.2)
+    client = chat.ChatHandler(False, '127.0.0.1', lambda msg, timestamp: None)
+    server_thread.join()
+
+    cpu_start = _cpu_seconds()
+    wall_start = time.perf_counter()
+    for i in range(messages):
+        client.send(f"bench {i} {time.time()}")
+    finished.wait(timeout=60)
+    wall = time.perf_counter() - wall_start
+    cpu = _cpu_seconds() - cpu_start
+
+    client.close()
+    server["handler"].close()
+    return {
+        "messages": messages,
+        "delivered": len(latencies),
+        "seconds": round(wall, 4),
+        "messages_per_s": round(len(latencies) / wall, 1) if wall else 0,
+        "latency_p50_ms": round(_percentile(latencies, 50), 3),
+        "latency_p99_ms": round(_percentile(latencies, 99), 3),
+        "cpu_seconds": round(cpu, 3),
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+# ======================
+# HARNESS
+# ======================
+
+def _run_worker(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one case in a fresh interpreter so RSS and config changes don't leak"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "_worker", json.dumps(spec)],
+        capture_output=True, text=True, cwd=spec["workdir"]
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1:] or ["worker failed"]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_suite(args) -> Dict[str, Any]:
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "p2p-bench-data")
+    os.makedirs(workdir, exist_ok=True)
+    workloads = build_workloads(args.scale)
+    selected = args.workloads or list(workloads)
+    buffer_sizes = args.buffer_sizes or BUFFER_SIZES
+
+    cases = []
+    for name in selected:
+        paths = generate_dataset(workdir, name, workloads[name])
+        for transport in args.transports:
+            for buffer_size in buffer_sizes:
+                # Only the UDP proxy can drop packets
+                loss_pct = args.loss_pct if transport == "udp" else 0
+                spec = {"kind": "transfer", "workload": name, "paths": paths, "transport": transport,
+                        "buffer_size": buffer_size, "latency_ms": args.latency_ms, "loss_pct": loss_pct,
+                        "fec": args.fec, "workdir": workdir}
+                result = _run_worker(spec)
+                case = {"workload": name, "transport": transport, "buffer_size": buffer_size,
+                        "latency_ms": args.latency_ms, "loss_pct": loss_pct, **result}
+                cases.append(case)
+                if "error" in case:
+                    print(f"❌ {name} {transport} {buffer_size} B: {case['error']}", file=sys.stderr)
+                    continue
+                print(f"📊 {name:12s} {transport:10s} {buffer_size:>8d} B  "
+                      f"{case.get('throughput_mb_s', 0):>9.2f} MB/s  "
+                      f"p50 {case.get('latency_p50_ms', 0):.2f} ms  p99 {case.get('latency_p99_ms', 0):.2f} ms",
+                      file=sys.stderr)
+
+    if args.chat_messages:
+        result = _run_worker({"kind": "chat", "messages": args.chat_messages, "workdir": workdir})
+        cases.append({"workload": "chat", "transport": "tcp", **result})
+        print(f"💬 chat {result.get('messages_per_s', 0)} msg/s  "
+              f"p50 {result.get('latency_p50_ms', 0)} ms  p99 {result.get('latency_p99_ms', 0)} ms",
+              file=sys.stderr)
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "cases": cases,
+    }
+
+def _case_key(case: Dict[str, Any]) -> Tuple:
+    return (case["workload"], case["transport"], case.get("buffer_size"), case.get("latency_ms"),
+            case.get("loss_pct", 0))
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> int:
+    """Print throughput changes per case, return 1 if any case regressed past threshold %"""
+    base_cases = {_case_key(case): case for case in baseline["cases"]}
+    regressions = 0
+    for case in current["cases"]:
+        base = base_cases.get(_case_key(case))
+        metric = "messages_per_s" if case["workload"] == "chat" else "throughput_mb_s"
+        if not base or not base.get(metric):
+            continue
+        change = (case.get(metric, 0) - base[metric]) / base[metric] * 100
+        flag = "❌" if change < -threshold else "✅"
+        regressions += change < -threshold
+        print(f"{flag} {' '.join(str(part) for part in _case_key(case))}: "
+              f"{base[metric]} -> {case.get(metric, 0)} {metric} ({change:+.1f}%)")
+    return 1 if regressions else 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["_worker"]:
+        spec = json.loads(argv[1])
+        # Library status prints would corrupt the JSON result line
+        with redirect_stdout(sys.stderr):
+            if spec["kind"] == "chat":
+                result = run_chat_case(spec["messages"])
+            else:
+                result = run_transfer_case(spec["paths"], spec["transport"], spec["buffer_size"],
+                                           spec["latency_ms"], spec.get("loss_pct", 0), spec.get("fec", 0))
+        print(json.dumps(result))
+        return 0
+
+    parser = argparse.ArgumentParser(prog="benchmark", description="Loopback transfer benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the workload matrix and save JSON results")
+    run.add_argument("--out", default="bench_results.json", help="results file")
+    run.add_argument("--scale", type=float, default=1.0, help="multiply workload sizes (e.g. 0.1 for a quick run)")
+    run.add_argument("--workloads", nargs="+", choices=list(build_workloads(1.0)))
+    run.add_argument("--transports", nargs="+", default=["socketpair", "tcp"], choices=["socketpair", "tcp", "udp"])
+    run.add_argument("--buffer-sizes", nargs="+", type=int)
+    run.add_argument("--latency-ms", type=float, default=0, help="add delay with a local proxy (tcp and udp)")
+    run.add_argument("--loss-pct", type=float, default=0, help="drop this share of datagrams (udp only)")
+    run.add_argument("--fec", type=int, default=0, help="UDP data packets per parity packet (0 disables)")
+    run.add_argument("--chat-messages", type=int, default=1000, help="chat messages to send (0 skips chat)")
+    run.add_argument("--workdir", help="where generated datasets are cached")
+
+    cmp = sub.add_parser("compare", help="compare two result files")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=5.0, help="allowed slowdown in percent")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        return compare(baseline, current, args.threshold)
+
+    results = run_suite(args)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results saved to {args.out}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import os
+import socket
+import threading
+import time
+from typing import Optional, List, Dict, Any, Tuple
+import peer
+from config import config
+from catalog import catalog
+from file_transfer import stream_file, receive_exact
+from metrics import metrics
+from protocol import send_frame, recv_frame, tune_socket, ProtocolError
+from utils import format_bytes, calculate_speed, safe_filename
+from eventlog import get_logger
+
+log = get_logger("browse")
+
+# Fields of a catalog row that are shown to peers
+_PUBLIC_FIELDS = ("path", "name", "size", "mtime_ns", "hash")
+
+def _requests(op: str):
+    return metrics.counter("p2p_browse_requests_total", "Browse requests served", op=op)
+
+class BrowseServer:
+    """Answers list/has/get requests against the shared-folder catalog.
+
+    Each connection carries any number of request frames. A "get" reply is
+    followed by the raw file bytes, sent with the same streaming path as a
+    pushed file. Only files present in the catalog can be requested, so a
+    peer can never name a path outside the shared folder.
+    """
+
+    def __init__(self):
+        self.listener = None
+        self.port = None
+        # False when the server only runs for registered handlers (sync),
+        # so the shared folder can't be listed or downloaded
+        self.sharing = True
+        # Extra request types registered by other modules, op -> handler(conn, request)
+        self.handlers = {}
+
+    def register(self, op: str, handler):
+        self.handlers[op] = handler
+
+    def start(self, port: Optional[int] = None, sharing: bool = True) -> int:
+        """Listen in a background thread, return the bound port"""
+        if self.listener:
+            return self.port
+        self.sharing = sharing
+        self.listener = peer.create_listener(config.BROWSE_PORT if port is None else port, backlog=16)
+        self.port = self.listener.getsockname()[1]
+        if sharing:
+            threading.Thread(target=catalog.rescan, daemon=True).start()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self.port
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, addr = self.listener.accept()
+            except OSError:
+                return
+            conn.settimeout(config.SOCKET_TIMEOUT)
+            tune_socket(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        if self.listener:
+            self.listener.close()
+            self.listener = None
+
+    def _serve(self, conn: socket.socket):
+        try:
+            while True:
+                request = recv_frame(conn)
+                if request is None:
+                    return
+                op = request.get("op")
+                handler = self.handlers.get(op)
+                if handler is None and self.sharing:
+                    handler = getattr(self, f"_op_{op}", None)
+                if handler is None:
+                    send_frame(conn, {"ok": False, "error": f"Unknown request: {op}"})
+                    continue
+                _requests(op).inc()
+                try:
+                    handler(conn, request)
+                except (KeyError, ValueError, TypeError, AttributeError) as e:
+                    # Handlers check their fields before replying or reading a payload
+                    send_frame(conn, {"ok": False, "error": f"Bad {op} request: {str(e)}"})
+        except (OSError, ProtocolError) as e:
+            log.warning(f"⚠️ Browse connection ended: {str(e)}")
+        finally:
+            conn.close()
+
+    def _op_list(self, conn, request: Dict[str, Any]):
+        rel_dir = str(request.get("dir", "")).strip("/")
+        limit = max(1, min(int(request.get("limit", 500)), 5000))
+        rows = catalog.listing(rel_dir, limit=limit, after=str(request.get("after", "")),
+                               pattern=request.get("pattern"))
+        send_frame(conn, {
+            "ok": True,
+            "files": [{key: row[key] for key in _PUBLIC_FIELDS} for row in rows],
+            "dirs": catalog.subdirs(rel_dir) if not request.get("after") else [],
+            # Keyset cursor: pass it back as "after" for the next page
+            "next": rows[-1]["name"] if len(rows) == limit else None,
+        })
+
+    def _op_has(self, conn, request: Dict[str, Any]):
+        row = catalog.find_hash(str(request.get("hash", "")))
+        send_frame(conn, {"ok": True, "found": bool(row), "path": row["path"] if row else None})
+
+    def _op_get(self, conn, request: Dict[str, Any]):
+        rel = str(request.get("path", "")).strip("/")
+        row = catalog.get(rel)
+        path = catalog.absolute(rel) if row else None
+        root = os.path.realpath(catalog.root)
+        if not path or not os.path.realpath(path).startswith(root + os.sep) or not os.path.isfile(path):
+            send_frame(conn, {"ok": False, "error": f"Not shared: {rel}"})
+            return
+
+        size = os.path.getsize(path)
+        send_frame(conn, {"ok": True, "path": rel, "size": size, "hash": row["hash"]})
+        stream_file(conn, path, size)
+
+# Global browse server instance
+browse_server = BrowseServer()
+
+class RemoteShare:
+    """Client side of the browse protocol: list and pull from a peer's shared folder"""
+
+    def __init__(self, ip: str, port: Optional[int] = None):
+        self.ip = ip
+        self.port = port or config.BROWSE_PORT
+        self.sock = None
+
+    def connect(self) -> "RemoteShare":
+        if not self.sock:
+            self.sock = socket.create_connection((self.ip, self.port), timeout=config.SOCKET_TIMEOUT)
+            tune_socket(self.sock)
+        return self
+
+    def _request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        self.connect()
+        send_frame(self.sock, message)
+        return self._reply()
+
+    def _reply(self) -> Dict[str, Any]:
+        reply = recv_frame(self.sock)
+        if reply is None:
+            raise ConnectionError("Peer closed the browse connection")
+        return reply
+
+    def list(self, rel_dir: str = "", pattern: Optional[str] = None,
+             limit: int = 500, after: str = "") -> Dict[str, Any]:
+        """One page of a remote directory: {"files": [...], "dirs": [...], "next": cursor}"""
+        message = {"op": "list", "dir": rel_dir, "limit": limit, "after": after}
+        if pattern:
+            message["pattern"] = pattern
+        return self._request(message)
+
+    def walk(self, rel_dir: str = "", pattern: Optional[str] = None):
+        """Yield every remote file under rel_dir, fetching pages as needed"""
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            after = ""
+            while True:
+                page = self.list(current, pattern=pattern, after=after)
+                if not page.get("ok"):
+                    raise ProtocolError(page.get("error", "List failed"))
+                pending.extend(page["dirs"])
+                yield from page["files"]
+                if not page["next"]:
+                    break
+                after = page["next"]
+
+    def has(self, digest: str) -> bool:
+        return bool(self._request({"op": "has", "hash": digest}).get("found"))
+
+    def pull(self, rel_path: str, dest_dir: Optional[str] = None,
+             progress_callback=None) -> Tuple[bool, Optional[str], str]:
+        """Download one file from the peer, same return shape as receive_file"""
+        temp_path = None
+        try:
+            start_time = time.time()
+            reply = self._request({"op": "get", "path": rel_path})
+            if not reply.get("ok"):
+                return (False, None, f"❌ {reply.get('error', 'Request refused')}")
+
+            filename = safe_filename(os.path.basename(reply["path"]))
+            if not filename:
+                return (False, None, "❌ Empty filename received")
+            save_path = os.path.join(dest_dir or config.SHARED_FOLDER, filename)
+            temp_path = save_path + ".part"
+            size = reply["size"]
+            receive_exact(self.sock, temp_path, size, progress_callback)
+            os.replace(temp_path, save_path)
+            catalog.note_file(save_path)
+
+            transfer_time = time.time() - start_time
+            speed = calculate_speed(size, transfer_time)
+            return (True, save_path, f"📥 Pulled {filename} ({format_bytes(size)}) in {transfer_time:.2f}s ({speed})")
+
+        except (OSError, ProtocolError) as e:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            # The stream position is unknown after a failure, start over next time
+            self.close()
+            return (False, None, f"❌ Error pulling file: {str(e)}")
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+def list_remote(ip: str, rel_dir: str = "", pattern: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Every file under rel_dir on the peer"""
+    with RemoteShare(ip) as remote:
+        return list(remote.walk(rel_dir, pattern))
@@ -0,0 +1,48 @@
+from typing import Dict, Any
+from config import config
+
+# Bumped whenever the wire format changes in a way old peers can't follow
+PROTOCOL_VERSION = 2
+
+# Starts a hello on the transfer port. 0xff never appears in UTF-8, so a
+# legacy receiver fails to decode it as a filename, drops it and keeps
+# waiting, and the sender falls back to the filename/ACK/<EOF> protocol.
+HELLO_MAGIC = b"\xffP2P"
+
+def local_capabilities() -> Dict[str, Any]:
+    """What this node supports. Lists are in order of preference, fastest first."""
+    return {
+        "version": PROTOCOL_VERSION,
+        "codecs": ["raw"],
+        "ciphers": ["none"],
+        "max_frame_size": config.MAX_FRAME_SIZE,
+        "buffer_size": config.BUFFER_SIZE,
+        "streams": 1,  # data connections per transfer
+        "sized": True,  # length-prefixed file headers instead of <EOF> scanning
+        "sparse": bool(config.SPARSE_TRANSFER),  # sized headers may carry a hole map, only data is sent
+    }
+
+def agree(offered: Dict[str, Any], local: Dict[str, Any]) -> Dict[str, Any]:
+    """The best set both sides support.
+
+    Numbers take the smaller value, flags must be set on both sides and
+    lists take our most preferred entry the peer also offers. Anything
+    the peer didn't mention, or a list with nothing in common, is left
+    out so callers fall back to the legacy behaviour.
+    """
+    agreed = {}
+    for key, value in local.items():
+        theirs = offered.get(key)
+        if isinstance(value, bool):
+            if theirs is True and value:
+                agreed[key] = True
+        elif isinstance(value, int):
+            if isinstance(theirs, int) and not isinstance(theirs, bool):
+                agreed[key] = min(theirs, value)
+        elif isinstance(value, list) and isinstance(theirs, (list, str)):
+            # A reply names the single choice, an offer lists several
+            offered_items = theirs if isinstance(theirs, list) else [theirs]
+            common = [item for item in value if item in offered_items]
+            if common:
+                agreed[key] = common[0]
+    return agreed
@@ -0,0 +1,365 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, List, Dict, Any, Iterable, Callable
+from config import config
+from hashing import hasher
+from eventlog import get_logger
+
+log = get_logger("catalog")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_files_dir ON files (dir, name);
+CREATE INDEX IF NOT EXISTS idx_files_name ON files (name);
+CREATE INDEX IF NOT EXISTS idx_files_hash ON files (hash) WHERE hash IS NOT NULL;
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL,
+    seen INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dirs_parent ON dirs (parent);
+"""
+
+# Files still being received are not shared yet
+_SKIP_SUFFIXES = (".part",)
+
+class SharedCatalog:
+    """Persistent index of the shared folder (path, size, mtime, inode, hash).
+
+    Lookups by name or content hash are single index probes. Rescans are
+    incremental: a directory whose mtime hasn't changed has the same entries
+    as last time, so only its subdirectories are visited. Changed directories
+    are listed once with os.scandir and diffed against their stored rows.
+    Files whose size, mtime or inode changed lose their cached hash.
+    """
+
+    def __init__(self, root: Optional[str] = None, db_path: Optional[str] = None):
+        self.root = root
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._ready = False
+        self._watcher = None
+
+    def _start(self):
+        """Create the schema on first use"""
+        with self._lock:
+            if self._ready:
+                return
+            if not self.root:
+                self.root = str(config.SHARED_FOLDER)
+            if not self.db_path:
+                self.db_path = str(config.HISTORY_DIR / "shared_catalog.db")
+                config.ensure_directories()
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = self._connect()
+            conn.executescript(_SCHEMA)
+            conn.commit()
+            self._ready = True
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=config.SOCKET_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _relative(self, path: str) -> Optional[str]:
+        """Catalog key for an absolute path, or None if it is outside the root"""
+        root = self.root or str(config.SHARED_FOLDER)
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+        if rel == os.curdir or rel.startswith(os.pardir):
+            return None
+        return rel.replace(os.sep, "/")
+
+    def absolute(self, rel: str) -> str:
+        self._start()
+        return os.path.join(self.root, *rel.split("/"))
+
+    # ======================
+    # SCANNING
+    # ======================
+
+    def rescan(self, full: bool = False,
+               on_change: Optional[Callable[[str, str], None]] = None) -> Dict[str, int]:
+        """Bring the catalog up to date with the folder.
+
+        With full=True every directory is listed even if its mtime is
+        unchanged, which also catches in-place edits to existing files.
+        on_change(kind, path) is called for every "added", "modified" or
+        "removed" file.
+        """
+        self._start()
+        stats = {"dirs_listed": 0, "dirs_skipped": 0, "added": 0, "updated": 0, "removed": 0}
+        if not os.path.isdir(self.root):
+            return stats
+
+        with self._scan_lock:
+            conn = self._connect()
+            scan_id = int(time.time() * 1000)
+            pending = [("", None)]
+            while pending:
+                rel_dir, parent = pending.pop()
+                abs_dir = self.absolute(rel_dir) if rel_dir else self.root
+                try:
+                    dir_mtime = os.stat(abs_dir).st_mtime_ns
+                except OSError:
+                    continue
+
+                row = conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (rel_dir,)).fetchone()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO dirs (path, parent, mtime_ns, seen) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, seen = excluded.seen",
+                        (rel_dir, parent, dir_mtime, scan_id)
+                    )
+                    if row and row["mtime_ns"] == dir_mtime and not full:
+                        stats["dirs_skipped"] += 1
+                        subdirs = [r["path"] for r in conn.execute(
+                            "SELECT path FROM dirs WHERE parent = ?", (rel_dir,))]
+                    else:
+                        stats["dirs_listed"] += 1
+                        subdirs = self._scan_dir(conn, rel_dir, abs_dir, stats, on_change)
+                pending.extend((subdir, rel_dir) for subdir in subdirs)
+
+            # Directories not reached this time were deleted or moved away
+            with conn:
+                gone = [r["path"] for r in conn.execute("SELECT path FROM dirs WHERE seen != ?", (scan_id,))]
+                for rel_dir in gone:
+                    if on_change:
+                        for r in conn.execute("SELECT path FROM files WHERE dir = ?", (rel_dir,)).fetchall():
+                            on_change("removed", r["path"])
+                    stats["removed"] += conn.execute("DELETE FROM files WHERE dir = ?", (rel_dir,)).rowcount
+                conn.execute("DELETE FROM dirs WHERE seen != ?", (scan_id,))
+        return stats
+
+    def _scan_dir(self, conn, rel_dir: str, abs_dir: str, stats: Dict[str, int],
+                  on_change: Optional[Callable[[str, str], None]] = None) -> List[str]:
+        """Diff one directory listing against its rows, return its subdirectories"""
+        known = {r["name"]: (r["size"], r["mtime_ns"], r["inode"]) for r in conn.execute(
+            "SELECT name, size, mtime_ns, inode FROM files WHERE dir = ?", (rel_dir,))}
+        subdirs = []
+        upserts = []
+        try:
+            entries = list(os.scandir(abs_dir))
+        except OSError:
+            return subdirs
+
+        for entry in entries:
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(rel)
+                    continue
+                if not entry.is_file() or entry.name.endswith(_SKIP_SUFFIXES):
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            # entry.inode() is the real inode on Windows too, unlike the dirent stat
+            current = (st.st_size, st.st_mtime_ns, entry.inode())
+            previous = known.pop(entry.name, None)
+            if previous == current:
+                continue
+            stats["updated" if previous else "added"] += 1
+            upserts.append((rel, rel_dir, entry.name, *current))
+            if on_change:
+                on_change("modified" if previous else "added", rel)
+
+        self._upsert(conn, upserts)
+        if known:
+            conn.executemany("DELETE FROM files WHERE dir = ? AND name = ?",
+                             [(rel_dir, name) for name in known])
+            stats["removed"] += len(known)
+            if on_change:
+                for name in known:
+                    on_change("removed", f"{rel_dir}/{name}" if rel_dir else name)
+        return subdirs
+
+    def _upsert(self, conn, rows: Iterable[tuple]):
+        # A changed file keeps its row but loses its hash
+        conn.executemany(
+            "INSERT INTO files (path, dir, name, size, mtime_ns, inode, hash) VALUES (?, ?, ?, ?, ?, ?, NULL) "
+            "ON CONFLICT(path) DO UPDATE SET "
+            "hash = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns "
+            "AND inode = excluded.inode THEN hash END, "
+            "size = excluded.size, mtime_ns = excluded.mtime_ns, inode = excluded.inode",
+            rows
+        )
+
+    def note_file(self, path: str, digest: Optional[str] = None) -> bool:
+        """Record (or refresh) a single file without a rescan, e.g. right after receiving it"""
+        rel = self._relative(path)
+        if rel is None or rel.endswith(_SKIP_SUFFIXES):
+            return False
+        self._start()
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return False
+
+        rel_dir, _, name = rel.rpartition("/")
+        conn = self._connect()
+        with conn:
+            self._upsert(conn, [(rel, rel_dir, name, st.st_size, st.st_mtime_ns, st.st_ino)])
+            if digest:
+                conn.execute("UPDATE files SET hash = ? WHERE path = ?", (digest, rel))
+        return True
+
+    def remove(self, path: str):
+        rel = self._relative(path)
+        if rel is not None:
+            self._start()
+            with self._connect() as conn:
+                conn.execute("DELETE FROM files WHERE path = ?", (rel,))
+
+    def hash_pending(self, limit: Optional[int] = None, batch_size: int = 512) -> int:
+        """Compute hashes for files that don't have one yet, return how many were hashed.
+
+        Files are hashed in parallel by the hashing engine, a batch at a time.
+        A digest is only stored if (size, mtime, inode) still match the row,
+        so a file edited while it was being hashed stays unhashed.
+        """
+        self._start()
+        conn = self._connect()
+        done = 0
+        after = ""
+        while limit is None or done < limit:
+            size = batch_size if limit is None else min(batch_size, limit - done)
+            rows = conn.execute(
+                "SELECT path, size, mtime_ns, inode FROM files WHERE hash IS NULL AND path > ? "
+                "ORDER BY path LIMIT ?", (after, size)
+            ).fetchall()
+            if not rows:
+                break
+            after = rows[-1]["path"]
+            results = hasher.hash_many([self.absolute(row["path"]) for row in rows])
+            updates = [(digest, row["path"], row["size"], row["mtime_ns"], row["inode"])
+                       for row, (_, digest) in zip(rows, results) if digest]
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    "UPDATE files SET hash = ? WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                    updates
+                )
+                done += conn.total_changes - before
+        return done
+
+    def digest(self, path: str) -> Optional[str]:
+        """Content hash of a shared file, from the catalog when (size, mtime, inode) still match"""
+        rel = self._relative(path)
+        if rel is None:
+            return hasher.digest(path)
+        self._start()
+        row = self.get(rel)
+        if row and row["hash"] and self._still_matches(row):
+            return row["hash"]
+        self.note_file(path)
+        st = os.stat(path)
+        digest = hasher.digest(path)
+        with self._connect() as conn:
+            conn.execute("UPDATE files SET hash = ? WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                         (digest, rel, st.st_size, st.st_mtime_ns, st.st_ino))
+        return digest
+
+    def start_watching(self, interval: Optional[float] = None):
+        """Rescan in a background thread every `interval` seconds (CATALOG_RESCAN_INTERVAL)"""
+        interval = interval if interval is not None else config.CATALOG_RESCAN_INTERVAL
+        if self._watcher or not interval:
+            return
+
+        def watch_loop():
+            while True:
+                try:
+                    self.rescan()
+                except (OSError, sqlite3.Error) as e:
+                    log.warning(f"⚠️ Catalog rescan failed: {str(e)}")
+                time.sleep(interval)
+
+        self._watcher = threading.Thread(target=watch_loop, daemon=True)
+        self._watcher.start()
+
+    # ======================
+    # LOOKUPS
+    # ======================
+
+    def _still_matches(self, row: Dict[str, Any]) -> bool:
+        try:
+            st = os.stat(self.absolute(row["path"]))
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns, st.st_ino) == (row["size"], row["mtime_ns"], row["inode"])
+
+    def find_hash(self, digest: str) -> Optional[Dict[str, Any]]:
+        """A file with this content hash, checked against the disk before it is returned"""
+        self._start()
+        for row in self._connect().execute("SELECT * FROM files WHERE hash = ?", (digest,)).fetchall():
+            if self._still_matches(row):
+                return dict(row)
+            # Changed since it was hashed, refresh the row so it isn't trusted again
+            self.note_file(self.absolute(row["path"]))
+        return None
+
+    def find_name(self, name: str) -> List[Dict[str, Any]]:
+        """Every catalogued file with this file name"""
+        self._start()
+        return [dict(row) for row in self._connect().execute(
+            "SELECT * FROM files WHERE name = ?", (name,))]
+
+    def get(self, rel: str) -> Optional[Dict[str, Any]]:
+        self._start()
+        row = self._connect().execute("SELECT * FROM files WHERE path = ?", (rel,)).fetchone()
+        return dict(row) if row else None
+
+    def listing(self, rel_dir: str = "", limit: int = 1000, after: str = "",
+                pattern: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Files directly inside rel_dir, ordered by name, keyset-paged with `after`.
+
+        `pattern` is a shell-style name filter such as "*.csv".
+        """
+        self._start()
+        sql = "SELECT * FROM files WHERE dir = ? AND name > ?"
+        params: List[Any] = [rel_dir, after]
+        if pattern:
+            sql += " AND name GLOB ?"
+            params.append(pattern)
+        sql += " ORDER BY name LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def subdirs(self, rel_dir: str = "") -> List[str]:
+        self._start()
+        return [row["path"] for row in self._connect().execute(
+            "SELECT path FROM dirs WHERE parent = ? ORDER BY path", (rel_dir,))]
+
+    def stats(self) -> Dict[str, int]:
+        self._start()
+        row = self._connect().execute(
+            "SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes, COUNT(hash) AS hashed FROM files"
+        ).fetchone()
+        return dict(row)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn:
+            conn.close()
+            self._local.conn = None
+
+# Global shared-folder catalog
+catalog = SharedCatalog()
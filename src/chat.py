@@ -1,39 +1,71 @@
+import logging
 import socket
 import threading
 import json
 import time
+from collections import deque
 from typing import Callable, Optional
 from config import config
-from utils import encrypt_message, decrypt_message, format_timestamp
+from utils import encrypt_message, decrypt_message, format_timestamp, generate_id
 from animation import show_chat_notification
+from history import history
+from metrics import metrics
+from profiling import profiler, NULL_PROFILE
+from eventlog import get_logger, log_event
+
+log = get_logger("chat")
 
 class ChatError(Exception):
     """Custom exception for chat-related errors"""
     pass
 
+MESSAGES_SENT = metrics.counter("p2p_chat_messages_total", "Chat messages", direction="sent")
+MESSAGES_RECEIVED = metrics.counter("p2p_chat_messages_total", "Chat messages", direction="received")
+RECONNECTS = metrics.counter("p2p_chat_reconnects_total", "Chat reconnection attempts that succeeded")
+RETRANSMITS = metrics.counter("p2p_chat_retransmits_total", "Chat messages replayed after reconnect")
+UNACKED = metrics.gauge("p2p_chat_unacked_messages", "Chat messages waiting for an acknowledgement")
+CHAT_LATENCY = metrics.histogram("p2p_chat_latency_seconds",
+                                 "Sender timestamp to delivery (includes clock skew between peers)")
+
 class ChatHandler:
-    def __init__(self, is_server: bool, peer_ip: Optional[str], 
-                 on_message_callback: Callable[[str], None],
+    def __init__(self, is_server: bool, peer_ip: Optional[str],
+                 on_message_callback: Callable[[str, Optional[float]], None],
                  encryption_key: Optional[str] = None):
         self.on_message_callback = on_message_callback
         self.encryption_key = encryption_key
         self.peer_ip = peer_ip
         self.is_server = is_server
         self.connection_established = False
-        self.message_queue = []
         self.conn = None
         self.running = False
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.settimeout(config.SOCKET_TIMEOUT)
+        # Reliable delivery state, kept across reconnects
+        self.session_id = generate_id(12)
+        self.peer_session = None
+        self.send_seq = 0
+        self.recv_seq = 0
+        self.unacked = deque()
+        self.resumed = False
+        self._send_lock = threading.Lock()
+        # Signalled when the peer resumes or acks, for flush()
+        self._delivered = threading.Condition(self._send_lock)
+        # Begun on the listener thread, since cProfile only sees the thread that enables it
+        self.prof = NULL_PROFILE
+        self._listener = None
+
+        self.sock = None
+        self._listening = False
+        if self.is_server:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.settimeout(config.SOCKET_TIMEOUT)
 
         self._setup_connection()
 
         if self.connection_established:
             self.running = True
-            threading.Thread(target=self._listen_loop, daemon=True).start()
-            threading.Thread(target=self._process_queue, daemon=True).start()
+            self._listener = threading.Thread(target=self._listen_loop, daemon=True)
+            self._listener.start()
 
     def _setup_connection(self):
         """Establish chat connection with retry logic"""
@@ -46,7 +78,7 @@ class ChatHandler:
                 else:
                     self._connect_to_server()
 
-                self.connection_established = True
+                self._on_connected()
                 show_chat_notification("💬 Chat connected successfully!")
                 return
 
@@ -58,8 +90,10 @@ class ChatHandler:
         show_chat_notification("💥 Failed to establish chat connection")
 
     def _start_server(self):
-        self.sock.bind(('', config.CHAT_PORT))
-        self.sock.listen(1)
+        if not self._listening:
+            self.sock.bind(('', config.CHAT_PORT))
+            self.sock.listen(1)
+            self._listening = True
         show_chat_notification("👂 Waiting for chat connection...")
         self.conn, addr = self.sock.accept()
         self.peer_ip = addr[0]
@@ -69,78 +103,228 @@ class ChatHandler:
         if not self.peer_ip:
             raise ChatError("No peer IP provided for client mode")
         show_chat_notification(f"🔗 Connecting to chat at {self.peer_ip}...")
-        self.sock.connect((self.peer_ip, config.CHAT_PORT))
-        self.conn = self.sock
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(config.SOCKET_TIMEOUT)
+        try:
+            sock.connect((self.peer_ip, config.CHAT_PORT))
+        except Exception:
+            sock.close()
+            raise
+        self.conn = sock
+
+    def _on_connected(self):
+        """Announce our receive position so the peer replays only what we missed"""
+        with self._send_lock:
+            self.connection_established = True
+            self.resumed = False
+        self._send_control({
+            'type': 'resume',
+            'session': self.session_id,
+            'ack': self.recv_seq,
+            'ack_session': self.peer_session
+        })
+
+    def _reconnect(self) -> bool:
+        """Re-establish a dropped chat connection, keeping unacked messages buffered"""
+        with self._send_lock:
+            self.connection_established = False
+            self.resumed = False
+        self._close_conn()
+        show_chat_notification("🔄 Chat connection lost, reconnecting...")
+
+        for attempt in range(1, config.CHAT_RECONNECT_ATTEMPTS + 1):
+            if not self.running:
+                return False
+            try:
+                if self.is_server:
+                    self._start_server()
+                else:
+                    self._connect_to_server()
+                self._on_connected()
+                RECONNECTS.inc()
+                show_chat_notification("💬 Chat reconnected")
+                return True
+            except (socket.timeout, OSError, ChatError) as e:
+                if not self.running:
+                    # close() shut the socket this attempt was waiting on
+                    return False
+                show_chat_notification(f"⚠️ Reconnect failed: {str(e)} "
+                                       f"(attempt {attempt}/{config.CHAT_RECONNECT_ATTEMPTS})")
+                if not self.is_server and attempt < config.CHAT_RECONNECT_ATTEMPTS:
+                    time.sleep(min(config.RETRY_DELAY * attempt, 30))
+        return False
 
     def _listen_loop(self):
-        buffer = ""
+        self.prof = profiler.begin("chat", self.peer_ip or "server")
+        while self.running:
+            self._read_connection()
+            if not self.running or not self._reconnect():
+                break
+
+        self._handle_disconnect()
+        self.prof.finish(sent=self.send_seq, received=self.recv_seq)
+
+    def _read_connection(self):
+        """Read newline-delimited messages until the current connection fails"""
+        buffer = b""
         while self.running:
             try:
-                data = self.conn.recv(config.BUFFER_SIZE).decode()
+                started = self.prof.mark()
+                data = self.conn.recv(config.BUFFER_SIZE)
+                self.prof.add("recv", started)
                 if not data:
-                    break
+                    return
 
                 buffer += data
+                delivered = False
+
+                # Split on raw bytes so multi-byte characters cut across reads survive
+                started = self.prof.mark()
+                while b"\n" in buffer:
+                    msg, buffer = buffer.split(b"\n", 1)
+                    delivered = self._process_incoming_message(msg.decode()) or delivered
+                self.prof.add("process", started)
 
-                while "\n" in buffer:
-                    msg, buffer = buffer.split("\n", 1)
-                    self._process_incoming_message(msg)
+                # One cumulative ack per read, not one per message
+                if delivered:
+                    self._send_control({'type': 'ack', 'ack': self.recv_seq})
 
             except socket.timeout:
                 continue
             except Exception as e:
-                show_chat_notification(f"⚠️ Chat error: {str(e)}")
-                break
-
-        self._handle_disconnect()
+                if self.running:
+                    show_chat_notification(f"⚠️ Chat error: {str(e)}")
+                return
 
-    def _process_incoming_message(self, raw_msg: str):
+    def _process_incoming_message(self, raw_msg: str) -> bool:
+        """Handle one incoming line, returning True if a data message arrived"""
         try:
             msg_data = json.loads(raw_msg)
+            msg_type = msg_data.get('type', 'msg')
+
+            if msg_type == 'ack':
+                self._handle_ack(msg_data.get('ack', 0))
+                return False
+            if msg_type == 'resume':
+                self._handle_resume(msg_data)
+                return False
+
+            seq = msg_data.get('seq')
+            if seq is not None and seq <= self.recv_seq:
+                # Replayed message we already delivered, just re-ack it
+                return True
+
             text = msg_data.get('text', '')
-            timestamp = msg_data.get('timestamp', '')
+            timestamp = float(msg_data.get('timestamp', ''))
 
             if self.encryption_key:
                 text = decrypt_message(text, self.encryption_key)
 
-            display_msg = f"{format_timestamp(float(timestamp))} Peer: {text}"
-            self._append_chat(display_msg, msg_type="remote")
+            history.append(self.peer_ip, "remote", text, timestamp)
+            # Advanced only once the message is decoded and stored, so one that
+            # fails above is never acked and the peer replays it on resume
+            if seq is not None:
+                if seq > self.recv_seq + 1:
+                    show_chat_notification(f"⚠️ {seq - self.recv_seq - 1} chat message(s) were lost")
+                self.recv_seq = seq
+            MESSAGES_RECEIVED.inc()
+            CHAT_LATENCY.observe(max(0.0, time.time() - timestamp))
+            display_msg = f"{format_timestamp(timestamp)} Peer: {text}"
+            self._append_chat(display_msg, msg_type="remote", timestamp=timestamp)
             show_chat_notification("✉️ New message received")
+            return seq is not None
 
         except json.JSONDecodeError:
             self._append_chat(f"Peer: {raw_msg}", msg_type="remote")
         except Exception as e:
             show_chat_notification(f"⚠️ Failed to process message: {str(e)}")
+        return False
+
+    def _handle_ack(self, ack: int):
+        with self._send_lock:
+            while self.unacked and self.unacked[0][0] <= ack:
+                self.unacked.popleft()
+            UNACKED.set(len(self.unacked))
+            self._delivered.notify_all()
+
+    def _handle_resume(self, msg_data: dict):
+        """Drop what the peer already has and replay the unacked tail in order"""
+        if msg_data.get('session') != self.peer_session:
+            # New peer session, its sequence numbers start over
+            self.peer_session = msg_data.get('session')
+            self.recv_seq = 0
+
+        ack = msg_data.get('ack', 0) if msg_data.get('ack_session') == self.session_id else 0
+
+        with self._send_lock:
+            while self.unacked and self.unacked[0][0] <= ack:
+                self.unacked.popleft()
+            try:
+                for _, line in self.unacked:
+                    self.conn.sendall(line)
+                RETRANSMITS.inc(len(self.unacked))
+                self.resumed = True
+                self._delivered.notify_all()
+            except Exception as e:
+                show_chat_notification(f"⚠️ Failed to replay messages: {str(e)}")
+
+    def flush(self, timeout: float) -> bool:
+        """Wait until the peer has resumed and acked everything sent, True if it did"""
+        deadline = time.monotonic() + timeout
+        with self._delivered:
+            while not (self.resumed and not self.unacked):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    return False
+                self._delivered.wait(remaining)
+            return True
 
     def send(self, msg: str):
         if not msg.strip():
             return
 
-        if not self.connection_established:
-            self.message_queue.append(msg)
-            return
-
-        try:
+        timestamp = time.time()
+        started = self.prof.mark()
+        text = encrypt_message(msg, self.encryption_key) if self.encryption_key else msg
+        self.prof.add("encrypt", started)
+        with self._send_lock:
+            self.send_seq += 1
             msg_data = {
-                'text': encrypt_message(msg, self.encryption_key) if self.encryption_key else msg,
-                'timestamp': time.time(),
+                'type': 'msg',
+                'seq': self.send_seq,
+                'text': text,
+                'timestamp': timestamp,
                 'sender': 'local'
             }
-            formatted_msg = json.dumps(msg_data) + "\n"
-            self.conn.send(formatted_msg.encode())
-            show_chat_notification("📤 Message sent")
-            self._append_chat(f"You: {msg}", msg_type="local")
+            line = (json.dumps(msg_data) + "\n").encode()
 
-        except Exception as e:
-            show_chat_notification(f"⚠️ Failed to send message: {str(e)}")
-            self.message_queue.append(msg)
+            if len(self.unacked) >= config.CHAT_RETRANSMIT_BUFFER:
+                self.unacked.popleft()
+                show_chat_notification("⚠️ Retransmit buffer full, dropping oldest unacked message")
+            self.unacked.append((self.send_seq, line))
+            UNACKED.set(len(self.unacked))
+            MESSAGES_SENT.inc()
 
-    def _process_queue(self):
-        while self.running:
-            if self.connection_established and self.message_queue:
-                msg = self.message_queue.pop(0)
-                self.send(msg)
-            time.sleep(0.5)
+            # Until the peer has resumed, the message waits in the buffer and
+            # goes out with the replay so ordering is preserved
+            if self.connection_established and self.resumed:
+                try:
+                    started = self.prof.mark()
+                    self.conn.sendall(line)
+                    self.prof.add("send", started)
+                    show_chat_notification("📤 Message sent")
+                except Exception as e:
+                    show_chat_notification(f"⚠️ Message queued for resend: {str(e)}")
+
+        history.append(self.peer_ip, "local", msg, timestamp)
+        self._append_chat(f"You: {msg}", msg_type="local", timestamp=timestamp)
+
+    def _send_control(self, msg_data: dict):
+        try:
+            with self._send_lock:
+                self.conn.sendall((json.dumps(msg_data) + "\n").encode())
+        except Exception as e:
+            show_chat_notification(f"⚠️ Failed to send chat control message: {str(e)}")
 
     def _handle_disconnect(self):
         show_chat_notification("🔌 Chat disconnected")
@@ -148,26 +332,42 @@ class ChatHandler:
         self.connection_established = False
         self.close()
 
-    def close(self):
-        self.running = False
+    def _close_conn(self):
+        try:
+            if self.conn:
+                # shutdown() wakes a recv() blocked on another thread, close() alone doesn't
+                self.conn.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
         try:
             if self.conn:
                 self.conn.close()
-            self.sock.close()
+        except Exception:
+            pass
+        self.conn = None
+
+    def close(self):
+        self.running = False
+        with self._delivered:
+            self._delivered.notify_all()
+        try:
+            self._close_conn()
+            if self.sock:
+                try:
+                    # Likewise for a listener thread blocked in accept()
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self.sock.close()
         except Exception as e:
             show_chat_notification(f"⚠️ Error closing chat: {str(e)}")
+        listener = self._listener
+        if self.prof is not NULL_PROFILE and listener and listener is not threading.current_thread():
+            # Let the listener thread write the profile before we return
+            listener.join(timeout=config.SOCKET_TIMEOUT)
 
-    def _append_chat(self, msg: str, msg_type: str = "default"):
-        colors = {
-            "system": ("#27ae60", "#ffffff"),
-            "error": ("#e74c3c", "#ffffff"),
-            "local": ("#3498db", "#ffffff"),
-            "remote": ("#9b59b6", "#ffffff"),
-            "default": ("#2c3e50", "#ffffff")
-        }
-
-        fg, _ = colors.get(msg_type, colors["default"])
-        r, g, b = int(fg[1:3], 16), int(fg[3:5], 16), int(fg[5:], 16)
-        print(f"\033[38;2;{r};{g};{b}m{msg}\033[0m")
+    def _append_chat(self, msg: str, msg_type: str = "default", timestamp: Optional[float] = None):
+        """Show a chat line; `timestamp` is that of its history row, None if it isn't stored"""
+        log_event(log, logging.INFO, msg, style=msg_type, kind=msg_type, peer=self.peer_ip)
         if self.on_message_callback:
-            self.on_message_callback(msg)
+            self.on_message_callback(msg, timestamp)
@@ -0,0 +1,113 @@
+import tkinter as tk
+from tkinter import scrolledtext
+from collections import deque
+from typing import Optional, List, Tuple
+from config import config
+
+class ChatLogView:
+    """Bounded chat log on top of a ScrolledText widget.
+
+    Messages are buffered and inserted once per frame in a single Text.insert
+    call, tags are configured once, and the oldest lines are trimmed beyond
+    CHAT_VIEW_MAX_LINES (they stay available through the chat history store).
+    The view only follows new messages while the user is scrolled to the bottom.
+    """
+
+    def __init__(self, parent, colors: dict, **text_options):
+        self.colors = colors
+        self.max_lines = config.CHAT_VIEW_MAX_LINES
+        self.widget = scrolledtext.ScrolledText(parent, state='disabled', **text_options)
+        self.widget.tag_config('you', foreground=colors['secondary'])
+        self.widget.tag_config('peer', foreground=colors['accent'])
+        self.widget.tag_config('system', foreground=colors['success'])
+
+        # One (timestamp, line_count) per displayed message, oldest first. The
+        # timestamp is that of the message's history row, None for lines that
+        # aren't stored, such as notices and search results
+        self._entries = deque()
+        self._pending = deque()
+        self._flush_scheduled = False
+        # Just past the newest stored message trimmed or dropped from the view
+        self._trimmed_before = None
+
+    @property
+    def history_anchor(self) -> Optional[float]:
+        """Stored messages older than this aren't displayed, None if none have been"""
+        shown = [entry[0] for entry in self._entries if entry[0] is not None]
+        shown += [entry[2] for entry in self._pending if entry[2] is not None]
+        return min(shown) if shown else self._trimmed_before
+
+    def _forget(self, timestamp: Optional[float]):
+        if timestamp is not None:
+            self._trimmed_before = max(self._trimmed_before or 0.0, timestamp + 1e-6)
+
+    def pack(self, **kwargs):
+        self.widget.pack(**kwargs)
+
+    def tag_for(self, msg: str, is_system: bool = False) -> str:
+        if "You:" in msg:
+            return 'you'
+        if "Peer:" in msg:
+            return 'peer'
+        if is_system:
+            return 'system'
+        return ''
+
+    def append(self, msg: str, is_system: bool = False, timestamp: Optional[float] = None):
+        """Queue a message for the next frame; `timestamp` is its history row's, if stored"""
+        if len(self._pending) >= self.max_lines * 2:
+            # Falling behind: drop the oldest unrendered message, history has it
+            self._forget(self._pending.popleft()[2])
+        self._pending.append((msg, self.tag_for(msg, is_system), timestamp))
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.widget.after(max(1, int(1000 / config.UI_FPS)), self._flush)
+
+    def prepend(self, entries: List[Tuple[str, float]]):
+        """Insert older messages (oldest first) above the current view"""
+        if not entries:
+            return
+        args = []
+        for msg, _ in entries:
+            args.extend((msg + '\n', self.tag_for(msg)))
+        self._insert('1.0', args)
+        for msg, timestamp in reversed(entries):
+            self._entries.appendleft((timestamp, msg.count('\n') + 1))
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+
+        at_bottom = self.widget.yview()[1] >= 0.999
+        args = []
+        while self._pending:
+            msg, tag, timestamp = self._pending.popleft()
+            args.extend((msg + '\n', tag))
+            self._entries.append((timestamp, msg.count('\n') + 1))
+        self._insert(tk.END, args)
+
+        # While the user reads older lines, allow some slack so the text
+        # doesn't shift under them
+        self._trim(self.max_lines if at_bottom else self.max_lines * 2)
+        if at_bottom:
+            self.widget.yview(tk.END)
+
+    def _insert(self, index, args):
+        self.widget.configure(state='normal')
+        self.widget.insert(index, *args)
+        self.widget.configure(state='disabled')
+
+    def _trim(self, limit: int):
+        excess = len(self._entries) - limit
+        if excess <= 0:
+            return
+        lines = 0
+        for _ in range(excess):
+            timestamp, count = self._entries.popleft()
+            lines += count
+            self._forget(timestamp)
+        self.widget.configure(state='normal')
+        self.widget.delete('1.0', f'{lines + 1}.0')
+        self.widget.configure(state='disabled')
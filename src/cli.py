@@ -0,0 +1,429 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+from typing import List, Optional, Tuple
+import peer
+import file_transfer
+from config import config, PROFILES, CONFIG_FILE_NAME
+from metrics import metrics
+from catalog import catalog
+from eventlog import event_log
+
+ACTIVE_CONNECTIONS = metrics.gauge("p2p_active_connections", "Open incoming transfer connections")
+
+class JsonLinesEmitter:
+    """Writes one JSON object per line, safe to call from several threads"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, event: str, **fields):
+        record = {"event": event, "time": round(time.time(), 3), **fields}
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+def _receive_callback(emit, peer_addr: str):
+    """Translate receive_loop's string callbacks into JSON events"""
+    def callback(message: str):
+        if os.path.isfile(message):
+            emit("received", peer=peer_addr, path=message, size=os.path.getsize(message))
+        elif message.startswith("✨"):
+            emit("info", peer=peer_addr, message=message[2:])
+        else:
+            emit("warning", peer=peer_addr, message=message)
+    return callback
+
+def _start_chat(emit, is_server: bool, peer_ip: Optional[str]):
+    import chat
+    handler = chat.ChatHandler(
+        is_server=is_server,
+        peer_ip=peer_ip,
+        on_message_callback=lambda msg, timestamp: emit("chat", message=msg)
+    )
+    return handler if handler.connection_established else None
+
+def _watch_config(emit):
+    """Apply config file edits (and SIGHUP on POSIX) while the daemon runs"""
+    def reloaded(ok: bool, message: str):
+        emit("config", ok=ok, message=message, profile=config.PERF_PROFILE or "default")
+
+    config.watch(reloaded)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reloaded(*config.load()))
+
+def cmd_serve(args, emit) -> int:
+    """Accept any number of senders and receive their files until interrupted"""
+    listener = peer.create_listener(config.PORT, backlog=args.backlog)
+    if args.splice:
+        config.override('RECEIVE_SPLICE', True)
+    emit("listening", port=config.PORT, dest=args.dest or str(config.SHARED_FOLDER))
+    _watch_config(emit)
+    catalog.start_watching()
+    browsing = args.browse or config.BROWSE_ENABLED
+    accept_sync = args.accept_sync or config.SYNC_ACCEPT
+    if browsing or accept_sync:
+        from browse import browse_server
+        if accept_sync:
+            from sync import SyncReceiver
+            SyncReceiver(args.dest or str(config.SHARED_FOLDER)).register(browse_server)
+        # Sync alone doesn't let peers list or download the shared folder
+        emit("browsing", port=browse_server.start(sharing=browsing), sharing=browsing)
+
+    if args.chat:
+        threading.Thread(target=_start_chat, args=(emit, True, None), daemon=True).start()
+
+    def handle(conn, addr):
+        file_transfer.receive_loop(conn, callback=_receive_callback(emit, addr[0]), dest_dir=args.dest)
+        conn.close()
+        ACTIVE_CONNECTIONS.dec()
+        emit("disconnected", peer=addr[0], port=addr[1])
+
+    def accept_loop(accept, transport: str):
+        while True:
+            conn, addr = accept()
+            conn.settimeout(None)
+            emit("connected", peer=addr[0], port=addr[1], transport=transport)
+            ACTIVE_CONNECTIONS.inc()
+            threading.Thread(target=handle, args=(conn, addr), daemon=True).start()
+
+    if args.udp:
+        import udp_transport
+        udp_listener = udp_transport.UdpListener(config.UDP_PORT)
+        emit("listening", port=config.UDP_PORT, transport="udp")
+        threading.Thread(target=accept_loop, args=(udp_listener.accept, "udp"), daemon=True).start()
+
+    accept_loop(listener.accept, "tcp")
+
+def cmd_recv(args, emit) -> int:
+    """Accept a single sender and receive its files until it disconnects"""
+    conn = peer.start_server()
+    conn.settimeout(None)
+    peer_addr = conn.getpeername()[0]
+    emit("connected", peer=peer_addr)
+
+    received = []
+    on_event = _receive_callback(emit, peer_addr)
+
+    def callback(message: str):
+        on_event(message)
+        if os.path.isfile(message):
+            received.append(message)
+            if args.count and len(received) >= args.count:
+                # Ends receive_loop the same way a peer disconnect would
+                conn.shutdown(socket.SHUT_RDWR)
+
+    file_transfer.receive_loop(conn, callback=callback, dest_dir=args.dest)
+    conn.close()
+    emit("done", files=len(received))
+    return 0
+
+def cmd_send(args, emit) -> int:
+    """Connect to a peer and send each file, reporting progress as it goes"""
+    missing = [path for path in args.files if not os.path.isfile(path)]
+    if missing:
+        emit("error", message="File(s) not found", files=missing)
+        return 2
+
+    conn = peer.connect_to_peer(args.host, transport=args.transport)
+    if not conn:
+        emit("error", message=f"Could not connect to {args.host}")
+        return 1
+
+    failures = 0
+    handler = None
+    try:
+        if args.message:
+            handler = _start_chat(emit, False, args.host)
+            if handler:
+                # Only queued until the peer resumes; flushed below while the files go out
+                handler.send(args.message)
+
+        for path in args.files:
+            name = os.path.basename(path)
+            emit("start", file=name, size=os.path.getsize(path))
+            success, message = file_transfer.send_file(
+                conn, path,
+                progress_callback=lambda sent, total, name=name: emit(
+                    "progress", file=name, sent=sent, total=total)
+            )
+            emit("sent" if success else "failed", file=name, message=message)
+            if not success:
+                failures += 1
+    finally:
+        conn.close()
+        if handler:
+            if not handler.flush(config.SOCKET_TIMEOUT):
+                emit("warning", peer=args.host, message="Chat message not acknowledged by the peer")
+            handler.close()
+
+    emit("done", files=len(args.files), failed=failures)
+    return 1 if failures else 0
+
+def cmd_ls(args, emit) -> int:
+    """List a peer's shared folder"""
+    from browse import RemoteShare
+    with RemoteShare(args.host) as remote:
+        if args.recursive:
+            count = 0
+            for entry in remote.walk(args.dir, args.pattern):
+                emit("file", **entry)
+                count += 1
+            emit("done", files=count)
+            return 0
+
+        page = remote.list(args.dir, pattern=args.pattern, limit=args.limit, after=args.after)
+        if not page.get("ok"):
+            emit("error", message=page.get("error"))
+            return 1
+        for subdir in page["dirs"]:
+            emit("dir", path=subdir)
+        for entry in page["files"]:
+            emit("file", **entry)
+        emit("done", files=len(page["files"]), next=page["next"])
+    return 0
+
+def cmd_pull(args, emit) -> int:
+    """Fetch files from a peer's shared folder"""
+    from browse import RemoteShare
+    failures = 0
+    with RemoteShare(args.host) as remote:
+        for path in args.paths:
+            emit("start", file=path)
+            success, save_path, message = remote.pull(
+                path, args.dest,
+                progress_callback=lambda done, total, path=path: emit(
+                    "progress", file=path, received=done, total=total)
+            )
+            if success:
+                emit("received", file=path, path=save_path, message=message)
+            else:
+                emit("failed", file=path, message=message)
+                failures += 1
+    emit("done", files=len(args.paths), failed=failures)
+    return 1 if failures else 0
+
+def cmd_sync(args, emit) -> int:
+    """Mirror a folder to peers until interrupted"""
+    from sync import SyncSession
+    if not os.path.isdir(args.folder):
+        emit("error", message=f"Folder not found: {args.folder}")
+        return 2
+    SyncSession(args.folder, args.hosts, watcher=args.watcher, on_event=emit).run()
+    return 0
+
+def cmd_index(args, emit) -> int:
+    """Update the shared-folder catalog and answer lookups against it"""
+    if not args.no_scan:
+        started = time.perf_counter()
+        stats = catalog.rescan(full=args.full)
+        emit("rescanned", seconds=round(time.perf_counter() - started, 3), **stats)
+    if args.hash_files:
+        emit("hashed", files=catalog.hash_pending())
+    for digest in args.has or []:
+        row = catalog.find_hash(digest)
+        emit("lookup", hash=digest, found=bool(row), path=row["path"] if row else None)
+    emit("catalog", **catalog.stats())
+    return 0
+
+def _import_times(statement: str) -> Tuple[dict, dict]:
+    """Import times in microseconds for a statement: (top-level cumulative, per-module self)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    cumulative, own = {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        own[name.strip()] = int(self_us)
+        if not name.startswith("  "):
+            cumulative[name.strip()] = int(cumulative_us)
+    return cumulative, own
+
+def cmd_check_startup(args, emit) -> int:
+    """Fail if importing the entry module costs more than IMPORT_BUDGET_MS"""
+    budget_ms = args.budget or config.IMPORT_BUDGET_MS
+    best = None
+    for _ in range(args.runs):
+        # Interpreter startup imports (site, encodings) are not ours to budget
+        baseline, _ = _import_times("pass")
+        cumulative, own = _import_times(f"import {args.module}")
+        total_ms = sum(us for name, us in cumulative.items() if name not in baseline) / 1000
+        if best is None or total_ms < best[0]:
+            best = (total_ms, own)
+
+    total_ms, own = best
+    slowest = sorted(own.items(), key=lambda item: item[1], reverse=True)[:10]
+    emit("import_time", module=args.module, total_ms=round(total_ms, 2), budget_ms=budget_ms,
+         slowest={name: round(us / 1000, 2) for name, us in slowest})
+    return 0 if total_ms <= budget_ms else 1
+
+def cmd_check_gui(args, emit) -> int:
+    """Import the GUI and build both main-window panels on a hidden root"""
+    try:
+        import gui
+    except ImportError as e:
+        emit("gui_check", ok=False, stage="import", error=str(e))
+        return 1
+    try:
+        root = gui.TkinterDnD.Tk()
+    except gui.tk.TclError as e:
+        # No display: the import is all that can be checked
+        emit("gui_check", ok=True, stage="import", skipped=str(e))
+        return 0
+    root.withdraw()
+    try:
+        app = gui.P2PGUI(root)
+        for build in (app._build_receiver_interface, app._build_sender_interface):
+            build(gui.ttk.Frame(root))
+        root.update()
+    except Exception as e:
+        emit("gui_check", ok=False, stage="build", error=repr(e))
+        return 1
+    finally:
+        root.destroy()
+    emit("gui_check", ok=True, stage="build")
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="p2p-share",
+        description="Headless P2P Share: transfer files without the GUI. "
+                    "Events are printed to stdout as JSON lines, status text goes to stderr."
+    )
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--metrics-dump", type=float, help="write logs/metrics.json every N seconds")
+    parser.add_argument("--profile", choices=["spans", "cprofile", "tracemalloc"],
+                        help="write a per-transfer timing breakdown to logs/profiles")
+    parser.add_argument("--config", help=f"JSON settings file (default: $P2P_CONFIG or ./{CONFIG_FILE_NAME})")
+    parser.add_argument("--perf-profile", choices=sorted(PROFILES),
+                        help="named set of buffer, pipeline and rate settings")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE",
+                        help="override one setting, e.g. --set SEND_RATE_LIMIT=1000000 (repeatable)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="lowest level written to the console and logs/p2p.log")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="run as a daemon accepting files from any number of peers")
+    serve.add_argument("--dest", help="folder for received files (default: shared folder)")
+    serve.add_argument("--chat", action="store_true", help="also accept a chat connection")
+    serve.add_argument("--backlog", type=int, default=16, help="pending connection backlog")
+    serve.add_argument("--browse", action="store_true",
+                       help="let peers list and pull shared files (unauthenticated, anyone on the network)")
+    serve.add_argument("--splice", action="store_true",
+                       help="Linux: splice sized payloads straight from the socket into files")
+    serve.add_argument("--udp", action="store_true",
+                       help="also accept transfers over the UDP transport on UDP_PORT")
+    serve.add_argument("--accept-sync", action="store_true",
+                       help="apply changes (including deletes) pushed by 'sync' peers to the destination folder")
+    serve.set_defaults(func=cmd_serve)
+
+    recv = sub.add_parser("recv", help="receive files from a single peer, then exit")
+    recv.add_argument("--dest", help="folder for received files (default: shared folder)")
+    recv.add_argument("--count", type=int, default=0, help="exit after this many files")
+    recv.set_defaults(func=cmd_recv)
+
+    send = sub.add_parser("send", help="send files to a peer")
+    send.add_argument("host", help="peer IP address")
+    send.add_argument("files", nargs="+", help="files to send")
+    send.add_argument("--message", help="chat message to send before the files")
+    send.add_argument("--transport", choices=["tcp", "udp"],
+                      help="connection type (default: TRANSPORT setting); udp suits lossy, high-latency links")
+    send.set_defaults(func=cmd_send)
+
+    ls = sub.add_parser("ls", help="list a peer's shared folder")
+    ls.add_argument("host", help="peer IP address")
+    ls.add_argument("dir", nargs="?", default="", help="folder inside the share (default: top level)")
+    ls.add_argument("--pattern", help='file name filter, e.g. "*.csv"')
+    ls.add_argument("--recursive", "-r", action="store_true", help="list every file below dir")
+    ls.add_argument("--limit", type=int, default=500, help="page size")
+    ls.add_argument("--after", default="", help="continue from the 'next' cursor of a previous page")
+    ls.set_defaults(func=cmd_ls)
+
+    pull = sub.add_parser("pull", help="download files from a peer's shared folder")
+    pull.add_argument("host", help="peer IP address")
+    pull.add_argument("paths", nargs="+", help="paths as shown by ls")
+    pull.add_argument("--dest", help="folder for downloaded files (default: shared folder)")
+    pull.set_defaults(func=cmd_pull)
+
+    sync = sub.add_parser("sync", help="watch a folder and mirror its changes to peers")
+    sync.add_argument("folder", help="folder to watch")
+    sync.add_argument("hosts", nargs="+", help="peer IP addresses (peers run 'serve --accept-sync')")
+    sync.add_argument("--watcher", choices=["auto", "inotify", "poll"], help="change detection (default: SYNC_WATCHER)")
+    sync.set_defaults(func=cmd_sync)
+
+    index = sub.add_parser("index", help="rescan the shared-folder catalog")
+    index.add_argument("--full", action="store_true", help="list every directory, not only changed ones")
+    index.add_argument("--hash", dest="hash_files", action="store_true", help="hash files that have no hash yet")
+    index.add_argument("--has", action="append", metavar="DIGEST",
+                       help="check whether a file with this digest is shared (tree-sha256:... for files of 256 MB or more)")
+    index.add_argument("--no-scan", action="store_true", help="only answer lookups")
+    index.set_defaults(func=cmd_index)
+
+    check = sub.add_parser("check-startup", help="check import time (-X importtime) against the budget")
+    check.add_argument("--module", default="cli", help="module to import (default: cli)")
+    check.add_argument("--budget", type=float, help="budget in ms (default: IMPORT_BUDGET_MS)")
+    check.add_argument("--runs", type=int, default=5, help="best of this many runs is reported")
+    check.set_defaults(func=cmd_check_startup)
+
+    check_gui = sub.add_parser("check-gui", help="import the GUI and build its panels without showing a window")
+    check_gui.set_defaults(func=cmd_check_gui)
+
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    for setting in args.set or []:
+        key, _, value = setting.partition("=")
+        config.override(key.strip().upper(), value)
+    if args.perf_profile:
+        config.override('PERF_PROFILE', args.perf_profile)
+    ok, message = config.load(args.config)
+    if not ok:
+        print(message, file=sys.stderr)
+        return 2
+    ok, message = config.ensure_directories()
+    if not ok:
+        print(message, file=sys.stderr)
+        return 1
+    if getattr(args, "dest", None):
+        os.makedirs(args.dest, exist_ok=True)
+    if args.metrics_port:
+        config.override('METRICS_PORT', args.metrics_port)
+    if args.metrics_dump:
+        config.override('METRICS_DUMP_INTERVAL', args.metrics_dump)
+    metrics.start_from_config()
+    if args.profile:
+        config.override('PROFILE', args.profile)
+    if args.log_level:
+        config.override('LOG_LEVEL', args.log_level)
+        event_log.set_level(args.log_level)
+
+    # Keep stdout machine-readable: library status prints go to stderr
+    emit = JsonLinesEmitter(sys.stdout)
+    with redirect_stdout(sys.stderr):
+        try:
+            return args.func(args, emit)
+        except KeyboardInterrupt:
+            emit("stopped")
+            return 0
+        except peer.PeerConnectionError as e:
+            emit("error", message=str(e))
+            return 1
+        finally:
+            # Status lines still queued must reach stderr, not the JSON stream
+            event_log.flush()
+
+if __name__ == "__main__":
+    sys.exit(main())
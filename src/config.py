@@ -1,52 +1,336 @@
+import json
 import os
 import sys
-from typing import Dict, Any
+import threading
+import time
+from typing import Dict, Any, Tuple, Optional, Callable, List
 from pathlib import Path
 
 DEFAULT_CONFIG: Dict[str, Any] = {
     'PORT': 5001,
     'CHAT_PORT': 5002,
+    'BROWSE_PORT': 5003,  # list/pull requests against the shared folder
+    'UDP_PORT': 5004,  # file transfers over the UDP transport
     'BUFFER_SIZE': 16384,  # 16KB chunks
     'SOCKET_TIMEOUT': 30,
     'MAX_RETRIES': 3,
     'RETRY_DELAY': 2,
     'LOG_LEVEL': 'INFO',
+    'LOG_TO_FILE': True,  # JSON lines in LOG_DIR/p2p.log, written by a background thread
+    'LOG_FILE_MAX_BYTES': 10 * 1024 * 1024,  # rotate the log file at this size
+    'LOG_FILE_BACKUPS': 5,  # rotated log files kept
+    'LOG_QUEUE_SIZE': 10000,  # records waiting for the log thread before new ones are dropped
+    'CONSOLE_RATE_LIMIT': 20,  # console lines per second, 0 for no limit (errors always show)
+    'CONSOLE_BURST': 50,  # console lines allowed back to back before the limit applies
+    'HISTORY_PAGE_SIZE': 100,  # chat messages loaded per history page
+    'CHAT_RETRANSMIT_BUFFER': 1000,  # unacked chat messages kept for replay
+    'CHAT_RECONNECT_ATTEMPTS': 10,
+    'UI_FPS': 30,  # GUI refresh rate for worker thread updates
+    'CHAT_VIEW_MAX_LINES': 2000,  # older lines are trimmed, history keeps them
+    'ANIMATION_FPS': 30,
+    'MAX_POPUPS': 3,  # notification popups shown at once
+    'ANIMATION_BACKLOG_LIMIT': 10,  # queued popups beyond this are dropped
+    'IMPORT_BUDGET_MS': 150,  # startup import time allowed for the CLI
+    'METRICS_PORT': 0,  # local Prometheus endpoint, 0 disables it
+    'METRICS_DUMP_INTERVAL': 0,  # seconds between logs/metrics.json dumps, 0 disables
+    'PROFILE': '',  # '', 'spans', 'cprofile' or 'tracemalloc'
+    'PROGRESS_INTERVAL': 0.1,  # seconds between progress callbacks
+    'SEND_RATE_LIMIT': 0,  # bytes per second per outgoing file, 0 for no limit; applies mid-transfer on reload
+    'PERF_PROFILE': '',  # named set of tuning values, see PROFILES
+    'CONFIG_RELOAD_INTERVAL': 2,  # seconds between checks of the config file for changes, 0 disables
+    'MMAP_THRESHOLD': 16 * 1024 * 1024,  # files this large are memory-mapped, 0 disables
+    'MMAP_CHUNK_SIZE': 1024 * 1024,  # bytes handed to one socket call on the mmap path
+    'PIPELINE_THRESHOLD': 1024 * 1024,  # files this large read ahead / write behind on a second thread
+    'PIPELINE_BUFFER_SIZE': 256 * 1024,  # size of each pooled read-ahead / write-behind buffer
+    'READ_AHEAD_DEPTH': 4,  # buffers read ahead of the socket on send, 0 disables
+    'WRITE_BEHIND_DEPTH': 8,  # received buffers queued for the disk writer, 0 disables
+    'FSYNC_BYTES': 0,  # fsync received files every N bytes and at the end, 0 leaves it to the OS
+    'SPARSE_TRANSFER': True,  # send only the data regions of files with holes (VM images, databases)
+    'SPARSE_MIN_HOLE': 64 * 1024,  # holes smaller than this are sent as zeros
+    'SPARSE_MAX_EXTENTS': 16384,  # files more fragmented than this are sent whole
+    'RECEIVE_SPLICE': False,  # Linux: splice sized payloads from the socket into the file
+    'SPLICE_CHUNK_SIZE': 1024 * 1024,  # pipe size and bytes moved per splice call
+    'CATALOG_RESCAN_INTERVAL': 60,  # seconds between shared-folder rescans, 0 disables
+    'BROWSE_ENABLED': False,  # let peers list and pull from the shared folder, without authentication
+    'MAX_FRAME_SIZE': 1024 * 1024,  # largest control frame accepted from a peer
+    'CAPABILITY_HELLO': True,  # negotiate features with the receiver before the first file
+    'HELLO_TIMEOUT': 2.0,  # seconds to wait for a hello reply before assuming a legacy peer
+    'SYNC_WATCHER': 'auto',  # 'auto' (inotify if available), 'inotify' or 'poll'
+    'SYNC_POLL_INTERVAL': 2,  # seconds between rescans for the polling watcher
+    'SYNC_DEBOUNCE': 0.5,  # quiet time before a batch of changes is sent
+    'SYNC_MAX_DELAY': 5,  # longest a change waits while the folder keeps changing
+    'SYNC_BLOCK_SIZE': 64 * 1024,  # delta sync compares files in blocks of this size
+    'SYNC_RETRY_INTERVAL': 10,  # seconds between attempts to resend changes a peer missed
+    'SYNC_ACCEPT': False,  # apply changes pushed by syncing peers to the shared folder
+    'TRANSPORT': 'tcp',  # 'tcp', or 'udp' for lossy / high-latency links
+    'UDP_PAYLOAD_SIZE': 1400,  # file bytes per datagram, keep under the path MTU
+    'UDP_INITIAL_WINDOW': 16,  # packets in flight before the first RTT sample
+    'UDP_MAX_WINDOW': 16384,  # congestion window cap in packets
+    'UDP_RECV_WINDOW': 4096,  # packets the receiver buffers before the app reads them
+    'UDP_SEND_BUFFER': 8 * 1024 * 1024,  # bytes queued or in flight before sendall blocks
+    'UDP_SOCKET_BUFFER': 4 * 1024 * 1024,  # kernel SO_RCVBUF/SO_SNDBUF request
+    'UDP_ACK_DELAY': 0.005,  # longest a lone in-order packet waits for its ACK
+    'UDP_MIN_RTO': 0.2,  # floor for the retransmission timeout, seconds
+    'UDP_MIN_RTT_WINDOW': 10,  # seconds the base (minimum) RTT is remembered
+    'UDP_PACING_GAIN': 1.25,  # send rate as a multiple of cwnd per RTT
+    'UDP_PACING_BURST': 8,  # packets sent back to back at most
+    'UDP_VEGAS_ALPHA': 4,  # grow the window while fewer packets than this are queued
+    'UDP_VEGAS_BETA': 12,  # shrink it when more than this are queued
+    'UDP_LOSS_BACKOFF': 0.7,  # window multiplier after a congestion loss
+    'UDP_RANDOM_LOSS': 0.1,  # per-round loss rate still treated as link noise
+    'UDP_FEC_GROUP': 0,  # data packets per XOR parity packet, 0 disables FEC
+    'UDP_MAX_CONNECTIONS': 64,  # open UDP transport connections a listener allows
+    'UDP_MAX_PENDING': 16,  # connections waiting to be accepted before new SYNs are refused
+    'THUMBNAIL_SIZE': 128,  # longest side of received-image previews, pixels
+    'THUMBNAIL_WORKERS': 2,  # threads decoding images for previews
+    'THUMBNAIL_CACHE_BYTES': 64 * 1024 * 1024,  # disk cache for previews, least recently used evicted
+    'HASH_WORKERS': 0,  # hashing threads, 0 uses one per CPU
+    'HASH_READ_SIZE': 1024 * 1024,  # bytes per read while hashing
 }
 
+# Built-in values, before any profile, file, environment or CLI layer
+BUILTIN_CONFIG: Dict[str, Any] = dict(DEFAULT_CONFIG)
+
+# Tuning values that go together. A profile sits above the built-in
+# defaults and below the config file, environment and command line, so any
+# of those can still override one of its values.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # Fast, clean local network: big buffers, deep pipelines, zero-copy receive
+    'lan-bulk': {
+        'BUFFER_SIZE': 256 * 1024,
+        'PIPELINE_BUFFER_SIZE': 1024 * 1024,
+        'READ_AHEAD_DEPTH': 8,
+        'WRITE_BEHIND_DEPTH': 16,
+        'MMAP_CHUNK_SIZE': 4 * 1024 * 1024,
+        'SPLICE_CHUNK_SIZE': 4 * 1024 * 1024,
+        'RECEIVE_SPLICE': True,
+        'HASH_READ_SIZE': 4 * 1024 * 1024,
+        'SEND_RATE_LIMIT': 0,
+    },
+    # Long, lossy links: patient timeouts, large UDP windows with FEC
+    'wan': {
+        'BUFFER_SIZE': 64 * 1024,
+        'SOCKET_TIMEOUT': 60,
+        'HELLO_TIMEOUT': 8.0,
+        'PROGRESS_INTERVAL': 0.5,
+        'UDP_MAX_WINDOW': 32768,
+        'UDP_SEND_BUFFER': 32 * 1024 * 1024,
+        'UDP_RECV_WINDOW': 8192,
+        'UDP_FEC_GROUP': 16,
+    },
+    # Small machines: few, small buffers and one hashing thread
+    'low-memory': {
+        'BUFFER_SIZE': 16 * 1024,
+        'PIPELINE_BUFFER_SIZE': 64 * 1024,
+        'READ_AHEAD_DEPTH': 1,
+        'WRITE_BEHIND_DEPTH': 2,
+        'MMAP_THRESHOLD': 0,
+        'HASH_WORKERS': 1,
+        'HASH_READ_SIZE': 256 * 1024,
+        'UDP_SEND_BUFFER': 1024 * 1024,
+        'UDP_RECV_WINDOW': 512,
+        'CHAT_RETRANSMIT_BUFFER': 200,
+        'CHAT_VIEW_MAX_LINES': 500,
+        'LOG_QUEUE_SIZE': 1000,
+        'THUMBNAIL_WORKERS': 1,
+        'THUMBNAIL_CACHE_BYTES': 16 * 1024 * 1024,
+    },
+    # Thousands of small files: no per-file threads or mappings, quiet console
+    'many-small-files': {
+        'BUFFER_SIZE': 64 * 1024,
+        'PIPELINE_THRESHOLD': 8 * 1024 * 1024,
+        'MMAP_THRESHOLD': 64 * 1024 * 1024,
+        'PROGRESS_INTERVAL': 0.5,
+        'CONSOLE_RATE_LIMIT': 5,
+    },
+}
+
+# Only read when a process starts, a reload can't move them
+RESTART_KEYS = ('PORT', 'CHAT_PORT', 'BROWSE_PORT', 'UDP_PORT', 'LOG_QUEUE_SIZE', 'LOG_TO_FILE')
+
+ENV_PREFIX = "P2P_"
+CONFIG_FILE_NAME = "p2p_config.json"
+
+def _coerce(key: str, value: Any) -> Any:
+    """Convert an environment string (or JSON value) to the type of the built-in default"""
+    default = BUILTIN_CONFIG[key]
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            if value.lower() in ('1', 'true', 'yes', 'on'):
+                return True
+            if value.lower() in ('0', 'false', 'no', 'off', ''):
+                return False
+            raise ValueError(f"{key} expects true or false, got {value!r}")
+        return bool(value)
+    if isinstance(default, int) and not isinstance(value, bool):
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return int(value) if isinstance(value, (int, str)) else value
+    if isinstance(default, float) and isinstance(value, (int, str)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
 class AppConfig:
     def __init__(self):
         self._validate_ports()
         self._setup_paths()
+        self._overrides: Dict[str, Any] = {}
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self.config_path: Optional[str] = None
+        self._config_mtime = None
         
     def _validate_ports(self):
         # Validate the ports to be within the acceptable range
-        for port in [DEFAULT_CONFIG['PORT'], DEFAULT_CONFIG['CHAT_PORT']]:
+        for port in [DEFAULT_CONFIG['PORT'], DEFAULT_CONFIG['CHAT_PORT'], DEFAULT_CONFIG['BROWSE_PORT'],
+                     DEFAULT_CONFIG['UDP_PORT']]:
             if not 1024 <= port <= 65535:
                 print(f"❌ Invalid port number: {port}. Must be between 1024-65535")
                 sys.exit(1)
                 
     def _setup_paths(self):
-        # Set up the base and log directories, creating them if necessary
+        # Only compute the paths here, importing config must not touch the disk
         self.BASE_DIR = Path(os.getcwd())
         self.SHARED_FOLDER = self.BASE_DIR / "shared_files"
-        self._ensure_directory(self.SHARED_FOLDER)
         self.LOG_DIR = self.BASE_DIR / "logs"
-        self._ensure_directory(self.LOG_DIR)
-        
-    def _ensure_directory(self, path: Path):
-        # Ensure the directory exists and has the necessary permissions
-        try:
-            path.mkdir(exist_ok=True, parents=True)
-            # Test if we can write to the directory
-            test_file = path / '.permission_test'
-            test_file.touch()
-            test_file.unlink()
-        except PermissionError:
-            print(f"❌ Permission denied for directory: {path}")
-            sys.exit(1)
-        except Exception as e:
-            print(f"❌ Failed to setup directory {path}: {str(e)}")
-            sys.exit(1)
+        self.HISTORY_DIR = self.BASE_DIR / "history"
+        self.CACHE_DIR = self.BASE_DIR / "cache"  # created on first use, safe to delete
+        self._directories_ready = False
+
+    def ensure_directories(self) -> Tuple[bool, str]:
+        """Create the app directories and check they are writable, once per process"""
+        if self._directories_ready:
+            return True, f"✔️ Environment ready (Shared folder: {self.SHARED_FOLDER})"
+
+        for path in (self.SHARED_FOLDER, self.LOG_DIR, self.HISTORY_DIR):
+            try:
+                path.mkdir(exist_ok=True, parents=True)
+            except PermissionError:
+                return False, f"❌ Permission denied for directory: {path}"
+            except Exception as e:
+                return False, f"❌ Failed to setup directory {path}: {str(e)}"
+            if not os.access(path, os.W_OK | os.X_OK):
+                return False, f"❌ Permission denied for directory: {path}"
+
+        self._directories_ready = True
+        return True, f"✔️ Environment ready (Shared folder: {self.SHARED_FOLDER})"
+
+    # ======================
+    # LAYERED LOADING
+    # ======================
+
+    def _read_file(self, path: Optional[str]) -> Dict[str, Any]:
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            values = json.load(f)
+        if not isinstance(values, dict):
+            raise ValueError(f"{path} must hold a JSON object")
+        return values
+
+    def _layers(self, environ) -> List[Tuple[str, Dict[str, Any]]]:
+        """Config file, environment and command-line values, lowest priority first"""
+        file_values = self._read_file(self.config_path)
+        env_values = {key[len(ENV_PREFIX):]: value for key, value in environ.items()
+                      if key.startswith(ENV_PREFIX) and key[len(ENV_PREFIX):] in BUILTIN_CONFIG}
+        return [(self.config_path or "config file", file_values), ("environment", env_values),
+                ("command line", self._overrides)]
+
+    def resolve(self, environ=None) -> Dict[str, Any]:
+        """Merge defaults, profile, file, environment and CLI values.
+
+        Raises ValueError naming the layer and key that is wrong.
+        """
+        layers = self._layers(os.environ if environ is None else environ)
+        merged = dict(BUILTIN_CONFIG)
+        explicit: Dict[str, Any] = {}
+        for source, values in layers:
+            for key, value in values.items():
+                if key not in BUILTIN_CONFIG:
+                    raise ValueError(f"Unknown setting {key} in {source}")
+                try:
+                    explicit[key] = _coerce(key, value)
+                except ValueError as e:
+                    raise ValueError(f"Bad value for {key} in {source}: {str(e)}") from e
+
+        profile = explicit.get('PERF_PROFILE', BUILTIN_CONFIG['PERF_PROFILE'])
+        if profile:
+            if profile not in PROFILES:
+                raise ValueError(f"Unknown performance profile '{profile}' "
+                                 f"(choose from {', '.join(sorted(PROFILES))})")
+            merged.update(PROFILES[profile])
+        merged.update(explicit)
+        return merged
+
+    def load(self, path: Optional[str] = None, environ=None) -> Tuple[bool, str]:
+        """(Re)load every layer and apply it if it validates.
+
+        The config file is `path`, else $P2P_CONFIG, else p2p_config.json in
+        the working directory. On any error the running values stay as they
+        were.
+        """
+        from utils import validate_config
+
+        with self._load_lock:
+            environ = os.environ if environ is None else environ
+            self.config_path = path or self.config_path or environ.get("P2P_CONFIG") or \
+                str(self.BASE_DIR / CONFIG_FILE_NAME)
+            try:
+                self._config_mtime = os.path.getmtime(self.config_path) if os.path.exists(self.config_path) else None
+                merged = self.resolve(environ)
+            except (OSError, ValueError) as e:
+                return False, f"❌ Config not loaded: {str(e)}"
+            valid, message = validate_config(merged)
+            if not valid:
+                return False, f"❌ Config not loaded: {message}"
+
+            changed = {key: value for key, value in merged.items() if DEFAULT_CONFIG.get(key) != value}
+            # Update in place, readers never see a key missing
+            DEFAULT_CONFIG.update(merged)
+
+        for listener in list(self._listeners):
+            listener(changed)
+        restart = [key for key in changed if key in RESTART_KEYS]
+        profile = merged['PERF_PROFILE'] or "default"
+        if restart:
+            return True, f"✔️ Config loaded ({profile} profile), restart to apply: {', '.join(restart)}"
+        return True, f"✔️ Config loaded ({profile} profile, {len(changed)} setting(s) changed)"
+
+    def override(self, key: str, value: Any):
+        """Set a value from the command line; it survives reloads"""
+        self._overrides[key] = value
+        DEFAULT_CONFIG[key] = value
+
+    def on_reload(self, callback: Callable[[Dict[str, Any]], None]):
+        """Call `callback(changed)` after every successful load"""
+        self._listeners.append(callback)
+
+    def watch(self, callback: Optional[Callable[[bool, str], None]] = None,
+              interval: Optional[float] = None):
+        """Reload whenever the config file changes, checking every CONFIG_RELOAD_INTERVAL seconds.
+
+        Settings are read where they are used, so running transfers pick up
+        new limits on their next chunk.
+        """
+        interval = interval if interval is not None else self.CONFIG_RELOAD_INTERVAL
+        if self._watcher or not interval:
+            return
+
+        def watch_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    mtime = os.path.getmtime(self.config_path) if self.config_path else None
+                except OSError:
+                    mtime = None
+                if mtime != self._config_mtime:
+                    result = self.load()
+                    if callback:
+                        callback(*result)
+
+        self._watcher = threading.Thread(target=watch_loop, daemon=True)
+        self._watcher.start()
 
     def __getattr__(self, name):
         # Return the configuration setting or raise an error if not found
@@ -57,11 +341,15 @@ class AppConfig:
 # Create the global config instance
 config = AppConfig()
 
-# Legacy access for configuration settings
-PORT = config.PORT
-CHAT_PORT = config.CHAT_PORT
-BUFFER_SIZE = config.BUFFER_SIZE
-SHARED_FOLDER = str(config.SHARED_FOLDER)
+# Legacy access for configuration settings, read on access so reloads apply
+_LEGACY_NAMES = ('PORT', 'CHAT_PORT', 'BUFFER_SIZE')
+
+def __getattr__(name):
+    if name in _LEGACY_NAMES:
+        return DEFAULT_CONFIG[name]
+    if name == 'SHARED_FOLDER':
+        return str(config.SHARED_FOLDER)
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
 
 # ======================
 # THEME CONFIGURATION
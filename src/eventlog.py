@@ -0,0 +1,205 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Optional, Any
+from config import config
+from metrics import metrics
+
+# Callers only put records on a queue. A single listener thread formats
+# them, writes rotating JSON lines to LOG_DIR/p2p.log and prints to the
+# console, so slow terminals and disks never stall a transfer or chat.
+ROOT_NAME = "p2p"
+
+DROPPED = metrics.counter("p2p_log_dropped_total", "Log records dropped because the log queue was full")
+SUPPRESSED = metrics.counter("p2p_log_console_suppressed_total", "Console lines held back by the rate limit")
+
+# ANSI codes worked out once, keyed by the style callers pass
+STYLES = {
+    "info": "\033[1;34m",
+    "success": "\033[1;32m",
+    "warning": "\033[1;33m",
+    "error": "\033[1;31m",
+    "system": "\033[38;2;39;174;96m",
+    "local": "\033[38;2;52;152;219m",
+    "remote": "\033[38;2;155;89;182m",
+    "default": "\033[38;2;44;62;80m",
+}
+_LEVEL_STYLES = {logging.DEBUG: "default", logging.INFO: "info", logging.WARNING: "warning",
+                 logging.ERROR: "error", logging.CRITICAL: "error"}
+_RESET = "\033[0m"
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any `fields` passed in extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ConsoleHandler(logging.Handler):
+    """Colored console lines, limited to `rate` per second with bursts of `burst`.
+
+    Errors always get through. Lines over the limit are counted and
+    reported in one summary line once the limit allows it again. The
+    stream is looked up on each write so redirect_stdout still applies.
+    """
+
+    def __init__(self, rate: float, burst: int, stream=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.stream = stream
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._suppressed = 0
+
+    def _allow(self, record: logging.LogRecord) -> bool:
+        if not self.rate or record.levelno >= logging.ERROR:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        if not self._allow(record):
+            self._suppressed += 1
+            SUPPRESSED.inc()
+            return
+        stream = self.stream or sys.stdout
+        try:
+            if self._suppressed:
+                stream.write(f"{STYLES['warning']}… {self._suppressed} console message(s) suppressed{_RESET}\n")
+                self._suppressed = 0
+            style = getattr(record, "style", None) or _LEVEL_STYLES.get(record.levelno, "default")
+            stream.write(f"{STYLES.get(style, STYLES['default'])}{record.getMessage()}{_RESET}\n")
+            stream.flush()
+        except Exception:
+            self.handleError(record)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records untouched and never blocks.
+
+    The stock handler formats each record on the caller's thread before
+    queueing it; here the listener does all formatting. A full queue drops
+    the record instead of waiting.
+    """
+
+    def __init__(self, log_queue: queue.Queue, owner: "EventLog"):
+        super().__init__(log_queue)
+        self.owner = owner
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self.owner.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+class EventLog:
+    """The logging pipeline behind every logger under "p2p".
+
+    Nothing touches the disk or starts a thread until the first record is
+    logged, so importing a module that logs stays cheap.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        self.log_path: Optional[str] = None
+        self.root = logging.getLogger(ROOT_NAME)
+        self.root.propagate = False
+        self.root.handlers[:] = [_QueueHandler(self._queue, self)]
+        self.set_level(config.LOG_LEVEL)
+        self._console: Optional[ConsoleHandler] = None
+        config.on_reload(self._reloaded)
+
+    def _handlers(self):
+        handlers = []
+        if config.LOG_TO_FILE:
+            try:
+                os.makedirs(str(config.LOG_DIR), exist_ok=True)
+                self.log_path = os.path.join(str(config.LOG_DIR), "p2p.log")
+                file_handler = logging.handlers.RotatingFileHandler(
+                    self.log_path, maxBytes=config.LOG_FILE_MAX_BYTES,
+                    backupCount=config.LOG_FILE_BACKUPS, encoding="utf-8", delay=True
+                )
+                file_handler.setFormatter(JsonFormatter())
+                handlers.append(file_handler)
+            except OSError as e:
+                self.log_path = None
+                sys.stderr.write(f"⚠️ File logging disabled: {str(e)}\n")
+        self._console = ConsoleHandler(config.CONSOLE_RATE_LIMIT, config.CONSOLE_BURST)
+        handlers.append(self._console)
+        return handlers
+
+    def start(self):
+        """Start the background writer if it isn't running yet"""
+        if self._listener:
+            return
+        with self._lock:
+            if self._listener:
+                return
+            listener = logging.handlers.QueueListener(self._queue, *self._handlers(), respect_handler_level=True)
+            listener.start()
+            self._listener = listener
+            atexit.register(self.stop)
+
+    def set_level(self, level: str):
+        """Levels are checked on the logger, so filtered calls never build a record"""
+        self.root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+
+    def _reloaded(self, changed):
+        if 'LOG_LEVEL' in changed:
+            self.set_level(config.LOG_LEVEL)
+        if self._console:
+            self._console.rate = config.CONSOLE_RATE_LIMIT
+            self._console.burst = max(1, config.CONSOLE_BURST)
+
+    def flush(self):
+        """Wait until every record queued so far has been written"""
+        if self._listener:
+            self._queue.join()
+
+    def stop(self):
+        with self._lock:
+            if self._listener:
+                self._listener.stop()
+                for handler in self._listener.handlers:
+                    handler.close()
+                self._listener = None
+
+# Global logging pipeline
+event_log = EventLog()
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for one module, e.g. get_logger("peer")"""
+    return event_log.root.getChild(name)
+
+def log_event(logger: logging.Logger, level: int, message: str, style: Optional[str] = None,
+              **fields: Any):
+    """Log `message` with a console style and structured fields for the JSON file"""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"style": style, "fields": fields})
@@ -1,11 +1,335 @@
+import errno
 import os
+import socket
 import time
-from typing import Optional, Tuple
+import weakref
+from contextlib import closing
+from typing import Optional, Tuple, Dict, Any
 from config import config
+from capabilities import HELLO_MAGIC, PROTOCOL_VERSION, local_capabilities, agree
+from fileio import (MappedSource, MappedSink, ReadAhead, WriteBehind, advise, preallocate, data_extents,
+                    splice_supported, open_pipe, splice_in, splice_out, SPLICE_UNSUPPORTED)
 from utils import format_bytes, calculate_speed, safe_filename
+from metrics import metrics, THROUGHPUT_BUCKETS
+from profiling import profiler, NULL_PROFILE
+from catalog import catalog
+from protocol import encode_frame, recv_exact, recv_frame, recv_frame_after, tune_socket, ProtocolError
+
+EOF_MARKER = b"<EOF>"
+
+# Bytes read past the end of one file on a connection (the start of the next
+# filename), handed to the next receive_file call on that connection
+_leftover = weakref.WeakKeyDictionary()
+
+# Capabilities agreed on each connection by the hello exchange, {} for a
+# legacy peer
+_peer_caps = weakref.WeakKeyDictionary()
+
+# Addresses that didn't answer a hello, so later connections skip the wait
+_legacy_peers = set()
+
+# Hello replies held back to go out with the ACK of the header that came
+# with the hello
+_pending_reply = weakref.WeakKeyDictionary()
+
+BYTES_SENT = metrics.counter("p2p_bytes_sent_total", "File payload bytes sent")
+BYTES_RECEIVED = metrics.counter("p2p_bytes_received_total", "File payload bytes received")
+FILES_SENT = metrics.counter("p2p_files_total", "Completed file transfers", direction="sent")
+FILES_RECEIVED = metrics.counter("p2p_files_total", "Completed file transfers", direction="received")
+SEND_FAILURES = metrics.counter("p2p_transfer_failures_total", "Failed file transfers", direction="sent")
+RECEIVE_FAILURES = metrics.counter("p2p_transfer_failures_total", "Failed file transfers", direction="received")
+SEND_SYSCALL = metrics.histogram("p2p_chunk_syscall_seconds", "Time spent in one socket call per chunk", op="send")
+RECV_SYSCALL = metrics.histogram("p2p_chunk_syscall_seconds", "Time spent in one socket call per chunk", op="recv")
+SEND_THROUGHPUT = metrics.histogram("p2p_transfer_throughput_mb_s", "Per-transfer throughput",
+                                    buckets=THROUGHPUT_BUCKETS, direction="sent")
+RECEIVE_THROUGHPUT = metrics.histogram("p2p_transfer_throughput_mb_s", "Per-transfer throughput",
+                                       buckets=THROUGHPUT_BUCKETS, direction="received")
+SPARSE_SKIPPED = metrics.counter("p2p_sparse_bytes_skipped_total", "Hole bytes not sent or written thanks to sparse transfer")
+NEGOTIATED = metrics.counter("p2p_hello_total", "Transfer connections by handshake outcome", result="negotiated")
+LEGACY = metrics.counter("p2p_hello_total", "Transfer connections by handshake outcome", result="legacy")
+
+# ==============================================
+# Capability negotiation
+# ==============================================
+
+def _peer_host(conn) -> str:
+    try:
+        address = conn.getpeername()
+    except OSError:
+        address = None
+    if isinstance(address, tuple):
+        return str(address[0])
+    # Unix socketpairs (benchmarks) have no address
+    return "local"
+
+def negotiate(conn, first_header: bytes = b"") -> Dict[str, Any]:
+    """Agree capabilities with the receiver, {} means the legacy protocol.
+
+    A sized `first_header` goes out in the same write as the hello and the
+    receiver answers both at once, so the hello costs no round trip. It has
+    been delivered when this returns non-empty capabilities.
+    """
+    caps = _peer_caps.get(conn)
+    if caps is not None:
+        return caps
+
+    # Hello, headers and ACKs are small writes that each wait on a reply,
+    # Nagle would hold them back for a delayed ACK
+    tune_socket(conn)
+    host = _peer_host(conn)
+    if not config.CAPABILITY_HELLO or host in _legacy_peers:
+        _peer_caps[conn] = {}
+        return {}
+
+    hello = {"version": PROTOCOL_VERSION, "capabilities": local_capabilities()}
+    if first_header:
+        hello["header_follows"] = True
+    conn.sendall(HELLO_MAGIC + encode_frame(hello) + first_header)
+
+    # Kept short so a legacy peer costs little. A receiver slower than this
+    # has its reply turn up where the legacy ACK should be, _send_file
+    # catches that and fails the transfer rather than corrupt it.
+    timeout = conn.gettimeout()
+    conn.settimeout(config.HELLO_TIMEOUT)
+    try:
+        magic = recv_exact(conn, len(HELLO_MAGIC))
+    except socket.timeout:
+        # A legacy receiver drops the hello as an undecodable filename and
+        # keeps waiting for a real one
+        _legacy_peers.add(host)
+        _peer_caps[conn] = {}
+        LEGACY.inc()
+        return {}
+    finally:
+        conn.settimeout(timeout)
+
+    if magic != HELLO_MAGIC:
+        raise ProtocolError("Unexpected reply to hello")
+    reply = recv_frame(conn)
+    if reply is None:
+        raise ConnectionError("Connection closed during hello")
+    # Never trust the peer to have picked something we don't support
+    caps = agree(reply.get("capabilities") or {}, local_capabilities())
+    if first_header and not caps.get("sized"):
+        raise ProtocolError("Receiver took a sized header without agreeing to sized transfers")
+    _peer_caps[conn] = caps
+    NEGOTIATED.inc()
+    return caps
+
+def _answer_hello(conn, header: bytes) -> bytes:
+    """Reply to a sender's hello, returning the bytes that follow it"""
+    while len(header) < len(HELLO_MAGIC) and HELLO_MAGIC.startswith(header):
+        data = conn.recv(len(HELLO_MAGIC) - len(header))
+        if not data:
+            return b""
+        header += data
+    if not header.startswith(HELLO_MAGIC):
+        # Not a hello after all, let the filename check reject it
+        return header
+
+    hello, rest = recv_frame_after(conn, header[len(HELLO_MAGIC):])
+    tune_socket(conn)
+    caps = agree(hello.get("capabilities") or {}, local_capabilities())
+    reply = HELLO_MAGIC + encode_frame({"version": caps.get("version", 1), "capabilities": caps})
+    if hello.get("header_follows"):
+        # Answered together with that header's ACK
+        _pending_reply[conn] = reply
+    else:
+        conn.sendall(reply)
+    _peer_caps[conn] = caps
+    NEGOTIATED.inc()
+    return rest or conn.recv(config.BUFFER_SIZE)
 
 def send_file(conn, filepath: str, progress_callback=None) -> Tuple[bool, str]:
     """Enhanced file transfer with detailed progress reporting"""
+    prof = profiler.begin("send", os.path.basename(filepath))
+    success, message = _send_file(conn, filepath, progress_callback, prof)
+    if not success:
+        SEND_FAILURES.inc()
+    prof.finish(success=success, message=message)
+    return (success, message)
+
+def _use_mmap(size: Optional[int]) -> bool:
+    return bool(config.MMAP_THRESHOLD) and size is not None and size >= config.MMAP_THRESHOLD
+
+def _use_pipeline(size: Optional[int], depth: int) -> bool:
+    return bool(depth) and (size is None or size >= config.PIPELINE_THRESHOLD)
+
+def _write_behind(f) -> WriteBehind:
+    return WriteBehind(f, config.PIPELINE_BUFFER_SIZE, config.WRITE_BEHIND_DEPTH, config.FSYNC_BYTES)
+
+def _read_extents(filepath: str, extents):
+    """Yield only the data regions of a sparse file, in order, holes are never read"""
+    buffer = bytearray(config.PIPELINE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(filepath, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        for offset, length in extents:
+            advise(fd, "willneed", offset, length)
+            end = offset + length
+            while offset < end:
+                count = os.preadv(fd, [view[:min(len(buffer), end - offset)]], offset)
+                if not count:
+                    raise ValueError("File shrank while it was being sent")
+                yield view[:count]
+                offset += count
+
+def _exactly(chunks, total_size: int):
+    """Cut `chunks` off at total_size, raise if they end before it"""
+    remaining = total_size
+    for chunk in chunks:
+        if len(chunk) >= remaining:
+            if remaining:
+                yield chunk[:remaining]
+            return
+        yield chunk
+        remaining -= len(chunk)
+    if remaining:
+        raise ValueError("File shrank while it was being sent")
+
+def _read_chunks(filepath: str, total_size: int, extents=None):
+    """Yield exactly total_size bytes of the file, chunk by chunk.
+
+    Receivers count on the size announced up front, so a file that grows
+    is cut off there and one that shrinks raises ValueError.
+
+    Large files are memory-mapped and yielded as memoryview slices, so the
+    bytes go from the page cache to the socket without an extra copy.
+    Medium files are read ahead on a background thread into pooled buffers,
+    so the disk read of the next chunk overlaps the send of this one.
+    With `extents`, only those (offset, length) regions are read.
+    """
+    if extents is not None:
+        yield from _read_extents(filepath, extents)
+        return
+
+    if _use_mmap(total_size):
+        with MappedSource(filepath) as source:
+            for chunk in source.slices(config.MMAP_CHUNK_SIZE, end=total_size):
+                try:
+                    yield chunk
+                finally:
+                    # An exported slice would keep the mapping from closing
+                    chunk.release()
+        return
+
+    if _use_pipeline(total_size, config.READ_AHEAD_DEPTH):
+        with ReadAhead(filepath, config.PIPELINE_BUFFER_SIZE, config.READ_AHEAD_DEPTH) as reader:
+            yield from _exactly(reader, total_size)
+        return
+
+    with open(filepath, 'rb') as f:
+        advise(f.fileno(), "sequential")
+        yield from _exactly(iter(lambda: f.read(config.BUFFER_SIZE), b""), total_size)
+
+class _Throttle:
+    """Paces one outgoing file to SEND_RATE_LIMIT bytes per second.
+
+    The limit is read on every call, so a config reload slows down or
+    speeds up transfers that are already running.
+    """
+
+    def __init__(self):
+        self.rate = 0
+        self.start = 0.0
+        self.sent = 0
+
+    def send(self, conn, chunk) -> float:
+        """Send `chunk` in paced slices, return the time spent inside sendall"""
+        in_send = 0.0
+        view = memoryview(chunk)
+        while view:
+            rate = config.SEND_RATE_LIMIT
+            if not rate:
+                self.rate = 0
+                started = time.perf_counter()
+                conn.sendall(view)
+                return in_send + time.perf_counter() - started
+            now = time.monotonic()
+            if rate != self.rate:
+                self.rate, self.start, self.sent = rate, now, 0
+            # Slices of ~50 ms keep the pace smooth whatever the chunk size
+            piece = view[:max(1024, rate // 20)]
+            delay = self.sent / rate - (now - self.start)
+            if delay > 0:
+                time.sleep(delay)
+            started = time.perf_counter()
+            conn.sendall(piece)
+            in_send += time.perf_counter() - started
+            self.sent += len(piece)
+            view = view[len(piece):]
+        return in_send
+
+def stream_file(conn, filepath: str, total_size: int, progress_callback=None, prof=NULL_PROFILE,
+                extents=None) -> int:
+    """Send the raw contents of a file, return the number of bytes sent.
+
+    Shared by every protocol that moves file data: framing is the caller's job.
+    With `extents` only those regions are sent, and total_size is their sum.
+    If the file shrinks below total_size, ValueError is raised and the
+    connection is shut down so the peer doesn't wait for the missing bytes.
+    """
+    sent_bytes = 0
+    last_update = time.monotonic()
+    throttle = _Throttle()
+
+    try:
+        with closing(_read_chunks(filepath, total_size, extents)) as chunks:
+            while True:
+                started = prof.mark()
+                chunk = next(chunks, None)
+                prof.add("read", started)
+                if chunk is None:
+                    break
+                if config.SEND_RATE_LIMIT:
+                    elapsed = throttle.send(conn, chunk)
+                else:
+                    call_start = time.perf_counter()
+                    conn.sendall(chunk)
+                    elapsed = time.perf_counter() - call_start
+                SEND_SYSCALL.observe(elapsed)
+                prof.record("syscall", elapsed)
+                sent_bytes += len(chunk)
+                BYTES_SENT.inc(len(chunk))
+
+                # Throttle by time only, reporting every chunk makes the
+                # callback (and the GUI behind it) the bottleneck
+                current_time = time.monotonic()
+                if progress_callback and current_time - last_update >= config.PROGRESS_INTERVAL:
+                    started = prof.mark()
+                    progress_callback(sent_bytes, total_size)
+                    prof.add("callback", started)
+                    last_update = current_time
+    except (ValueError, OSError):
+        # A short file or a failed send leaves the peer waiting for bytes that
+        # won't come, end the stream so it fails instead
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        raise
+    if progress_callback:
+        progress_callback(sent_bytes, total_size)
+    return sent_bytes
+
+def _sparse_extents(filepath: str, size: int) -> Optional[list]:
+    """Data extents of a file worth sending sparsely, None to send it whole"""
+    if not config.SPARSE_TRANSFER or size < config.SPARSE_MIN_HOLE:
+        return None
+    try:
+        with open(filepath, 'rb') as f:
+            st = os.fstat(f.fileno())
+            # Every byte has a block behind it: no holes, skip the lseek walk
+            if not hasattr(st, "st_blocks") or st.st_blocks * 512 >= size:
+                return None
+            extents = data_extents(f.fileno(), size, config.SPARSE_MIN_HOLE)
+    except OSError:
+        return None
+    if len(extents) > config.SPARSE_MAX_EXTENTS or extents == [(0, size)]:
+        return None
+    return [[offset, length] for offset, length in extents]
+
+def _send_file(conn, filepath: str, progress_callback, prof) -> Tuple[bool, str]:
     try:
         filename = safe_filename(os.path.basename(filepath))
         if not os.path.exists(filepath):
@@ -14,87 +338,474 @@ def send_file(conn, filepath: str, progress_callback=None) -> Tuple[bool, str]:
         start_time = time.time()
         total_size = os.path.getsize(filepath)
 
-        conn.send(filename.encode())
-        ack = conn.recv(config.BUFFER_SIZE).decode().strip()
-        if ack != "ACK":
+        started = prof.mark()
+        header_sent = False
+        extents = None
+        if conn in _peer_caps:
+            caps = _peer_caps[conn]
+        elif _sparse_extents(filepath, total_size) is None:
+            # First file on this connection: its header rides with the hello
+            caps = negotiate(conn, encode_frame({"name": filename, "size": total_size}))
+            header_sent = bool(caps)
+        else:
+            # A hole map can outgrow one read, and a legacy receiver would take
+            # each piece after the first for a filename, so it waits for the reply
+            caps = negotiate(conn)
+        sized = caps.get("sized", False)
+        if not header_sent:
+            extents = _sparse_extents(filepath, total_size) if sized and caps.get("sparse") else None
+            if extents is not None:
+                conn.sendall(encode_frame({"name": filename, "size": total_size, "extents": extents}))
+            elif sized:
+                conn.sendall(encode_frame({"name": filename, "size": total_size}))
+            else:
+                conn.sendall(filename.encode())
+        ack = conn.recv(config.BUFFER_SIZE)
+        prof.add("handshake", started)
+        if not sized and ack.startswith(HELLO_MAGIC[:1]):
+            # The receiver does speak the hello, it just answered after we gave
+            # up and read our filename as sized-protocol data. The stream is out
+            # of step, so end it, and try the hello again next time.
+            _legacy_peers.discard(_peer_host(conn))
+            conn.shutdown(socket.SHUT_RDWR)
+            return (False, "❌ Receiver answered the hello too late, retry or raise HELLO_TIMEOUT")
+        if ack.decode(errors="replace").strip() != "ACK":
             return (False, "❌ Connection handshake failed")
 
-        sent_bytes = 0
-        last_update = time.time()
-
-        with open(filepath, 'rb') as f:
-            while True:
-                chunk = f.read(config.BUFFER_SIZE)
-                if not chunk:
-                    break
-                try:
-                    conn.send(chunk)
-                    sent_bytes += len(chunk)
-
-                    current_time = time.time()
-                    if progress_callback and (current_time - last_update > 0.1 or len(chunk) > config.BUFFER_SIZE / 2):
-                        progress_callback(sent_bytes, total_size)
-                        last_update = current_time
-
-                except ConnectionError as e:
-                    return (False, f"❌ Connection lost during transfer: {str(e)}")
+        try:
+            if extents is not None:
+                data_size = sum(length for _, length in extents)
+                sent_bytes = stream_file(conn, filepath, data_size, progress_callback, prof, extents)
+                SPARSE_SKIPPED.inc(total_size - data_size)
+            else:
+                sent_bytes = stream_file(conn, filepath, total_size, progress_callback, prof)
+        except ConnectionError as e:
+            return (False, f"❌ Connection lost during transfer: {str(e)}")
 
-        if progress_callback:
-            progress_callback(sent_bytes, total_size)
-        conn.send(b"<EOF>")
+        if not sized:
+            conn.sendall(EOF_MARKER)
 
         transfer_time = time.time() - start_time
         speed = calculate_speed(total_size, transfer_time)
+        prof.count("bytes", sent_bytes)
+        FILES_SENT.inc()
+        if transfer_time > 0:
+            SEND_THROUGHPUT.observe(total_size / transfer_time / (1 << 20))
         return (True, f"✅ {filename} ({format_bytes(total_size)}) sent in {transfer_time:.2f}s ({speed})")
 
     except Exception as e:
         return (False, f"❌ Error sending file: {str(e)}")
 
-def receive_file(conn) -> Tuple[bool, Optional[str], str]:
-    """Enhanced file reception with validation"""
+def _looks_like_filename(data: bytes) -> bool:
+    if not data or len(data) > 255:
+        return False
     try:
-        filename = safe_filename(conn.recv(config.BUFFER_SIZE).decode().strip())
-        if not filename:
-            return (False, None, "❌ Empty filename received")
+        name = data.decode().strip()
+    except UnicodeDecodeError:
+        return False
+    return bool(name) and safe_filename(name) == name
 
-        conn.send(b"ACK")
-        save_path = os.path.join(config.SHARED_FOLDER, filename)
-        temp_path = save_path + ".part"
+def _find_eof(data: bytes) -> Optional[int]:
+    """Offset of the end-of-file marker in a chunk, or None.
 
-        start_time = time.time()
-        received_bytes = 0
+    The sender writes the next filename straight after <EOF>, so both can
+    arrive in one read. A marker in the middle of a chunk only counts when
+    what follows it is a plausible filename.
+    """
+    if data.endswith(EOF_MARKER):
+        return len(data) - len(EOF_MARKER)
+    idx = data.rfind(EOF_MARKER)
+    if idx >= 0 and _looks_like_filename(data[idx + len(EOF_MARKER):]):
+        return idx
+    return None
+
+def _partial_marker(data: bytes) -> int:
+    """Length of a trailing prefix of <EOF> that may complete in the next read"""
+    for size in range(len(EOF_MARKER) - 1, 0, -1):
+        if data.endswith(EOF_MARKER[:size]):
+            return size
+    return 0
+
+def _receive_mapped(conn, temp_path: str, size: int, progress_callback, prof) -> int:
+    """Receive exactly `size` bytes straight into a preallocated mapping of temp_path"""
+    received_bytes = 0
+    last_update = time.monotonic()
+    with MappedSink(temp_path, size) as sink:
+        while received_bytes < size:
+            window = sink.window(received_bytes, config.MMAP_CHUNK_SIZE)
+            call_start = time.perf_counter()
+            try:
+                count = conn.recv_into(window)
+            finally:
+                window.release()
+            elapsed = time.perf_counter() - call_start
+            RECV_SYSCALL.observe(elapsed)
+            prof.record("syscall", elapsed)
+            if not count:
+                raise ConnectionError("Connection closed unexpectedly")
+            received_bytes += count
+            BYTES_RECEIVED.inc(count)
+
+            current_time = time.monotonic()
+            if progress_callback and current_time - last_update >= config.PROGRESS_INTERVAL:
+                progress_callback(received_bytes, size)
+                last_update = current_time
+    return received_bytes
+
+def _receive_pipelined(conn, temp_path: str, size: int, progress_callback, prof) -> int:
+    """Receive exactly `size` bytes into pooled buffers that a writer thread drains to disk"""
+    received_bytes = 0
+    last_update = time.monotonic()
+    with open(temp_path, 'wb') as f:
+        writer = _write_behind(f)
+        try:
+            while received_bytes < size:
+                started = prof.mark()
+                buffer = writer.acquire()
+                # Waiting for a free buffer means the disk is behind the network
+                prof.add("write", started)
+                call_start = time.perf_counter()
+                count = conn.recv_into(buffer, min(len(buffer), size - received_bytes))
+                elapsed = time.perf_counter() - call_start
+                RECV_SYSCALL.observe(elapsed)
+                prof.record("syscall", elapsed)
+                if not count:
+                    writer.release(buffer)
+                    raise ConnectionError("Connection closed unexpectedly")
+                writer.submit(buffer, count)
+                received_bytes += count
+                BYTES_RECEIVED.inc(count)
+
+                current_time = time.monotonic()
+                if progress_callback and current_time - last_update >= config.PROGRESS_INTERVAL:
+                    progress_callback(received_bytes, size)
+                    last_update = current_time
+        finally:
+            writer.close()
+    return received_bytes
 
+def _receive_buffered(conn, temp_path: str, size: int, progress_callback, prof) -> int:
+    """Receive exactly `size` bytes into temp_path with ordinary writes"""
+    if _use_pipeline(size, config.WRITE_BEHIND_DEPTH):
+        return _receive_pipelined(conn, temp_path, size, progress_callback, prof)
+
+    received_bytes = 0
+    last_update = time.monotonic()
+    with open(temp_path, 'wb') as f:
+        while received_bytes < size:
+            call_start = time.perf_counter()
+            data = conn.recv(min(config.BUFFER_SIZE, size - received_bytes))
+            elapsed = time.perf_counter() - call_start
+            RECV_SYSCALL.observe(elapsed)
+            prof.record("syscall", elapsed)
+            if not data:
+                raise ConnectionError("Connection closed unexpectedly")
+
+            started = prof.mark()
+            f.write(data)
+            prof.add("write", started)
+            received_bytes += len(data)
+            BYTES_RECEIVED.inc(len(data))
+
+            current_time = time.monotonic()
+            if progress_callback and current_time - last_update >= config.PROGRESS_INTERVAL:
+                progress_callback(received_bytes, size)
+                last_update = current_time
+    return received_bytes
+
+class _SpliceUnsupported(Exception):
+    """splice refused the socket or file before any data moved"""
+    pass
+
+def _receive_spliced(conn, temp_path: str, size: int, progress_callback, prof) -> int:
+    """Receive exactly `size` bytes with socket -> pipe -> file splices, never copying to userspace"""
+    received_bytes = 0
+    last_update = time.monotonic()
+    pipe_read, pipe_write = open_pipe(config.SPLICE_CHUNK_SIZE)
+    try:
         with open(temp_path, 'wb') as f:
+            preallocate(f.fileno(), size)
+            while received_bytes < size:
+                call_start = time.perf_counter()
+                try:
+                    count = splice_in(conn, pipe_write, min(config.SPLICE_CHUNK_SIZE, size - received_bytes))
+                except OSError as e:
+                    if received_bytes == 0 and e.errno in SPLICE_UNSUPPORTED:
+                        raise _SpliceUnsupported() from e
+                    raise
+                if not count:
+                    raise ConnectionError("Connection closed unexpectedly")
+                splice_out(pipe_read, f.fileno(), count, received_bytes)
+                elapsed = time.perf_counter() - call_start
+                RECV_SYSCALL.observe(elapsed)
+                prof.record("splice", elapsed)
+                received_bytes += count
+                BYTES_RECEIVED.inc(count)
+
+                current_time = time.monotonic()
+                if progress_callback and current_time - last_update >= config.PROGRESS_INTERVAL:
+                    progress_callback(received_bytes, size)
+                    last_update = current_time
+    finally:
+        os.close(pipe_read)
+        os.close(pipe_write)
+    return received_bytes
+
+def _use_splice(conn, size: int) -> bool:
+    # Bytes already read past a boundary sit in _leftover, splice would skip them
+    return (config.RECEIVE_SPLICE and splice_supported() and size > 0
+            and hasattr(conn, "fileno") and conn not in _leftover)
+
+def receive_exact(conn, temp_path: str, size: int, progress_callback=None, prof=NULL_PROFILE) -> int:
+    """Receive a payload of known size into temp_path.
+
+    With RECEIVE_SPLICE on Linux the bytes are spliced from the socket into
+    the file. Otherwise large payloads are memory-mapped and the rest go
+    through buffered (or write-behind) writes.
+    Raises ConnectionError if the peer disconnects before `size` bytes arrive.
+    """
+    if _use_splice(conn, size):
+        try:
+            received_bytes = _receive_spliced(conn, temp_path, size, progress_callback, prof)
+            if progress_callback:
+                progress_callback(received_bytes, size)
+            return received_bytes
+        except _SpliceUnsupported:
+            pass
+
+    if _use_mmap(size):
+        received_bytes = _receive_mapped(conn, temp_path, size, progress_callback, prof)
+    else:
+        received_bytes = _receive_buffered(conn, temp_path, size, progress_callback, prof)
+    if progress_callback:
+        progress_callback(received_bytes, size)
+    return received_bytes
+
+def _check_extents(extents, size: int) -> list:
+    """The announced hole map as (offset, length) pairs, ValueError unless ordered and inside the file"""
+    if not isinstance(extents, list) or len(extents) > config.SPARSE_MAX_EXTENTS:
+        raise ValueError("Bad extent list")
+    checked, end = [], 0
+    for item in extents:
+        offset, length = (int(value) for value in item)
+        if offset < end or length <= 0 or offset + length > size:
+            raise ValueError(f"Bad extent ({offset}, {length})")
+        checked.append((offset, length))
+        end = offset + length
+    return checked
+
+def receive_sparse(conn, temp_path: str, size: int, extents, progress_callback=None, prof=NULL_PROFILE) -> int:
+    """Receive only the data extents of a sparse file into temp_path.
+
+    The file is truncated to its full size first, which leaves holes
+    everywhere, then each extent is written in place with pwrite. Returns
+    the number of data bytes received.
+    """
+    data_size = sum(length for _, length in extents)
+    received_bytes = 0
+    last_update = time.monotonic()
+    buffer = bytearray(config.PIPELINE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(temp_path, 'wb') as f:
+        fd = f.fileno()
+        os.ftruncate(fd, size)
+        pending = _leftover.pop(conn, b"")
+        for offset, length in extents:
+            end = offset + length
+            while offset < end:
+                if pending:
+                    count = min(len(pending), end - offset)
+                    view[:count] = pending[:count]
+                    pending = pending[count:]
+                else:
+                    call_start = time.perf_counter()
+                    count = conn.recv_into(view[:min(len(buffer), end - offset)])
+                    elapsed = time.perf_counter() - call_start
+                    RECV_SYSCALL.observe(elapsed)
+                    prof.record("syscall", elapsed)
+                    if not count:
+                        raise ConnectionError("Connection closed unexpectedly")
+                started = prof.mark()
+                written = os.pwrite(fd, view[:count], offset)
+                prof.add("write", started)
+                if written < count:
+                    raise OSError(errno.EIO, "Short write to sparse file")
+                offset += count
+                received_bytes += count
+                BYTES_RECEIVED.inc(count)
+
+                current_time = time.monotonic()
+                if progress_callback and current_time - last_update >= config.PROGRESS_INTERVAL:
+                    progress_callback(received_bytes, data_size)
+                    last_update = current_time
+        if pending:
+            _leftover[conn] = pending
+    SPARSE_SKIPPED.inc(size - data_size)
+    if progress_callback:
+        progress_callback(received_bytes, data_size)
+    return received_bytes
+
+def _expect_eof(conn):
+    """Consume the <EOF> marker that follows a payload of known size"""
+    trailer = _leftover.pop(conn, b"")
+    while len(trailer) < len(EOF_MARKER):
+        data = conn.recv(config.BUFFER_SIZE)
+        if not data:
+            raise ConnectionError("Connection closed unexpectedly")
+        trailer += data
+    if not trailer.startswith(EOF_MARKER):
+        raise ValueError("File data longer than announced size")
+    if len(trailer) > len(EOF_MARKER):
+        _leftover[conn] = trailer[len(EOF_MARKER):]
+
+def _receive_stream(conn, temp_path: str, prof) -> int:
+    """Receive into temp_path until the <EOF> marker, for files of unknown size.
+
+    Once the file passes PIPELINE_THRESHOLD, writes move to a writer thread.
+    """
+    received_bytes = 0
+    carry = b""
+    writer = None
+
+    with open(temp_path, 'wb') as f:
+        out = f
+        try:
             while True:
+                call_start = time.perf_counter()
                 data = conn.recv(config.BUFFER_SIZE)
+                elapsed = time.perf_counter() - call_start
+                RECV_SYSCALL.observe(elapsed)
+                prof.record("syscall", elapsed)
                 if not data:
-                    return (False, None, "❌ Connection closed unexpectedly")
+                    raise ConnectionError("Connection closed unexpectedly")
+                if carry:
+                    data = carry + data
+                    carry = b""
 
-                if data.endswith(b"<EOF>"):
-                    f.write(data[:-5])
-                    received_bytes += len(data) - 5
-                    break
+                started = prof.mark()
+                end = _find_eof(data)
+                prof.add("parse", started)
+                if end is not None:
+                    out.write(data[:end])
+                    received_bytes += end
+                    BYTES_RECEIVED.inc(end)
+                    rest = data[end + len(EOF_MARKER):]
+                    if rest:
+                        _leftover[conn] = rest
+                    return received_bytes
+
+                # Hold back a marker split across two reads
+                held = _partial_marker(data)
+                if held:
+                    carry = data[-held:]
+                    data = data[:-held]
 
-                f.write(data)
+                started = prof.mark()
+                out.write(data)
+                prof.add("write", started)
                 received_bytes += len(data)
+                BYTES_RECEIVED.inc(len(data))
+
+                if writer is None and received_bytes >= config.PIPELINE_THRESHOLD \
+                        and _use_pipeline(None, config.WRITE_BEHIND_DEPTH):
+                    writer = out = _write_behind(f)
+        finally:
+            if writer:
+                writer.close()
+
+def receive_file(conn, dest_dir: Optional[str] = None,
+                 expected_size: Optional[int] = None) -> Tuple[bool, Optional[str], str]:
+    """Enhanced file reception with validation.
+
+    When the size is known up front, because the sender announced it after
+    a hello or the caller passed expected_size, exactly that many bytes are
+    read through the sized paths (splice, memory map, write-behind) instead
+    of scanning for the <EOF> marker. A header with a hole map brings only
+    the data extents, written into a sparse file.
+    """
+    success, save_path, message, prof = _receive_file(conn, dest_dir, expected_size)
+    if not success and "Connection closed by peer" not in message:
+        RECEIVE_FAILURES.inc()
+    if success:
+        catalog.note_file(save_path)
+    prof.finish(success=success, message=message)
+    return (success, save_path, message)
+
+def _receive_file(conn, dest_dir: Optional[str],
+                  expected_size: Optional[int]) -> Tuple[bool, Optional[str], str, Any]:
+    """Also returns the transfer's profile, begun only once a header names a file"""
+    prof = NULL_PROFILE
+    try:
+        header = _leftover.pop(conn, b"") or conn.recv(config.BUFFER_SIZE)
+        if header[:1] == HELLO_MAGIC[:1] and conn not in _peer_caps:
+            header = _answer_hello(conn, header)
+        if not header:
+            return (False, None, "❌ Connection closed by peer", prof)
+
+        sized = _peer_caps.get(conn, {}).get("sized", False)
+        extents = None
+        if sized:
+            # The sender waits for our ACK before the payload, nothing can follow the header
+            announced, rest = recv_frame_after(conn, header)
+            if rest:
+                raise ProtocolError("Data sent before the header was acknowledged")
+            filename = safe_filename(str(announced.get("name", "")).strip())
+            expected_size = int(announced["size"])
+            if "extents" in announced:
+                extents = _check_extents(announced["extents"], expected_size)
+        else:
+            filename = safe_filename(header.decode().strip())
+        if not filename:
+            _send_pending_reply(conn)
+            return (False, None, "❌ Empty filename received", prof)
+
+        prof = profiler.begin("receive", filename)
+        conn.sendall(_pending_reply.pop(conn, b"") + b"ACK")
+        save_path = os.path.join(dest_dir or config.SHARED_FOLDER, filename)
+        temp_path = save_path + ".part"
+
+        start_time = time.time()
+        if extents is not None:
+            received_bytes = receive_sparse(conn, temp_path, expected_size, extents, prof=prof)
+        elif expected_size is not None:
+            received_bytes = receive_exact(conn, temp_path, expected_size, prof=prof)
+            if not sized:
+                _expect_eof(conn)
+        else:
+            received_bytes = _receive_stream(conn, temp_path, prof)
 
         os.rename(temp_path, save_path)
         transfer_time = time.time() - start_time
         file_size = os.path.getsize(save_path)
         speed = calculate_speed(file_size, transfer_time)
+        prof.count("bytes", received_bytes)
+        FILES_RECEIVED.inc()
+        if transfer_time > 0:
+            RECEIVE_THROUGHPUT.observe(file_size / transfer_time / (1 << 20))
 
-        return (True, save_path, f"📥 Received {filename} ({format_bytes(file_size)}) in {transfer_time:.2f}s ({speed})")
+        return (True, save_path, f"📥 Received {filename} ({format_bytes(file_size)}) in {transfer_time:.2f}s ({speed})", prof)
 
     except Exception as e:
+        _send_pending_reply(conn)
         if 'temp_path' in locals() and os.path.exists(temp_path):
             os.remove(temp_path)
-        return (False, None, f"❌ Error receiving file: {str(e)}")
+        return (False, None, f"❌ Error receiving file: {str(e)}", prof)
+
+def _send_pending_reply(conn):
+    """Answer a held hello even though its header was refused, so the sender
+    doesn't take us for a legacy peer"""
+    reply = _pending_reply.pop(conn, None)
+    if reply:
+        try:
+            conn.sendall(reply)
+        except OSError:
+            pass
 
-def receive_loop(conn, callback=None):
+def receive_loop(conn, callback=None, dest_dir: Optional[str] = None):
     """Continuous file reception loop with enhanced logging"""
     while True:
         try:
-            success, filepath, message = receive_file(conn)
+            success, filepath, message = receive_file(conn, dest_dir)
             if not success:
                 if "Connection closed" in message:
                     break
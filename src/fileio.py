@@ -0,0 +1,363 @@
+import errno
+import mmap
+import os
+import queue
+import select
+import threading
+from typing import Iterator, Optional, Tuple, List
+
+def advise(fd: int, advice: str, offset: int = 0, length: int = 0):
+    """posix_fadvise hint ("sequential", "willneed", "dontneed"), ignored where unsupported"""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    flag = getattr(os, f"POSIX_FADV_{advice.upper()}", None)
+    if flag is None:
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, flag)
+    except OSError:
+        pass
+
+def preallocate(fd: int, size: int):
+    """Reserve `size` bytes on disk so writes can't fail halfway with ENOSPC.
+
+    Falls back to ftruncate (a sparse file) on platforms or filesystems
+    without posix_fallocate.
+    """
+    if size <= 0:
+        return
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+def sparse_supported() -> bool:
+    return hasattr(os, "SEEK_DATA") and hasattr(os, "SEEK_HOLE")
+
+def data_extents(fd: int, size: int, min_hole: int = 0) -> List[Tuple[int, int]]:
+    """(offset, length) of each region holding data, found with SEEK_DATA/SEEK_HOLE.
+
+    Holes shorter than `min_hole` are kept as data, so a fragmented file
+    doesn't turn into thousands of tiny extents. Where the platform or
+    filesystem can't report holes the whole file is one extent.
+    """
+    if size <= 0:
+        return []
+    if not sparse_supported():
+        return [(0, size)]
+    extents: List[Tuple[int, int]] = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # Only a hole left before the end
+                    break
+                raise
+            if start >= size:
+                break
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            if extents and start - (extents[-1][0] + extents[-1][1]) < min_hole:
+                extents[-1] = (extents[-1][0], end - extents[-1][0])
+            else:
+                extents.append((start, end - start))
+            offset = end
+    except OSError as e:
+        if e.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+            return [(0, size)]
+        raise
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+    return extents
+
+def splice_supported() -> bool:
+    return hasattr(os, "splice")
+
+def open_pipe(size: int) -> Tuple[int, int]:
+    """A pipe for splice, grown to `size` bytes where the kernel allows it"""
+    read_fd, write_fd = os.pipe()
+    try:
+        import fcntl
+        fcntl.fcntl(write_fd, fcntl.F_SETPIPE_SZ, size)
+    except (ImportError, AttributeError, OSError):
+        # Default 64 KB pipe, still correct, just more calls
+        pass
+    return read_fd, write_fd
+
+# errno values meaning "splice can't be used with this socket or file"
+SPLICE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF)
+
+def splice_in(sock, pipe_write: int, count: int) -> int:
+    """Move up to `count` bytes from a socket into a pipe without copying them to userspace.
+
+    Sockets with a timeout are non-blocking at the OS level, so wait for
+    data with select and honour the socket's timeout.
+    """
+    while True:
+        try:
+            return os.splice(sock.fileno(), pipe_write, count, flags=os.SPLICE_F_MOVE)
+        except BlockingIOError:
+            ready, _, _ = select.select([sock], [], [], sock.gettimeout())
+            if not ready:
+                raise TimeoutError("timed out")
+
+def splice_out(pipe_read: int, fd: int, count: int, offset: int):
+    """Move exactly `count` bytes from a pipe into a file at `offset`.
+
+    Filesystems that can't be spliced into get the bytes with read/pwrite
+    instead, the data is already in the pipe and must not be lost.
+    """
+    while count:
+        try:
+            moved = os.splice(pipe_read, fd, count, offset_dst=offset, flags=os.SPLICE_F_MOVE)
+        except OSError as e:
+            if e.errno not in SPLICE_UNSUPPORTED:
+                raise
+            data = os.read(pipe_read, count)
+            moved = os.pwrite(fd, data, offset)
+            if moved < len(data):
+                raise OSError(errno.EIO, "Short write while draining splice pipe")
+        offset += moved
+        count -= moved
+
+class MappedSource:
+    """Read-only mapping of a file, handed out as memoryview slices without copying"""
+
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = None
+        self.view = None
+        if self.size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+            advise(self.file.fileno(), "sequential")
+            if hasattr(self.map, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                self.map.madvise(mmap.MADV_SEQUENTIAL)
+
+    def slices(self, chunk_size: int, offset: int = 0, end: Optional[int] = None) -> Iterator[memoryview]:
+        """Slices up to `end` (default the mapped size).
+
+        Touching a page the file no longer covers raises SIGBUS, which Python
+        can't catch, so the size is checked again before each slice and a
+        shrunk file raises ValueError instead. Pages cut off while a slice is
+        in sendall fail the send with EFAULT.
+        """
+        end = self.size if end is None else end
+        if end > self.size:
+            raise ValueError("File shrank while it was being sent")
+        can_prefetch = hasattr(self.map, "madvise") and hasattr(mmap, "MADV_WILLNEED")
+        for start in range(offset, end, chunk_size):
+            stop = min(start + chunk_size, end)
+            if os.fstat(self.file.fileno()).st_size < stop:
+                raise ValueError("File shrank while it was being sent")
+            if can_prefetch and stop < end:
+                # Start reading the next chunk from disk while this one is sent
+                page_start = stop - stop % mmap.PAGESIZE
+                self.map.madvise(mmap.MADV_WILLNEED, page_start, min(chunk_size, end - page_start))
+            yield self.view[start:stop]
+
+    def close(self):
+        # Every slice must be released before the map can close
+        if self.view is not None:
+            self.view.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class MappedSink:
+    """Preallocated, writable mapping of a file of known size.
+
+    Writes may land at any offset, so chunks can be filled out of order,
+    and `window` exposes the mapping directly to socket.recv_into.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.file = open(path, 'w+b')
+        preallocate(self.file.fileno(), size)
+        self.map = None
+        self.view = None
+        if size:
+            self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_WRITE)
+            self.view = memoryview(self.map)
+            advise(self.file.fileno(), "sequential")
+
+    def window(self, offset: int, length: int) -> memoryview:
+        return self.view[offset:min(offset + length, self.size)]
+
+    def write_at(self, offset: int, data) -> int:
+        end = offset + len(data)
+        if end > self.size:
+            raise ValueError(f"Write past end of file ({end} > {self.size})")
+        self.view[offset:end] = data
+        return len(data)
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BufferPool:
+    """Fixed set of reusable buffers, get() blocks while all are in use"""
+
+    def __init__(self, count: int, size: int):
+        self.size = size
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(bytearray(size))
+
+    def get(self) -> bytearray:
+        return self._free.get()
+
+    def put(self, buffer: bytearray):
+        self._free.put(buffer)
+
+class ReadAhead:
+    """Reads a file on a background thread, ahead of the consumer.
+
+    At most `depth` buffers are filled and waiting, so memory stays bounded
+    and a slow consumer simply pauses the reader.
+    """
+
+    def __init__(self, path: str, buffer_size: int, depth: int):
+        self.pool = BufferPool(depth, buffer_size)
+        self._ready = queue.Queue()
+        self._stopped = False
+        self._file = open(path, 'rb', buffering=0)
+        advise(self._file.fileno(), "sequential")
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _read_loop(self):
+        try:
+            while not self._stopped:
+                buffer = self.pool.get()
+                if self._stopped:
+                    break
+                count = self._file.readinto(buffer)
+                self._ready.put((buffer, count))
+                if not count:
+                    return
+        except OSError as e:
+            self._ready.put(e)
+
+    def __iter__(self) -> Iterator[memoryview]:
+        while True:
+            item = self._ready.get()
+            if isinstance(item, Exception):
+                raise item
+            buffer, count = item
+            if not count:
+                return
+            view = memoryview(buffer)[:count]
+            try:
+                yield view
+            finally:
+                view.release()
+                self.pool.put(buffer)
+
+    def close(self):
+        self._stopped = True
+        # Hand the reader a buffer in case it is waiting for one
+        self.pool.put(bytearray(0))
+        self._thread.join()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class WriteBehind:
+    """Writes to a file on a background thread so the caller can keep receiving.
+
+    Callers either hand over bytes with write(), or fill a pooled buffer from
+    acquire() (e.g. with recv_into) and pass it to submit(). Both block once
+    `depth` writes are queued. With fsync_bytes set, the file is fsynced each
+    time that many bytes have been written, and always on close.
+    """
+
+    def __init__(self, f, buffer_size: int, depth: int, fsync_bytes: int = 0):
+        self.file = f
+        self.pool = BufferPool(depth, buffer_size)
+        self.fsync_bytes = fsync_bytes
+        self._pending = queue.Queue(maxsize=depth)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _write_loop(self):
+        unsynced = 0
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            data, count, pooled = item
+            if self._error is None:
+                try:
+                    self.file.write(memoryview(data)[:count])
+                    unsynced += count
+                    if self.fsync_bytes and unsynced >= self.fsync_bytes:
+                        self.file.flush()
+                        os.fsync(self.file.fileno())
+                        unsynced = 0
+                except OSError as e:
+                    self._error = e
+            if pooled:
+                self.pool.put(data)
+        if self._error is None and self.fsync_bytes and unsynced:
+            try:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def acquire(self) -> bytearray:
+        self._check()
+        return self.pool.get()
+
+    def submit(self, buffer: bytearray, count: int):
+        self._check()
+        self._pending.put((buffer, count, True))
+
+    def release(self, buffer: bytearray):
+        """Return an acquired buffer that turned out not to be needed"""
+        self.pool.put(buffer)
+
+    def write(self, data) -> int:
+        self._check()
+        self._pending.put((data, len(data), False))
+        return len(data)
+
+    def close(self):
+        """Wait for every queued write, raising the first write error if there was one"""
+        self._pending.put(None)
+        self._thread.join()
+        self._check()
@@ -0,0 +1,165 @@
+import math
+import os
+import tkinter as tk
+from typing import Dict, List, Optional, Tuple
+from config import config
+from thumbnails import thumbnails
+from ui_bus import ui_bus
+
+class GalleryView:
+    """Scrollable grid of received images with lazily made previews.
+
+    Only the tiles in (or one row beyond) the visible part of the canvas
+    exist as canvas items, so thousands of entries cost one list of paths.
+    Previews come from the thumbnail workers and the main thread only ever
+    loads the small cached PNG. Tiles that scroll away drop their image
+    and cancel previews still waiting for a worker.
+    """
+
+    PAD = 6
+    LABEL_HEIGHT = 18
+
+    def __init__(self, parent, colors: dict, height: int = 220):
+        self.colors = colors
+        self.size = config.THUMBNAIL_SIZE
+        self.tile_w = self.size + 2 * self.PAD
+        self.tile_h = self.size + 2 * self.PAD + self.LABEL_HEIGHT
+
+        self.frame = tk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, height=height, highlightthickness=0, bg=colors['chat_bg'])
+        scrollbar = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self._yview)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.canvas.bind('<Configure>', lambda e: self._schedule())
+        self.canvas.bind('<MouseWheel>', self._on_wheel)
+        self.canvas.bind('<Button-4>', lambda e: self._yview('scroll', -1, 'units'))
+        self.canvas.bind('<Button-5>', lambda e: self._yview('scroll', 1, 'units'))
+
+        self.paths: List[str] = []
+        self._known = set()
+        # Drawn tiles: display index -> (path, canvas item ids)
+        self._tiles: Dict[int, Tuple[str, List[int]]] = {}
+        self._images: Dict[str, tk.PhotoImage] = {}
+        self._requested = set()
+        self._columns = 0
+        self._redraw_scheduled = False
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def add(self, path: str):
+        """Show a newly received file first in the grid"""
+        if path in self._known:
+            return
+        self._known.add(path)
+        self.paths.append(path)
+        # Every display index moves down by one: slide the drawn tiles along
+        # instead of rebuilding them, the redraw then adds the new first tile
+        shifted = {}
+        for index, (tile_path, items) in self._tiles.items():
+            (x0, y0), (x1, y1) = self._center(index), self._center(index + 1)
+            for item in items:
+                self.canvas.move(item, x1 - x0, y1 - y0)
+            shifted[index + 1] = (tile_path, items)
+        self._tiles = shifted
+        self._schedule()
+
+    def load(self, paths: List[str]):
+        """Fill the grid with existing files, oldest first"""
+        for path in paths:
+            if path not in self._known:
+                self._known.add(path)
+                self.paths.append(path)
+        self._clear()
+        self._schedule()
+
+    def _path_at(self, index: int) -> str:
+        return self.paths[len(self.paths) - 1 - index]
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._schedule()
+
+    def _on_wheel(self, event):
+        self._yview('scroll', -1 if event.delta > 0 else 1, 'units')
+
+    def _schedule(self):
+        if not self._redraw_scheduled:
+            self._redraw_scheduled = True
+            self.canvas.after(max(1, int(1000 / config.UI_FPS)), self._redraw)
+
+    def _clear(self):
+        for index in list(self._tiles):
+            self._drop(index)
+
+    def _drop(self, index: int):
+        path, items = self._tiles.pop(index)
+        for item in items:
+            self.canvas.delete(item)
+        self._images.pop(path, None)
+        if path in self._requested:
+            self._requested.discard(path)
+            thumbnails.cancel(path, self.size)
+
+    def _redraw(self):
+        self._redraw_scheduled = False
+        width = max(self.canvas.winfo_width(), self.tile_w)
+        columns = max(1, width // self.tile_w)
+        if columns != self._columns:
+            self._columns = columns
+            self._clear()
+        rows = math.ceil(len(self.paths) / columns)
+        self.canvas.configure(scrollregion=(0, 0, width, rows * self.tile_h),
+                              yscrollincrement=self.tile_h // 2)
+
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first_row = max(0, int(top // self.tile_h) - 1)
+        last_row = min(rows - 1, int(bottom // self.tile_h) + 1)
+        wanted = set(range(first_row * columns, min(len(self.paths), (last_row + 1) * columns)))
+
+        for index in [index for index in self._tiles if index not in wanted]:
+            self._drop(index)
+        for index in sorted(wanted):
+            if index not in self._tiles:
+                self._draw(index)
+
+    def _center(self, index: int) -> Tuple[int, int]:
+        row, column = divmod(index, self._columns)
+        return column * self.tile_w + self.tile_w // 2, row * self.tile_h + self.PAD + self.size // 2
+
+    def _draw(self, index: int):
+        path = self._path_at(index)
+        x, y = self._center(index)
+        name = os.path.basename(path)
+        if len(name) > 18:
+            name = name[:8] + "…" + name[-8:]
+        items = [
+            self.canvas.create_rectangle(x - self.size // 2, y - self.size // 2,
+                                         x + self.size // 2, y + self.size // 2,
+                                         outline=self.colors['status_bar']),
+            self.canvas.create_text(x, y, text="🖼️", font=('Helvetica', 18)),
+            self.canvas.create_text(x, y + self.size // 2 + self.LABEL_HEIGHT // 2 + 2,
+                                    text=name, font=('Helvetica', 8), fill=self.colors['text']),
+        ]
+        self._tiles[index] = (path, items)
+        if path not in self._requested:
+            self._requested.add(path)
+            thumbnails.request(path, ui_bus.wrap(self._thumbnail_ready), self.size)
+
+    def _thumbnail_ready(self, path: str, thumbnail: Optional[str]):
+        self._requested.discard(path)
+        index = next((index for index, (drawn, _) in self._tiles.items() if drawn == path), None)
+        if index is None or not thumbnail:
+            # Scrolled away meanwhile, or not an image Pillow can read
+            return
+        try:
+            image = tk.PhotoImage(file=thumbnail)
+        except tk.TclError:
+            return
+        self._images[path] = image
+        _, items = self._tiles[index]
+        x, y = self.canvas.coords(items[1])
+        self.canvas.delete(items[1])
+        items[1] = self.canvas.create_image(x, y, image=image)
@@ -1,5 +1,5 @@
 import tkinter as tk
-from tkinter import filedialog, scrolledtext, messagebox, ttk
+from tkinter import filedialog, messagebox, simpledialog, ttk
 from tkinterdnd2 import DND_FILES, TkinterDnD
 import threading
 import os
@@ -7,8 +7,15 @@ import peer
 import chat
 import file_transfer
 from animation import animator
+from chat_view import ChatLogView
+from gallery_view import GalleryView
+from thumbnails import is_image, available as previews_available
+from ui_bus import ui_bus
 from config import config
-from utils import format_bytes
+from history import history
+from metrics import metrics
+from catalog import catalog
+from utils import format_bytes, format_timestamp
 from PIL import Image, ImageTk
 import sv_ttk
 
@@ -28,6 +35,7 @@ class P2PGUI:
             'status_bar': '#e0e0e0'
         }
         animator.init_root(root)
+        ui_bus.start(root)
         self._setup_window()
         self._create_variables()
         self._build_connect_screen()
@@ -52,6 +60,8 @@ class P2PGUI:
         self.chat_input = tk.StringVar()
         self.conn = None
         self.chat_handler = None
+        self.gallery = None
+        self.chat_view = None
         self.progress = tk.DoubleVar()
         self.style = ttk.Style()
         self.style.configure('Accent.TButton', foreground='white', background=self.colors['secondary'])
@@ -111,7 +121,7 @@ class P2PGUI:
                 self.chat_handler = chat.ChatHandler(
                     is_server=True, 
                     peer_ip=None, 
-                    on_message_callback=self._append_chat
+                    on_message_callback=ui_bus.wrap(self._on_chat_message)
                 )
                 self.peer_ip.set(self.conn.getpeername()[0])
                 self._build_main_window()
@@ -129,7 +139,7 @@ class P2PGUI:
                     self.chat_handler = chat.ChatHandler(
                         is_server=False, 
                         peer_ip=ip, 
-                        on_message_callback=self._append_chat
+                        on_message_callback=ui_bus.wrap(self._on_chat_message)
                     )
                     self._build_main_window()
             except Exception as e:
@@ -156,8 +166,16 @@ class P2PGUI:
                                  borderwidth=3)
         chat_frame.pack(fill=tk.BOTH, expand=True, pady=5)
 
-        self.chat_box = scrolledtext.ScrolledText(
+        history_frame = ttk.Frame(chat_frame)
+        history_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Button(history_frame, text="⬆ Earlier Messages",
+                   command=self._load_older_history).pack(side=tk.LEFT)
+        ttk.Button(history_frame, text="🔍 Search History",
+                   command=self._search_history).pack(side=tk.RIGHT)
+
+        self.chat_view = ChatLogView(
             chat_frame, 
+            self.colors,
             bg=self.colors['chat_bg'],
             fg=self.colors['chat_fg'],
             insertbackground=self.colors['chat_fg'],
@@ -165,10 +183,9 @@ class P2PGUI:
             padx=10,
             pady=10,
             width=60, 
-            height=15, 
-            state='disabled'
+            height=15
         )
-        self.chat_box.pack(fill=tk.BOTH, expand=True)
+        self.chat_view.pack(fill=tk.BOTH, expand=True)
 
         input_frame = ttk.Frame(chat_frame)
         input_frame.pack(fill=tk.X, pady=(10, 0))
@@ -180,6 +197,8 @@ class P2PGUI:
 
         ttk.Button(input_frame, text="Send", command=self._send_chat).pack(side=tk.RIGHT)
 
+        self._load_older_history()
+
         if self.mode.get() == "send":
             self._build_sender_interface(main_container)
         else:
@@ -215,6 +234,24 @@ class P2PGUI:
         ttk.Label(transfer_frame, text="⏳ Waiting for files to be sent...", 
                   font=('Helvetica', 11)).pack(pady=10)
 
+        self.gallery = None
+        if previews_available():
+            self.gallery = GalleryView(transfer_frame, self.colors)
+            self.gallery.pack(fill=tk.BOTH, expand=True)
+            threading.Thread(target=self._list_received_images, daemon=True).start()
+
+    def _list_received_images(self):
+        """Find images already in the receive folder, off the main thread"""
+        folder = str(config.SHARED_FOLDER)
+        try:
+            with os.scandir(folder) as it:
+                found = [(entry.stat().st_mtime, entry.path) for entry in it
+                         if entry.is_file() and is_image(entry.name)]
+        except OSError:
+            return
+        found.sort()
+        ui_bus.post(self.gallery.load, [path for _, path in found])
+
     def _clear_window(self):
         for widget in self.root.winfo_children():
             widget.destroy()
@@ -235,21 +272,24 @@ class P2PGUI:
         threading.Thread(target=self._send_file_logic, args=(filepath,), daemon=True).start()
 
     def _send_file_logic(self, filepath):
-        self.progress.set(0)
+        # Runs on a worker thread, so every widget update goes through the UI bus
+        ui_bus.post(self.progress.set, 0)
         success, message = file_transfer.send_file(
             self.conn, 
             filepath, 
-            progress_callback=self._update_progress
+            progress_callback=self._post_progress
         )
-        animator.show_animation("success" if success else "error", message)
-        self._append_chat(message, is_system=True)
+        ui_bus.post(animator.show_animation, "success" if success else "error", message)
+        ui_bus.post(self._append_chat, message, True)
 
     def _receive_loop_logic(self):
-        file_transfer.receive_loop(self.conn, callback=self._on_file_received)
+        file_transfer.receive_loop(self.conn, callback=ui_bus.wrap(self._on_file_received))
 
     def _on_file_received(self, message):
         if message.startswith("✨"):
             animator.show_animation("transfer", message[2:])
+        elif self.gallery and is_image(message) and os.path.isfile(message):
+            self.gallery.add(message)
         self._append_chat(message, is_system=True)
 
     def _send_chat(self):
@@ -261,20 +301,32 @@ class P2PGUI:
                 self.chat_handler.send(msg)
 
     def _append_chat(self, msg, is_system=False):
-        self.chat_box.configure(state='normal')
-        if "You:" in msg:
-            self.chat_box.tag_config('you', foreground=self.colors['secondary'])
-            self.chat_box.insert(tk.END, msg + '\n', 'you')
-        elif "Peer:" in msg:
-            self.chat_box.tag_config('peer', foreground=self.colors['accent'])
-            self.chat_box.insert(tk.END, msg + '\n', 'peer')
-        elif is_system:
-            self.chat_box.tag_config('system', foreground=self.colors['success'])
-            self.chat_box.insert(tk.END, msg + '\n', 'system')
-        else:
-            self.chat_box.insert(tk.END, msg + '\n')
-        self.chat_box.configure(state='disabled')
-        self.chat_box.yview(tk.END)
+        self.chat_view.append(msg, is_system)
+
+    def _on_chat_message(self, msg, timestamp):
+        # Stored messages carry their history timestamp, which paging anchors on
+        self.chat_view.append(msg, timestamp=timestamp)
+
+    def _format_history(self, entry):
+        who = "You" if entry['direction'] == "local" else "Peer"
+        return f"{format_timestamp(entry['timestamp'])} {who}: {entry['text']}"
+
+    def _load_older_history(self):
+        """Prepend the previous page of stored messages for this peer"""
+        peer_ip = self.peer_ip.get()
+        if not peer_ip:
+            return
+        entries = history.page(peer_ip, before_ts=self.chat_view.history_anchor)
+        self.chat_view.prepend([(self._format_history(e), e['timestamp']) for e in entries])
+
+    def _search_history(self):
+        query = simpledialog.askstring("Search History", "Search messages for:", parent=self.root)
+        if not query:
+            return
+        results = history.search(query, peer=self.peer_ip.get() or None)
+        self._append_chat(f"🔍 {len(results)} result(s) for '{query}'", is_system=True)
+        for entry in reversed(results):
+            self._append_chat(f"   {self._format_history(entry)}", is_system=True)
 
     def _create_progress_bar(self, parent):
         self.progress_frame = ttk.Frame(parent)
@@ -291,15 +343,26 @@ class P2PGUI:
                                             maximum=100)
         self.progress_bar.pack(fill=tk.X, pady=5)
 
+    def _post_progress(self, sent, total):
+        ui_bus.post_progress("send", self._update_progress, sent, total)
+
     def _update_progress(self, sent, total):
-        percent = (sent / total) * 100
+        percent = (sent / total) * 100 if total else 100
         self.progress.set(percent)
         self.progress_label.config(text=f"📊 Progress: {int(percent)}%")
         if percent >= 100:
             self.progress_label.config(text="🎉 Transfer complete!", fg=self.colors['success'])
 
 def start_gui():
-    os.makedirs(config.SHARED_FOLDER, exist_ok=True)
+    config.ensure_directories()
+    metrics.start_from_config()
+    catalog.start_watching()
+    if config.BROWSE_ENABLED:
+        from browse import browse_server
+        try:
+            browse_server.start()
+        except peer.PeerConnectionError as e:
+            print(f"⚠️ Browsing disabled: {str(e)}")
     root = TkinterDnD.Tk()
     sv_ttk.set_theme("dark")
     gui = P2PGUI(root)
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Iterator, Tuple
+from config import config
+from metrics import metrics
+
+# Fixed, not configurable: peers must agree on both for digests to match,
+# a file gets the same digest everywhere whatever the local settings
+TREE_CHUNK_SIZE = 4 * 1024 * 1024
+TREE_THRESHOLD = 256 * 1024 * 1024
+TREE_PREFIX = "tree-sha256:"
+
+HASHED_BYTES = metrics.counter("p2p_hashed_bytes_total", "File bytes hashed")
+HASH_TIME = metrics.histogram("p2p_hash_seconds", "Time to hash one file")
+
+def _read_range(path: str, offset: int, length: int, algorithm: str) -> bytes:
+    """Digest of `length` bytes starting at `offset`"""
+    hash_func = hashlib.new(algorithm)
+    buffer = bytearray(min(config.HASH_READ_SIZE, max(length, 1)))
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            count = f.readinto(view[:min(len(buffer), remaining)])
+            if not count:
+                break
+            # hashlib drops the GIL for buffers over 2 KB, so threads hash in parallel
+            hash_func.update(view[:count])
+            remaining -= count
+    return hash_func.digest()
+
+def hash_file(path: str, algorithm: str = "sha256") -> str:
+    """Plain digest of a whole file using large reads into one reused buffer"""
+    return _read_range(path, 0, os.path.getsize(path), algorithm).hex()
+
+class HashEngine:
+    """Hashes files on a thread pool.
+
+    Many files are hashed concurrently, one per worker. Files of at least
+    TREE_THRESHOLD bytes are split into TREE_CHUNK_SIZE pieces hashed
+    in parallel, and the digest of the concatenated chunk digests is
+    returned with a "tree-sha256:" prefix.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers
+        self._file_pool = None
+        self._chunk_pool = None
+        self._lock = threading.Lock()
+
+    def _pools(self) -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+        with self._lock:
+            if self._file_pool is None:
+                workers = self.workers or config.HASH_WORKERS or os.cpu_count() or 4
+                # Separate pools so a tree hash running on a file worker can
+                # never wait on chunks queued behind other files
+                self._file_pool = ThreadPoolExecutor(workers, thread_name_prefix="hash-file")
+                self._chunk_pool = ThreadPoolExecutor(workers, thread_name_prefix="hash-chunk")
+            return self._file_pool, self._chunk_pool
+
+    def digest(self, path: str) -> str:
+        """Content digest of one file, tree-hashed when it is large"""
+        started = time.perf_counter()
+        size = os.path.getsize(path)
+        if size >= TREE_THRESHOLD:
+            result = self.tree_digest(path, size)
+        else:
+            result = hash_file(path)
+        HASH_TIME.observe(time.perf_counter() - started)
+        HASHED_BYTES.inc(size)
+        return result
+
+    def tree_digest(self, path: str, size: Optional[int] = None) -> str:
+        size = os.path.getsize(path) if size is None else size
+        _, chunk_pool = self._pools()
+        offsets = range(0, max(size, 1), TREE_CHUNK_SIZE)
+        chunks = chunk_pool.map(lambda offset: _read_range(path, offset, TREE_CHUNK_SIZE, "sha256"), offsets)
+        return TREE_PREFIX + hashlib.sha256(b"".join(chunks)).hexdigest()
+
+    def hash_many(self, paths: List[str]) -> Iterator[Tuple[str, Optional[str]]]:
+        """Yield (path, digest) in input order, digest is None if the file couldn't be read"""
+        file_pool, _ = self._pools()
+
+        def safe_digest(path: str) -> Optional[str]:
+            try:
+                return self.digest(path)
+            except OSError:
+                return None
+
+        return zip(paths, file_pool.map(safe_digest, paths))
+
+# Global hashing engine
+hasher = HashEngine()
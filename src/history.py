@@ -0,0 +1,180 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional, List, Dict, Any
+from config import config
+from eventlog import get_logger
+
+log = get_logger("history")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    peer TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    text TEXT NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_peer ON messages (peer, id);
+CREATE INDEX IF NOT EXISTS idx_messages_peer_time ON messages (peer, timestamp);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+    USING fts5(text, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+class ChatHistory:
+    """Append-only chat history stored in SQLite, indexed per peer.
+
+    Writes are queued and committed in batches by a background thread so the
+    chat receive loop never waits on disk. Reads use paged queries keyed on an
+    indexed column, so loading a window of history costs the same regardless of how
+    many messages are stored.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, batch_size: int = 256):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.has_fts = False
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def _start(self):
+        """Create the schema and start the writer thread on first use"""
+        with self._lock:
+            if self._writer:
+                return
+            if not self.db_path:
+                self.db_path = str(config.HISTORY_DIR / "chat_history.db")
+                config.ensure_directories()
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+
+            conn = self._connect()
+            conn.executescript(_SCHEMA)
+            try:
+                conn.executescript(_FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                # SQLite built without FTS5, search falls back to LIKE scans
+                self.has_fts = False
+            conn.commit()
+
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=config.SOCKET_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def append(self, peer: str, direction: str, text: str, timestamp: Optional[float] = None):
+        """Queue a message for storage without blocking the caller"""
+        self._start()
+        self._queue.put((peer or "unknown", direction, text, timestamp or time.time()))
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows = [row for row in batch if row is not None]
+            if rows:
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT INTO messages (peer, direction, text, timestamp) VALUES (?, ?, ?, ?)",
+                            rows
+                        )
+                except sqlite3.Error as e:
+                    log.error(f"❌ Failed to store chat history: {e}")
+
+            for _ in batch:
+                self._queue.task_done()
+            if None in batch:
+                break
+
+    def flush(self):
+        """Block until every queued message has been written"""
+        if self._writer:
+            self._queue.join()
+
+    def page(self, peer: str, before_id: Optional[int] = None,
+             limit: Optional[int] = None,
+             before_ts: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Return up to `limit` messages older than `before_id` or `before_ts`, oldest first"""
+        self._start()
+        limit = limit or config.HISTORY_PAGE_SIZE
+        if before_ts is not None:
+            rows = self._connect().execute(
+                "SELECT * FROM messages WHERE peer = ? AND timestamp < ? ORDER BY timestamp DESC LIMIT ?",
+                (peer, before_ts, limit)
+            ).fetchall()
+        elif before_id is not None:
+            rows = self._connect().execute(
+                "SELECT * FROM messages WHERE peer = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (peer, before_id, limit)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM messages WHERE peer = ? ORDER BY id DESC LIMIT ?",
+                (peer, limit)
+            ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def search(self, query: str, peer: Optional[str] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Full-text search over stored messages, newest matches first"""
+        self._start()
+        limit = limit or config.HISTORY_PAGE_SIZE
+        if not query.strip():
+            return []
+
+        if self.has_fts:
+            # Quote every term so user input is never parsed as FTS syntax
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+            sql = ("SELECT m.* FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                   "WHERE messages_fts MATCH ?")
+            params = [match]
+        else:
+            sql = "SELECT m.* FROM messages m WHERE m.text LIKE ?"
+            params = [f"%{query}%"]
+
+        if peer:
+            sql += " AND m.peer = ?"
+            params.append(peer)
+        sql += " ORDER BY m.id DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._connect().execute(sql, params).fetchall()]
+
+    def close(self):
+        """Flush pending writes and stop the writer thread"""
+        if self._writer:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        conn = getattr(self._local, "conn", None)
+        if conn:
+            conn.close()
+            self._local.conn = None
+
+# Global history instance
+history = ChatHistory()
@@ -0,0 +1,444 @@
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from typing import Dict, Any, List, Optional, Tuple
+from config import config, DEFAULT_CONFIG
+from benchmark import _percentile, _git_commit, _write_data
+
+# Hundreds of simulated peers in one process, each with its own transfer
+# and chat connection, against a node running the real peer, file_transfer
+# and chat code on loopback. Every peer count runs in a fresh interpreter,
+# so threads, memory and config from one level don't leak into the next.
+
+DEFAULT_MIX = "chat=5,small=3,medium=1"
+FILE_SIZES = {"small": 16 * 1024, "medium": 1024 * 1024}
+
+# ======================
+# MEASUREMENT
+# ======================
+
+def _rss_kb() -> int:
+    """Current resident set size; falls back to the peak where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * (os.sysconf("SC_PAGE_SIZE") // 1024)
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == "darwin" else peak
+
+def _jain(values: List[float]) -> float:
+    """Jain's fairness index: 1.0 when every peer got the same share, 1/n when one got it all"""
+    values = [value for value in values if value > 0]
+    if not values:
+        return 0.0
+    return sum(values) ** 2 / (len(values) * sum(value * value for value in values))
+
+def _raise_fd_limit(needed: int):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+        except (ValueError, OSError):
+            pass
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """"chat=5,small=3,medium=1" -> relative weights per action"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("chat", "small", "medium"):
+            raise ValueError(f"Unknown action '{name}' (use chat, small or medium)")
+        mix[name] = float(weight or 1)
+    return mix
+
+# ======================
+# NODE
+# ======================
+
+class Node:
+    """The node under test: the same accept loops as 'cli.py serve', on ephemeral ports"""
+
+    def __init__(self, dest: str, backlog: int):
+        import chat
+        import file_transfer
+        import peer
+
+        self.dest = dest
+        self.files = {}
+        self.chat_messages = {}
+        self.chat_latencies = []
+        self.chats = []
+        self._lock = threading.Lock()
+
+        self.listener = peer.create_listener(0, backlog=backlog)
+        DEFAULT_CONFIG['PORT'] = self.listener.getsockname()[1]
+        self.chat_listener = peer.create_listener(0, backlog=backlog)
+        DEFAULT_CONFIG['CHAT_PORT'] = self.chat_listener.getsockname()[1]
+
+        node = self
+
+        class NodeChat(chat.ChatHandler):
+            """Server-side chat fed by the node's shared listener instead of binding CHAT_PORT itself"""
+
+            def __init__(self, conn, on_message):
+                self._accepted = conn
+                super().__init__(True, None, on_message)
+
+            def _start_server(self):
+                if self._accepted is None:
+                    raise chat.ChatError("Simulated peers don't reconnect")
+                self.conn, self._accepted = self._accepted, None
+                self.peer_ip = self.conn.getpeername()[0]
+                self.conn.settimeout(config.SOCKET_TIMEOUT)
+
+        def on_chat(msg: str, timestamp=None):
+            parts = msg.split()
+            if "load" in parts:
+                at = parts.index("load")
+                peer_id, sent_at = parts[at + 1], float(parts[at + 3])
+                with node._lock:
+                    node.chat_messages[peer_id] = node.chat_messages.get(peer_id, 0) + 1
+                    node.chat_latencies.append((time.time() - sent_at) * 1000)
+
+        def on_file(message: str):
+            if os.path.isfile(message):
+                peer_id = os.path.basename(message).split("_", 1)[0]
+                with node._lock:
+                    node.files[peer_id] = node.files.get(peer_id, 0) + 1
+
+        def accept_transfers():
+            while True:
+                try:
+                    conn, _ = self.listener.accept()
+                except OSError:
+                    return
+                conn.settimeout(None)
+                threading.Thread(target=self._serve, args=(file_transfer, conn, on_file), daemon=True).start()
+
+        def accept_chats():
+            while True:
+                try:
+                    conn, _ = self.chat_listener.accept()
+                except OSError:
+                    return
+                threading.Thread(target=lambda: self.chats.append(NodeChat(conn, on_chat)), daemon=True).start()
+
+        threading.Thread(target=accept_transfers, daemon=True).start()
+        threading.Thread(target=accept_chats, daemon=True).start()
+
+    def _serve(self, file_transfer, conn, on_file):
+        file_transfer.receive_loop(conn, callback=on_file, dest_dir=self.dest)
+        conn.close()
+
+    def close(self):
+        self.listener.close()
+        self.chat_listener.close()
+        for handler in self.chats:
+            handler.close()
+
+# ======================
+# SIMULATED PEERS
+# ======================
+
+class SimPeer:
+    """One simulated peer: a real transfer connection and a real chat client"""
+
+    def __init__(self, peer_id: str, files: Dict[str, str], mix: Dict[str, float],
+                 think_ms: float, burst: int, seed: int):
+        self.id = peer_id
+        self.files = files
+        self.actions = list(mix)
+        self.weights = [mix[action] for action in self.actions]
+        self.think = think_ms / 1000
+        self.burst = burst
+        self.random = random.Random(seed)
+        self.conn = None
+        self.chat = None
+        self.connect_ms = None
+        self.errors: List[str] = []
+        self.bytes_sent = 0
+        self.transfer_seconds = 0.0
+        self.files_sent = 0
+        self.files_failed = 0
+        self.chat_sent = 0
+
+    def connect(self) -> bool:
+        import chat
+        import peer
+
+        started = time.perf_counter()
+        self.conn = peer.connect_to_peer('127.0.0.1')
+        if not self.conn:
+            self.errors.append("transfer connect failed")
+            return False
+        self.conn.settimeout(config.SOCKET_TIMEOUT)
+        self.chat = chat.ChatHandler(False, '127.0.0.1', lambda msg, timestamp: None)
+        if not self.chat.connection_established:
+            self.errors.append("chat connect failed")
+            return False
+        self.connect_ms = (time.perf_counter() - started) * 1000
+        return True
+
+    def run(self, until: float):
+        import file_transfer
+
+        while time.monotonic() < until:
+            action = self.random.choices(self.actions, self.weights)[0]
+            if action == "chat":
+                for _ in range(self.burst):
+                    self.chat_sent += 1
+                    self.chat.send(f"load {self.id} {self.chat_sent} {time.time()}")
+            else:
+                started = time.perf_counter()
+                success, message = file_transfer.send_file(self.conn, self.files[action])
+                if success:
+                    self.transfer_seconds += time.perf_counter() - started
+                    self.bytes_sent += FILE_SIZES[action]
+                    self.files_sent += 1
+                else:
+                    self.files_failed += 1
+                    self.errors.append(message)
+                    return
+            time.sleep(self.random.expovariate(1 / self.think) if self.think else 0)
+
+    def close(self):
+        if self.chat:
+            self.chat.close()
+        if self.conn:
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.conn.close()
+
+def _peer_files(folder: str, peer_id: str, base: Dict[str, str]) -> Dict[str, str]:
+    """Per-peer names for the shared payloads (hard links where possible), so peers never share a .part"""
+    files = {}
+    for action, path in base.items():
+        target = os.path.join(folder, f"{peer_id}_{action}.bin")
+        if not os.path.exists(target):
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copyfile(path, target)
+        files[action] = target
+    return files
+
+def run_level(peers: int, duration: float, ramp: float, mix: Dict[str, float],
+              think_ms: float, burst: int, backlog: int) -> Dict[str, Any]:
+    """Run `peers` simulated peers against one node and measure it"""
+    from history import history
+
+    _raise_fd_limit(peers * 8 + 256)
+    workdir = tempfile.mkdtemp(prefix="p2p-load-")
+    history.db_path = os.path.join(workdir, "history.db")
+    payloads, dest = os.path.join(workdir, "payloads"), os.path.join(workdir, "received")
+    os.makedirs(payloads)
+    os.makedirs(dest)
+    base = {}
+    for action, size in FILE_SIZES.items():
+        base[action] = os.path.join(payloads, f"base_{action}.bin")
+        _write_data(base[action], size, "random")
+
+    rss_start = _rss_kb()
+    threads_start = threading.active_count()
+    node = Node(dest, backlog)
+    sims = [SimPeer(f"p{n:04d}", _peer_files(payloads, f"p{n:04d}", base), mix, think_ms, burst, seed=n)
+            for n in range(peers)]
+
+    # Connect in waves across the ramp, like peers joining over time
+    connected = []
+    lock = threading.Lock()
+
+    def join(sim: SimPeer, delay: float):
+        time.sleep(delay)
+        try:
+            ok = sim.connect()
+        except Exception as e:
+            sim.errors.append(f"connect: {str(e)}")
+            ok = False
+        if ok:
+            with lock:
+                connected.append(sim)
+
+    joiners = [threading.Thread(target=join, args=(sim, ramp * n / max(1, peers)), daemon=True)
+               for n, sim in enumerate(sims)]
+    for thread in joiners:
+        thread.start()
+    for thread in joiners:
+        thread.join()
+
+    # Let the node's chat handlers finish their resume exchange before measuring idle memory
+    time.sleep(0.5)
+    rss_connected = _rss_kb()
+    threads_connected = threading.active_count()
+
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    wall_start = time.perf_counter()
+    until = time.monotonic() + duration
+    workers = [threading.Thread(target=sim.run, args=(until,), daemon=True) for sim in connected]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join(duration + config.SOCKET_TIMEOUT)
+    wall = time.perf_counter() - wall_start
+
+    # Give the node a moment to take in the last chat messages
+    expected_chat = sum(sim.chat_sent for sim in connected)
+    deadline = time.monotonic() + 5
+    while sum(node.chat_messages.values()) < expected_chat and time.monotonic() < deadline:
+        time.sleep(0.05)
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    rss_end = _rss_kb()
+
+    for sim in sims:
+        sim.close()
+    node.close()
+
+    connect_times = [sim.connect_ms for sim in connected]
+    rates = [sim.bytes_sent / sim.transfer_seconds / (1 << 20) if sim.transfer_seconds else 0.0
+             for sim in connected]
+    files_sent = sum(sim.files_sent for sim in connected)
+    files_failed = sum(sim.files_failed for sim in sims)
+    chat_received = sum(node.chat_messages.values())
+    errors = [error for sim in sims for error in sim.errors]
+    attempts = peers + files_sent + files_failed + expected_chat
+    failures = (peers - len(connected)) + files_failed + max(0, expected_chat - chat_received)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "peers": peers,
+        "connected": len(connected),
+        "connect_p50_ms": round(_percentile(connect_times, 50), 2),
+        "connect_p99_ms": round(_percentile(connect_times, 99), 2),
+        "files_sent": files_sent,
+        "files_failed": files_failed,
+        "files_received": sum(node.files.values()),
+        "chat_sent": expected_chat,
+        "chat_received": chat_received,
+        "chat_p50_ms": round(_percentile(node.chat_latencies, 50), 2),
+        "chat_p99_ms": round(_percentile(node.chat_latencies, 99), 2),
+        "throughput_mb_s": round(sum(sim.bytes_sent for sim in connected) / wall / (1 << 20), 2) if wall else 0,
+        "per_peer_mb_s_min": round(min(rates), 3) if rates else 0,
+        "per_peer_mb_s_max": round(max(rates), 3) if rates else 0,
+        "fairness": round(_jain(rates), 3),
+        "error_rate": round(failures / attempts, 4) if attempts else 0,
+        "errors": sorted(set(errors))[:5],
+        "rss_kb_per_session": round((rss_connected - rss_start) / max(1, len(connected)), 1),
+        "rss_kb_end": rss_end,
+        "threads_per_session": round((threads_connected - threads_start) / max(1, len(connected)), 2),
+        "cpu_seconds": round((cpu_end.ru_utime + cpu_end.ru_stime) - (cpu_start.ru_utime + cpu_start.ru_stime), 2),
+        "seconds": round(wall, 2),
+    }
+
+# ======================
+# HARNESS
+# ======================
+
+def _run_worker(spec: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """Run one peer count in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "_worker", json.dumps(spec)],
+        capture_output=True, text=True, cwd=workdir
+    )
+    if result.returncode != 0:
+        return {"peers": spec["peers"], "error": result.stderr.strip().splitlines()[-1:] or ["worker failed"]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def breaking_point(levels: List[Dict[str, Any]], max_error_rate: float,
+                   max_connect_ms: float) -> Optional[Tuple[int, str]]:
+    """First peer count that failed or broke the error-rate or connect-time limit"""
+    for level in levels:
+        if "error" in level:
+            return level["peers"], f"worker failed: {level['error']}"
+        if level["error_rate"] > max_error_rate:
+            return level["peers"], f"error rate {level['error_rate']:.2%} > {max_error_rate:.2%}"
+        if level["connect_p99_ms"] > max_connect_ms:
+            return level["peers"], f"p99 connect {level['connect_p99_ms']} ms > {max_connect_ms} ms"
+    return None
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["_worker"]:
+        spec = json.loads(argv[1])
+        # Library status output would corrupt the JSON result line
+        with redirect_stdout(sys.stderr):
+            result = run_level(spec["peers"], spec["duration"], spec["ramp"], spec["mix"],
+                               spec["think_ms"], spec["burst"], spec["backlog"])
+            from eventlog import event_log
+            event_log.flush()
+        print(json.dumps(result))
+        return 0
+
+    parser = argparse.ArgumentParser(prog="loadtest",
+                                     description="Simulate many peers against one node on loopback")
+    parser.add_argument("--peers", nargs="+", type=int, default=[10, 50, 100, 200],
+                        help="peer counts to try, in order (default: 10 50 100 200)")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of traffic per peer count")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which peers connect")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"relative weights of chat bursts and small/medium files (default: {DEFAULT_MIX})")
+    parser.add_argument("--think-ms", type=float, default=200, help="mean pause between a peer's actions")
+    parser.add_argument("--burst", type=int, default=5, help="chat messages per chat burst")
+    parser.add_argument("--backlog", type=int, default=512, help="node listen backlog")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="breaking point: error rate above this")
+    parser.add_argument("--max-connect-ms", type=float, default=1000, help="breaking point: p99 connect time above this")
+    parser.add_argument("--stop-at-break", action="store_true", help="skip larger peer counts once one breaks")
+    parser.add_argument("--out", default="loadtest_results.json", help="results file")
+    parser.add_argument("--workdir", help="working directory for the node (logs, history)")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "p2p-loadtest")
+    os.makedirs(workdir, exist_ok=True)
+
+    levels = []
+    for peers in args.peers:
+        spec = {"peers": peers, "duration": args.duration, "ramp": args.ramp, "mix": mix,
+                "think_ms": args.think_ms, "burst": args.burst, "backlog": args.backlog}
+        level = _run_worker(spec, workdir)
+        levels.append(level)
+        if "error" in level:
+            print(f"❌ {peers} peers: {level['error']}", file=sys.stderr)
+        else:
+            print(f"📊 {peers:>5d} peers  connect p50 {level['connect_p50_ms']} / p99 {level['connect_p99_ms']} ms  "
+                  f"{level['throughput_mb_s']} MB/s  fairness {level['fairness']}  "
+                  f"errors {level['error_rate']:.2%}  {level['rss_kb_per_session']} KB/session",
+                  file=sys.stderr)
+        if args.stop_at_break and breaking_point([level], args.max_error_rate, args.max_connect_ms):
+            break
+
+    broken = breaking_point(levels, args.max_error_rate, args.max_connect_ms)
+    if broken:
+        print(f"💥 Breaking point: {broken[0]} peers ({broken[1]})", file=sys.stderr)
+    else:
+        print(f"✅ No breaking point up to {levels[-1]['peers']} peers", file=sys.stderr)
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "mix": mix,
+        "duration": args.duration,
+        "levels": levels,
+        "breaking_point": {"peers": broken[0], "reason": broken[1]} if broken else None,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results saved to {args.out}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,49 @@
 import os
 import sys
 import time
-from gui import start_gui
 from config import config
-from animation import show_startup_animation
 from utils import clear_screen, display_header, check_dependencies
 
 def setup_environment():
-    """Create necessary directories and validate permissions"""
-    try:
-        os.makedirs(config.SHARED_FOLDER, exist_ok=True)
-        test_file = os.path.join(config.SHARED_FOLDER, '.permission_test')
-        with open(test_file, 'w') as f:
-            f.write('test')
-        os.remove(test_file)
-        return True, f"✔️ Environment ready (Shared folder: {config.SHARED_FOLDER})"
-    except PermissionError:
-        return False, f"❌ Permission denied for shared folder: {config.SHARED_FOLDER}"
-    except Exception as e:
-        return False, f"❌ Environment setup failed: {str(e)}"
+    """Load the layered config, then create necessary directories and validate permissions"""
+    success, message = config.load()
+    if not success:
+        return success, message
+    config.watch()
+    return config.ensure_directories()
 
 def main():
     """Main application entry point"""
+    args = sys.argv[1:]
+    # Cosmetic pauses are skipped for scripted launches
+    fast = "--fast" in args or os.environ.get("P2P_FAST_STARTUP") == "1"
+    args = [arg for arg in args if arg != "--fast"]
+    pause = (lambda seconds: None) if fast else time.sleep
+
+    if args:
+        # Subcommands run headless, without Tk or the startup screen
+        import cli
+        sys.exit(cli.main(args))
+
     try:
-        clear_screen()
-        display_header()
-        show_startup_animation()
+        if not fast:
+            clear_screen()
+            display_header()
         
         if not check_dependencies():
-            time.sleep(3)
+            pause(3)
             sys.exit(1)
         
         success, message = setup_environment()
         print(f"\n{message}")
         if not success:
-            time.sleep(3)
+            pause(3)
             sys.exit(1)
         
         print("\n🚀 Starting P2P Share application...")
-        time.sleep(1)
+        pause(1)
+        # Imported here so headless runs never load Tk, PIL or the themes
+        from gui import start_gui
         start_gui()
         
     except KeyboardInterrupt:
@@ -48,7 +53,7 @@ def main():
         print(f"\n💥 Critical error: {str(e)}")
         import traceback
         traceback.print_exc()
-        time.sleep(5)
+        pause(5)
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Tuple
+from config import config
+
+# Seconds, for syscall and setup timings
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# MB/s, for per-transfer throughput
+THROUGHPUT_BUCKETS = (1, 5, 10, 50, 100, 250, 500, 1000, 2500)
+
+class Counter:
+    """Monotonically increasing value"""
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self) -> Any:
+        return self.value
+
+class Gauge:
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def snapshot(self) -> Any:
+        return self.value
+
+class Histogram:
+    """Bucketed distribution with a running sum and count"""
+    kind = "histogram"
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Any:
+        with self._lock:
+            return {"buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+                    "sum": self.sum, "count": self.count}
+
+class MetricsRegistry:
+    """Process-wide collection of named metrics, optionally labelled"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Dict[Tuple, Any]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._dumper = None
+
+    def _get(self, cls, name: str, help_text: str, labels: Dict[str, str], **kwargs):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._metrics.setdefault(name, {})
+            self._help.setdefault(name, help_text)
+            if key not in family:
+                family[key] = cls(**kwargs)
+            return family[key]
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = "", **labels) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = "",
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def _families(self) -> List[Tuple[str, Dict[Tuple, Any]]]:
+        with self._lock:
+            return [(name, dict(family)) for name, family in sorted(self._metrics.items())]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Snapshot of every metric, for the JSON dump"""
+        result = {}
+        for name, family in self._families():
+            result[name] = [{"labels": dict(key), "value": metric.snapshot()}
+                            for key, metric in family.items()]
+        return result
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, family in self._families():
+            kind = next(iter(family.values())).kind
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in family.items():
+                if kind == "histogram":
+                    snap = metric.snapshot()
+                    cumulative = 0
+                    for bound, count in snap["buckets"].items():
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(key, le=bound)} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(key)} {snap['sum']}")
+                    lines.append(f"{name}_count{_labels(key)} {snap['count']}")
+                else:
+                    lines.append(f"{name}{_labels(key)} {metric.snapshot()}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port: int, host: str = "127.0.0.1"):
+        """Serve /metrics (Prometheus text) and /metrics.json on a local port"""
+        if self._server:
+            return
+        # http.server pulls in email, http.client and ssl, only import it when asked
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body, content_type = json.dumps(registry.to_dict()).encode(), "application/json"
+                elif self.path.startswith("/metrics"):
+                    body, content_type = registry.render_prometheus().encode(), "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the console
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def start_json_dump(self, path: str, interval: float):
+        """Periodically write a JSON snapshot of every metric to `path`"""
+        if self._dumper:
+            return
+
+        def dump_loop():
+            while True:
+                time.sleep(interval)
+                snapshot = {"timestamp": time.time(), "metrics": self.to_dict()}
+                temp_path = path + ".tmp"
+                try:
+                    with open(temp_path, 'w') as f:
+                        json.dump(snapshot, f)
+                    os.replace(temp_path, path)
+                except OSError as e:
+                    print(f"⚠️ Failed to write metrics: {str(e)}")
+
+        self._dumper = threading.Thread(target=dump_loop, daemon=True)
+        self._dumper.start()
+
+    def start_from_config(self):
+        """Start the exporters enabled in the configuration"""
+        if config.METRICS_PORT:
+            self.start_http_server(config.METRICS_PORT)
+        if config.METRICS_DUMP_INTERVAL:
+            self.start_json_dump(str(config.LOG_DIR / "metrics.json"), config.METRICS_DUMP_INTERVAL)
+
+def _labels(key: Tuple, **extra) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+# Global metrics registry
+metrics = MetricsRegistry()
@@ -1,7 +1,10 @@
+import logging
 import socket
 import time
 from typing import Optional
 from config import config
+from metrics import metrics
+from eventlog import get_logger, log_event
 from utils import get_local_ip
 from animation import show_connection_animation
 
@@ -9,16 +12,31 @@ class PeerConnectionError(Exception):
     """Custom exception for peer connection issues"""
     pass
 
-# Modified display_network_status with ANSI colors
+CONNECT_ATTEMPTS = metrics.counter("p2p_connect_attempts_total", "Outgoing peer connection attempts")
+CONNECT_FAILURES = metrics.counter("p2p_connect_failures_total", "Failed outgoing peer connection attempts")
+CONNECT_TIME = metrics.histogram("p2p_connect_seconds", "Time to establish an outgoing peer connection")
+ACCEPTED = metrics.counter("p2p_connections_accepted_total", "Incoming peer connections accepted")
+
+log = get_logger("peer")
+_STATUS_LEVELS = {"info": logging.INFO, "success": logging.INFO,
+                  "warning": logging.WARNING, "error": logging.ERROR}
+
 def display_network_status(message, status="info"):
-    colors = {
-        "info": '34',     # Blue
-        "success": '32',  # Green
-        "error": '31',    # Red
-        "warning": '33'   # Yellow
-    }
-    color_code = colors.get(status, '37')  # Default to white
-    print(f"\033[1;{color_code}m{message}\033[0m", flush=True)
+    """Queue a colored status line for the console and the log file"""
+    log_event(log, _STATUS_LEVELS.get(status, logging.INFO), message, style=status, status=status)
+
+def create_listener(port: int, backlog: int = 1, timeout: Optional[float] = None) -> socket.socket:
+    """Create a bound, listening TCP socket on the given port"""
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.settimeout(timeout)
+    try:
+        server_socket.bind(('', port))
+    except OSError as e:
+        server_socket.close()
+        raise PeerConnectionError(f"❌ Port {port} is already in use") from e
+    server_socket.listen(backlog)
+    return server_socket
 
 def start_server() -> socket.socket:
     """Start a listening server and accept a connection"""
@@ -26,24 +44,17 @@ def start_server() -> socket.socket:
     conn = None
     try:
         display_network_status("🔄 Starting server...", "info")
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.settimeout(config.SOCKET_TIMEOUT)
-        
-        try:
-            server_socket.bind(('', config.PORT))
-        except OSError as e:
-            raise PeerConnectionError(f"❌ Port {config.PORT} is already in use") from e
-            
-        server_socket.listen(1)
+        server_socket = create_listener(config.PORT, timeout=config.SOCKET_TIMEOUT)
         local_ip = get_local_ip()
         display_network_status(f"👂 Listening on {local_ip}:{config.PORT}...", "success")
         show_connection_animation("Waiting for connection")
         
         try:
             conn, addr = server_socket.accept()
+            ACCEPTED.inc()
             display_network_status(f"✅ Connected by {addr[0]}", "success")
             show_connection_animation(f"Connection established with {addr[0]}")
+            server_socket.close()
             return conn
         except socket.timeout:
             raise PeerConnectionError("⌛ Connection timed out")
@@ -55,22 +66,35 @@ def start_server() -> socket.socket:
         if server_socket and conn is None:
             server_socket.close()
 
-def connect_to_peer(ip: str) -> Optional[socket.socket]:
-    """Connect to a peer with retry logic"""
+def connect_to_peer(ip: str, transport: Optional[str] = None) -> Optional[socket.socket]:
+    """Connect to a peer with retry logic.
+
+    transport "udp" connects to the peer's UDP_PORT instead; the result
+    behaves like a socket for send_file and receive_file.
+    """
+    transport = transport or config.TRANSPORT
     for attempt in range(1, config.MAX_RETRIES + 1):
         try:
             display_network_status(f"🔗 Connecting to {ip} (attempt {attempt}/{config.MAX_RETRIES})...", "info")
             show_connection_animation(f"Connecting to {ip}")
             
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(config.SOCKET_TIMEOUT)
-            sock.connect((ip, config.PORT))
+            CONNECT_ATTEMPTS.inc()
+            connect_start = time.perf_counter()
+            if transport == "udp":
+                import udp_transport
+                sock = udp_transport.connect((ip, config.UDP_PORT), timeout=config.SOCKET_TIMEOUT)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.settimeout(config.SOCKET_TIMEOUT)
+                sock.connect((ip, config.PORT))
+            CONNECT_TIME.observe(time.perf_counter() - connect_start)
             
             display_network_status(f"✅ Successfully connected to {ip}", "success")
             show_connection_animation(f"Connected to {ip}")
             return sock
             
         except (socket.timeout, ConnectionRefusedError, socket.error) as e:
+            CONNECT_FAILURES.inc()
             display_network_status(f"⚠️ Attempt {attempt} failed: {str(e)}", "warning")
             if attempt < config.MAX_RETRIES:
                 time.sleep(config.RETRY_DELAY)
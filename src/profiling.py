@@ -0,0 +1,176 @@
+import io
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+from config import config
+from utils import safe_filename
+
+# Profiles running in tracemalloc mode, and whether tracing was off before the first
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+def _start_tracing():
+    global _tracing_users, _tracing_started
+    # Imported here like cProfile, the module is only needed in this mode
+    import tracemalloc
+    with _tracing_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            _tracing_started = True
+        _tracing_users += 1
+        # The report's peak covers this transfer, not the process so far
+        tracemalloc.reset_peak()
+
+def _stop_tracing():
+    """Stop tracing once the last traced profile ends, if a profile turned it on"""
+    global _tracing_users, _tracing_started
+    import tracemalloc
+    with _tracing_lock:
+        _tracing_users -= 1
+        if not _tracing_users and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+class TransferProfile:
+    """Accumulates timing spans for one transfer or chat session.
+
+    Spans are plain (total, count, max) accumulators keyed by name, so
+    recording one costs two perf_counter calls and a list update.
+    """
+
+    def __init__(self, kind: str, name: str, mode: str):
+        self.kind = kind
+        self.name = name
+        self.mode = mode
+        self.spans: Dict[str, list] = {}
+        self.counters: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self._cprofile = None
+        self._lock = threading.Lock()
+
+        if mode == "cprofile":
+            # Imported here, so the CLI doesn't pay for it at startup
+            import cProfile
+            # cProfile only sees the thread that enabled it, which is the
+            # thread running the transfer loop
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif mode == "tracemalloc":
+            _start_tracing()
+
+    def mark(self) -> float:
+        return time.perf_counter()
+
+    def add(self, span: str, started: float):
+        """Record the time since `started` (a value from mark()) under `span`"""
+        self.record(span, time.perf_counter() - started)
+
+    def record(self, span: str, elapsed: float):
+        with self._lock:
+            entry = self.spans.get(span)
+            if entry is None:
+                self.spans[span] = [elapsed, 1, elapsed]
+            else:
+                entry[0] += elapsed
+                entry[1] += 1
+                if elapsed > entry[2]:
+                    entry[2] = elapsed
+
+    def count(self, counter: str, amount: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def finish(self, **extra) -> Optional[str]:
+        """Write the per-span breakdown to LOG_DIR/profiles and return its path"""
+        wall = time.perf_counter() - self.started
+        report: Dict[str, Any] = {
+            "kind": self.kind,
+            "name": self.name,
+            "mode": self.mode,
+            "wall_ms": round(wall * 1000, 3),
+            "counters": self.counters,
+            "spans": {},
+            **extra,
+        }
+        for span, (total, count, longest) in sorted(self.spans.items(), key=lambda item: -item[1][0]):
+            report["spans"][span] = {
+                "total_ms": round(total * 1000, 3),
+                "count": count,
+                "mean_us": round(total / count * 1e6, 2),
+                "max_us": round(longest * 1e6, 2),
+                "share": round(total / wall, 4) if wall else 0,
+            }
+        unaccounted = wall - sum(entry[0] for entry in self.spans.values())
+        report["unaccounted_ms"] = round(max(0.0, unaccounted) * 1000, 3)
+
+        base = os.path.join(str(config.LOG_DIR), "profiles",
+                            f"{time.strftime('%Y%m%d-%H%M%S')}_{self.kind}_{safe_filename(self.name)[:60]}")
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+
+        if self._cprofile:
+            # Disabled before the import, or loading pstats tops the report
+            self._cprofile.disable()
+            import pstats
+            self._cprofile.dump_stats(base + ".prof")
+            text = io.StringIO()
+            pstats.Stats(self._cprofile, stream=text).sort_stats("cumulative").print_stats(25)
+            report["cprofile_top"] = text.getvalue().splitlines()
+        elif self.mode == "tracemalloc":
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            _stop_tracing()
+            report["tracemalloc"] = {
+                "current_kb": current // 1024,
+                "peak_kb": peak // 1024,
+                "top": [str(stat) for stat in snapshot.statistics("lineno")[:20]],
+            }
+
+        try:
+            with open(base + ".json", 'w') as f:
+                json.dump(report, f, indent=2)
+        except OSError as e:
+            print(f"⚠️ Failed to write profile: {str(e)}")
+            return None
+        return base + ".json"
+
+class _NullProfile:
+    """Stand-in used when profiling is off, every call is a no-op"""
+
+    def mark(self) -> float:
+        return 0.0
+
+    def add(self, span: str, started: float):
+        pass
+
+    def record(self, span: str, elapsed: float):
+        pass
+
+    def count(self, counter: str, amount: int = 1):
+        pass
+
+    def finish(self, **extra) -> Optional[str]:
+        return None
+
+NULL_PROFILE = _NullProfile()
+
+class Profiler:
+    """Hands out per-transfer profiles according to the PROFILE setting.
+
+    PROFILE is empty (off), "spans" (timing spans only), "cprofile" (spans plus
+    a cProfile of the transfer thread) or "tracemalloc" (spans plus the top
+    allocation sites at the end of the transfer).
+    """
+
+    MODES = ("spans", "cprofile", "tracemalloc")
+
+    def begin(self, kind: str, name: str):
+        mode = config.PROFILE
+        if mode not in self.MODES:
+            return NULL_PROFILE
+        return TransferProfile(kind, name, mode)
+
+# Global profiler instance
+profiler = Profiler()
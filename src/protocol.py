@@ -0,0 +1,73 @@
+import json
+import socket
+import struct
+from typing import Optional, Dict, Any, Tuple
+from config import config
+
+# Every frame is a 4-byte big-endian length followed by that many bytes of
+# UTF-8 JSON. File data, when a frame announces some, follows as raw bytes.
+_LENGTH = struct.Struct(">I")
+
+class ProtocolError(Exception):
+    """Malformed or oversized frame from a peer"""
+    pass
+
+def tune_socket(sock: socket.socket):
+    """Request/response traffic: send small frames immediately instead of waiting on Nagle"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        # Not a TCP socket (socketpair in tests and benchmarks)
+        pass
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message, separators=(",", ":")).encode()
+    if len(body) > config.MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(body)} bytes exceeds MAX_FRAME_SIZE")
+    return _LENGTH.pack(len(body)) + body
+
+def send_frame(sock: socket.socket, message: Dict[str, Any]):
+    # Length and body go out in one call so they share a segment
+    sock.sendall(encode_frame(message))
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    """Read exactly `size` bytes, raising ConnectionError if the peer goes away first"""
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = sock.recv(size - len(buffer))
+        if not data:
+            raise ConnectionError("Connection closed unexpectedly")
+        buffer += data
+    return bytes(buffer)
+
+def _parse(body: bytes) -> Dict[str, Any]:
+    try:
+        message = json.loads(body)
+    except ValueError as e:
+        raise ProtocolError(f"Invalid frame: {str(e)}") from e
+    if not isinstance(message, dict):
+        raise ProtocolError("Frame is not a JSON object")
+    return message
+
+def recv_frame(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """Read one frame, or None if the peer closed the connection between frames"""
+    first = sock.recv(_LENGTH.size)
+    if not first:
+        return None
+    message, _ = recv_frame_after(sock, first)
+    return message
+
+def recv_frame_after(sock: socket.socket, buffered: bytes) -> Tuple[Dict[str, Any], bytes]:
+    """Finish a frame whose first bytes were already read.
+
+    Returns the frame and whatever bytes were buffered past its end.
+    """
+    if len(buffered) < _LENGTH.size:
+        buffered += recv_exact(sock, _LENGTH.size - len(buffered))
+    (length,) = _LENGTH.unpack(buffered[:_LENGTH.size])
+    if length > config.MAX_FRAME_SIZE:
+        raise ProtocolError(f"Peer sent a {length} byte frame, limit is {config.MAX_FRAME_SIZE}")
+    end = _LENGTH.size + length
+    if len(buffered) < end:
+        buffered += recv_exact(sock, end - len(buffered))
+    return _parse(buffered[_LENGTH.size:end]), buffered[end:]
@@ -0,0 +1,484 @@
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import shutil
+import struct
+import threading
+import time
+from typing import Optional, List, Dict, Any, Callable, Set, Tuple
+from config import config
+from catalog import SharedCatalog, catalog
+from file_transfer import stream_file, receive_exact
+from metrics import metrics
+from protocol import send_frame, recv_frame, recv_exact, ProtocolError
+from eventlog import get_logger
+
+log = get_logger("sync")
+
+SYNC_BYTES_SAVED = metrics.counter("p2p_sync_bytes_saved_total", "File bytes not sent thanks to delta sync")
+SYNC_OPS = {kind: metrics.counter("p2p_sync_ops_total", "Changes propagated by sync", kind=kind)
+            for kind in ("put", "patch", "delete", "skip")}
+
+# ======================
+# WATCHERS
+# ======================
+
+class PollingWatcher:
+    """Detects changes by rescanning the folder through its own catalog.
+
+    Works everywhere. Each poll costs one stat per file, only files whose
+    size, mtime or inode changed are reported.
+    """
+
+    name = "poll"
+
+    def __init__(self, root: str, interval: Optional[float] = None):
+        self.root = root
+        self.interval = interval or config.SYNC_POLL_INTERVAL
+        digest = hashlib.sha1(os.path.abspath(root).encode()).hexdigest()[:12]
+        self.catalog = SharedCatalog(root, str(config.HISTORY_DIR / f"sync_{digest}.db"))
+        self.running = False
+
+    def run(self, on_change: Callable[[str, str], None]):
+        self.running = True
+        while self.running:
+            # In-place edits don't touch the directory mtime, so every poll
+            # lists every directory
+            self.catalog.rescan(full=True, on_change=on_change)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+class InotifyWatcher:
+    """Linux inotify through ctypes, one watch per directory"""
+
+    name = "inotify"
+    _EVENT = struct.Struct("iIII")
+    IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x8, 0x40, 0x80
+    IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_ISDIR, IN_Q_OVERFLOW = 0x100, 0x200, 0x400, 0x40000000, 0x4000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    def __init__(self, root: str):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.root = root
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, str] = {}
+        # Files seen so far, so a directory moved away can report what it took
+        self.files: Set[str] = set()
+        self.running = False
+
+    def _watch_tree(self, rel_dir: str, on_change: Optional[Callable[[str, str], None]]):
+        """Watch rel_dir and everything below it, reporting existing files as added"""
+        for current, dirs, files in os.walk(os.path.join(self.root, *rel_dir.split("/")) if rel_dir else self.root):
+            rel = os.path.relpath(current, self.root).replace(os.sep, "/")
+            rel = "" if rel == "." else rel
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(current), self.MASK)
+            if wd >= 0:
+                self.watches[wd] = rel
+            for name in files:
+                path = f"{rel}/{name}" if rel else name
+                self.files.add(path)
+                if on_change:
+                    on_change("added", path)
+
+    def _forget_tree(self, rel_dir: str, on_change: Callable[[str, str], None]):
+        """Report every known file under rel_dir as removed and stop watching it"""
+        prefix = rel_dir + "/"
+        for path in sorted(p for p in self.files if p.startswith(prefix)):
+            self.files.discard(path)
+            on_change("removed", path)
+        for wd, rel in list(self.watches.items()):
+            if rel == rel_dir or rel.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def run(self, on_change: Callable[[str, str], None]):
+        self.running = True
+        self._watch_tree("", on_change)
+        while self.running:
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+                offset += length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    # Events were lost, treat everything as possibly changed
+                    self._watch_tree("", on_change)
+                    continue
+                base = self.watches.get(wd)
+                if base is None or not name:
+                    if mask & self.IN_DELETE_SELF:
+                        self.watches.pop(wd, None)
+                    continue
+                rel = f"{base}/{name}" if base else name
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        self._watch_tree(rel, on_change)
+                    elif mask & self.IN_MOVED_FROM:
+                        # Moved out of the tree, or renamed and reported again by its IN_MOVED_TO
+                        self._forget_tree(rel, on_change)
+                elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                    self.files.add(rel)
+                    on_change("modified", rel)
+                elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    self.files.discard(rel)
+                    on_change("removed", rel)
+        os.close(self.fd)
+
+    def stop(self):
+        self.running = False
+
+def make_watcher(root: str, kind: Optional[str] = None):
+    """Build the watcher named by `kind` (SYNC_WATCHER): "inotify", "poll" or "auto" """
+    kind = kind or config.SYNC_WATCHER
+    if kind in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            if kind == "inotify":
+                raise
+            log.warning(f"⚠️ inotify unavailable ({str(e)}), polling instead")
+    return PollingWatcher(root)
+
+# ======================
+# CHANGE BATCHING
+# ======================
+
+class ChangeBatcher:
+    """Coalesces watcher events and hands them out in batches.
+
+    Several events for one path collapse into the latest one. A batch is
+    released once the folder has been quiet for SYNC_DEBOUNCE seconds, or
+    SYNC_MAX_DELAY after its first change if events never stop.
+    """
+
+    def __init__(self, on_batch: Callable[[Dict[str, str]], None]):
+        self.on_batch = on_batch
+        self._pending: Dict[str, str] = {}
+        self._first = None
+        self._last = None
+        self._cond = threading.Condition()
+        self.running = True
+
+    def __call__(self, kind: str, path: str):
+        if path.endswith(".part"):
+            return
+        with self._cond:
+            self._pending[path] = kind
+            now = time.monotonic()
+            self._first = self._first or now
+            self._last = now
+            self._cond.notify()
+
+    def run(self):
+        while self.running:
+            with self._cond:
+                while not self._pending and self.running:
+                    self._cond.wait(0.5)
+                if not self._pending:
+                    continue
+                now = time.monotonic()
+                quiet_until = self._last + config.SYNC_DEBOUNCE
+                deadline = self._first + config.SYNC_MAX_DELAY
+                if now < quiet_until and now < deadline:
+                    self._cond.wait(min(quiet_until, deadline) - now)
+                    continue
+                batch, self._pending = self._pending, {}
+                self._first = self._last = None
+            self.on_batch(batch)
+
+    def stop(self):
+        self.running = False
+        with self._cond:
+            self._cond.notify()
+
+# ======================
+# DELTA SIGNATURES
+# ======================
+
+def block_size_for(size: int) -> int:
+    """Block size that keeps a signature list under ~8k entries"""
+    block = config.SYNC_BLOCK_SIZE
+    while size // block > 8192:
+        block *= 2
+    return block
+
+def block_signatures(path: str, block_size: int) -> List[str]:
+    signatures = []
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            signatures.append(hashlib.blake2b(block, digest_size=16).hexdigest())
+    return signatures
+
+def _resolve(root: str, rel: str) -> str:
+    """Absolute path for a peer-supplied relative path, refusing anything outside root"""
+    parts = [part for part in str(rel).split("/") if part]
+    if not parts or any(part in (".", "..") for part in parts):
+        raise ProtocolError(f"Invalid path: {rel}")
+    path = os.path.join(root, *parts)
+    real_root = os.path.realpath(root)
+    if not os.path.realpath(path).startswith(real_root + os.sep):
+        raise ProtocolError(f"Invalid path: {rel}")
+    return path
+
+def _drain(conn, size: int):
+    """Read and discard a payload the peer already sent"""
+    while size > 0:
+        size -= len(recv_exact(conn, min(size, config.BUFFER_SIZE)))
+
+# ======================
+# RECEIVING SIDE
+# ======================
+
+class SyncReceiver:
+    """Applies put/patch/delete requests from a syncing peer to a local folder.
+
+    Registered on the browse server, so sync traffic shares its port and
+    connections. Off unless SYNC_ACCEPT is set, since it lets a peer change
+    and delete files.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def register(self, server):
+        for op in ("sig", "put", "patch", "delete"):
+            server.register(op, getattr(self, f"_op_{op}"))
+
+    def _path(self, conn, request: Dict[str, Any], payload: int = 0) -> Optional[str]:
+        """Resolve the request's path, or refuse it and skip its payload so the connection carries on"""
+        try:
+            return _resolve(self.root, request.get("path"))
+        except ProtocolError as e:
+            _drain(conn, payload)
+            send_frame(conn, {"ok": False, "error": str(e)})
+            return None
+
+    def _finish(self, path: str, temp_path: str, mtime_ns: Optional[int]):
+        os.replace(temp_path, path)
+        if mtime_ns:
+            # Matching mtimes let the next sync skip this file without reading it
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+        catalog.note_file(path)
+
+    def _op_sig(self, conn, request: Dict[str, Any]):
+        path = self._path(conn, request)
+        if path is None:
+            return
+        if not os.path.isfile(path):
+            send_frame(conn, {"ok": True, "exists": False})
+            return
+        st = os.stat(path)
+        reply = {"ok": True, "exists": True, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        unchanged = (st.st_size, st.st_mtime_ns) == (request.get("size"), request.get("mtime_ns"))
+        # Reading the file for signatures is only worth it if it will be patched
+        if request.get("block_size") and not unchanged:
+            reply["blocks"] = block_signatures(path, int(request["block_size"]))
+        send_frame(conn, reply)
+
+    def _op_put(self, conn, request: Dict[str, Any]):
+        size = int(request["size"])
+        path = self._path(conn, request, payload=size)
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".part"
+        try:
+            receive_exact(conn, temp_path, size)
+            self._finish(path, temp_path, request.get("mtime_ns"))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        send_frame(conn, {"ok": True})
+
+    def _op_patch(self, conn, request: Dict[str, Any]):
+        """Rebuild a file from the local copy plus the blocks that changed"""
+        size = int(request["size"])
+        block_size = int(request["block_size"])
+        if block_size <= 0 or not all(0 <= int(index) * block_size < size for index in request["blocks"]):
+            # The payload length can't be worked out to skip it, so the connection ends
+            raise ProtocolError("Patch block outside the file")
+        payload = sum(min(block_size, size - index * block_size) for index in request["blocks"])
+        path = self._path(conn, request, payload=payload)
+        if path is None:
+            return
+        temp_path = path + ".part"
+        try:
+            shutil.copyfile(path, temp_path)
+            with open(temp_path, 'r+b') as f:
+                f.truncate(size)
+                for index in request["blocks"]:
+                    offset = index * block_size
+                    f.seek(offset)
+                    f.write(recv_exact(conn, min(block_size, size - offset)))
+            self._finish(path, temp_path, request.get("mtime_ns"))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        send_frame(conn, {"ok": True})
+
+    def _op_delete(self, conn, request: Dict[str, Any]):
+        path = self._path(conn, request)
+        if path is None:
+            return
+        if os.path.isfile(path):
+            os.remove(path)
+            catalog.remove(path)
+        send_frame(conn, {"ok": True})
+
+# ======================
+# SENDING SIDE
+# ======================
+
+class SyncSession:
+    """Watches a folder and mirrors its changes to one or more peers"""
+
+    def __init__(self, root: str, hosts: List[str], watcher: Optional[str] = None,
+                 on_event: Optional[Callable[..., None]] = None):
+        self.root = os.path.abspath(root)
+        self.hosts = hosts
+        self.watcher = make_watcher(self.root, watcher)
+        self.on_event = on_event or (lambda event, **fields: None)
+        self.batcher = ChangeBatcher(self.push_batch)
+        # Changes a peer hasn't taken yet, per host, merged into its next batch
+        self.failed: Dict[str, Dict[str, str]] = {}
+        self._push_lock = threading.Lock()
+        self.running = False
+
+    def run(self):
+        """Watch and push until stop() is called"""
+        self.running = True
+        threading.Thread(target=self.batcher.run, daemon=True).start()
+        threading.Thread(target=self._retry_loop, daemon=True).start()
+        self.on_event("watching", root=self.root, watcher=self.watcher.name, peers=self.hosts)
+        self.watcher.run(self.batcher)
+
+    def stop(self):
+        self.running = False
+        self.watcher.stop()
+        self.batcher.stop()
+
+    def _retry_loop(self):
+        """Resend what a peer missed once it is back, without waiting for new changes"""
+        while self.running:
+            time.sleep(config.SYNC_RETRY_INTERVAL)
+            if self.failed:
+                self.push_batch({})
+
+    def push_batch(self, batch: Dict[str, str]):
+        """Send one batch of changes to every peer over a single connection each"""
+        with self._push_lock:
+            for host in self.hosts:
+                changes = {**self.failed.pop(host, {}), **batch}
+                if changes:
+                    self._push_host(host, changes)
+
+    def _push_host(self, host: str, changes: Dict[str, str]):
+        from browse import RemoteShare
+        started = time.perf_counter()
+        counts = {"put": 0, "patch": 0, "delete": 0, "skip": 0, "failed": 0}
+        pending = sorted(changes.items())
+        try:
+            with RemoteShare(host) as remote:
+                while pending:
+                    rel, kind = pending[0]
+                    try:
+                        counts[self._push_one(remote, rel, kind)] += 1
+                    except ProtocolError as e:
+                        # Refused by the peer, resending wouldn't help
+                        counts["failed"] += 1
+                        self.on_event("failed", peer=host, path=rel, message=str(e))
+                    pending.pop(0)
+        except (OSError, ValueError) as e:
+            # Whatever wasn't confirmed goes out with the next batch, a file
+            # that changed while it was read is picked up again the same way
+            self.failed[host] = dict(pending)
+            self.on_event("failed", peer=host, pending=len(pending), message=f"Sync to {host} failed: {str(e)}")
+            return
+        self.on_event("synced", peer=host, changes=len(changes),
+                      seconds=round(time.perf_counter() - started, 3), **counts)
+
+    def _request(self, remote, message: Dict[str, Any]) -> Dict[str, Any]:
+        reply = remote._request(message)
+        if not reply.get("ok"):
+            raise ProtocolError(reply.get("error", "Request refused"))
+        return reply
+
+    def _push_one(self, remote, rel: str, kind: str) -> str:
+        path = os.path.join(self.root, *rel.split("/"))
+        # The file's current state wins over the event that reported it
+        if not os.path.isfile(path):
+            self._request(remote, {"op": "delete", "path": rel})
+            SYNC_OPS["delete"].inc()
+            return "delete"
+
+        st = os.stat(path)
+        block_size = block_size_for(st.st_size)
+        remote_state = self._request(remote, {"op": "sig", "path": rel, "block_size": block_size,
+                                              "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+        if remote_state["exists"] and remote_state["size"] == st.st_size \
+                and remote_state["mtime_ns"] == st.st_mtime_ns:
+            SYNC_OPS["skip"].inc()
+            return "skip"
+
+        remote_blocks = remote_state.get("blocks") if remote_state["exists"] else None
+        if remote_blocks and st.st_size > block_size:
+            changed = self._changed_blocks(path, st.st_size, block_size, remote_blocks)
+            send_frame(remote.sock, {"op": "patch", "path": rel, "size": st.st_size,
+                                     "block_size": block_size, "blocks": [i for i, _ in changed],
+                                     "mtime_ns": st.st_mtime_ns})
+            for _, block in changed:
+                remote.sock.sendall(block)
+            self._expect_ok(remote)
+            SYNC_BYTES_SAVED.inc(st.st_size - sum(len(block) for _, block in changed))
+            SYNC_OPS["patch"].inc()
+            return "patch"
+
+        send_frame(remote.sock, {"op": "put", "path": rel, "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+        stream_file(remote.sock, path, st.st_size)
+        self._expect_ok(remote)
+        SYNC_OPS["put"].inc()
+        return "put"
+
+    def _changed_blocks(self, path: str, size: int, block_size: int,
+                        remote_blocks: List[str]) -> List[Tuple[int, bytes]]:
+        """Blocks of the first `size` bytes that differ from the peer's, the size announced in the patch"""
+        changed = []
+        with open(path, 'rb') as f:
+            for index, offset in enumerate(range(0, size, block_size)):
+                block = f.read(min(block_size, size - offset))
+                if len(block) < min(block_size, size - offset):
+                    raise ValueError("File shrank while it was being sent")
+                if index >= len(remote_blocks) or \
+                        hashlib.blake2b(block, digest_size=16).hexdigest() != remote_blocks[index]:
+                    changed.append((index, block))
+        return changed
+
+    def _expect_ok(self, remote):
+        reply = recv_frame(remote.sock)
+        if reply is None:
+            raise ConnectionError("Peer closed the sync connection")
+        if not reply.get("ok"):
+            raise ProtocolError(reply.get("error", "Request refused"))
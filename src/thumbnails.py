@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Callable, Dict, List, Tuple
+from config import config
+from catalog import catalog
+from metrics import metrics
+from eventlog import get_logger
+
+log = get_logger("thumbnails")
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff')
+
+CACHE_HITS = metrics.counter("p2p_thumbnail_cache_total", "Thumbnail lookups", result="hit")
+CACHE_MISSES = metrics.counter("p2p_thumbnail_cache_total", "Thumbnail lookups", result="miss")
+EVICTED = metrics.counter("p2p_thumbnail_evicted_total", "Thumbnails evicted from the disk cache")
+RENDER_TIME = metrics.histogram("p2p_thumbnail_seconds", "Time to decode and shrink one image")
+
+def is_image(path: str) -> bool:
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+def available() -> bool:
+    """Previews need the optional Pillow package"""
+    try:
+        from PIL import Image
+        return True
+    except ImportError:
+        return False
+
+class ThumbnailCache:
+    """Thumbnails on disk, named by the source's content hash.
+
+    Renamed or re-sent copies of an image share one entry. Least recently
+    used entries are evicted once the folder holds more than
+    THUMBNAIL_CACHE_BYTES. A hit bumps the file's mtime, so the order
+    survives restarts.
+    """
+
+    def __init__(self, folder: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._entries: Optional["OrderedDict[str, int]"] = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _folder(self) -> str:
+        return self.folder or os.path.join(str(config.CACHE_DIR), "thumbnails")
+
+    def _limit(self) -> int:
+        return self.max_bytes if self.max_bytes is not None else config.THUMBNAIL_CACHE_BYTES
+
+    def _load(self) -> "OrderedDict[str, int]":
+        if self._entries is None:
+            folder = self._folder()
+            os.makedirs(folder, exist_ok=True)
+            found = []
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.name.endswith(".png") and entry.is_file():
+                        st = entry.stat()
+                        found.append((st.st_mtime, entry.name, st.st_size))
+            found.sort()
+            self._entries = OrderedDict((name, size) for _, name, size in found)
+            self._total = sum(self._entries.values())
+        return self._entries
+
+    @staticmethod
+    def name_for(digest: str, size: int) -> str:
+        # Tree digests carry a "tree-sha256:" prefix
+        return f"{digest.replace(':', '_')}-{size}.png"
+
+    def get(self, name: str) -> Optional[str]:
+        with self._lock:
+            entries = self._load()
+            if name not in entries:
+                return None
+            entries.move_to_end(name)
+        path = os.path.join(self._folder(), name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Removed behind our back
+            with self._lock:
+                self._total -= entries.pop(name, 0)
+            return None
+        return path
+
+    def put(self, name: str, data: bytes) -> str:
+        """Store one thumbnail, evicting the least recently used to stay under the limit"""
+        folder = self._folder()
+        path = os.path.join(folder, name)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+        with self._lock:
+            entries = self._load()
+            self._total += len(data) - entries.pop(name, 0)
+            entries[name] = len(data)
+            limit = self._limit()
+            while self._total > limit and len(entries) > 1:
+                old, size = entries.popitem(last=False)
+                self._total -= size
+                EVICTED.inc()
+                try:
+                    os.remove(os.path.join(folder, old))
+                except OSError:
+                    pass
+        return path
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            self._load()
+            return self._total
+
+def render(path: str, size: int) -> bytes:
+    """PNG bytes of `path` shrunk to fit size x size.
+
+    JPEGs are decoded at reduced scale (draft mode), so a large photo
+    never has to be decoded at full resolution.
+    """
+    import io
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        out = io.BytesIO()
+        image.save(out, format='PNG', optimize=False)
+        return out.getvalue()
+
+class ThumbnailService:
+    """Makes thumbnails on a small pool of worker threads.
+
+    request() queues one image and later calls callback(path, thumbnail)
+    on a worker thread, with thumbnail None if the file couldn't be
+    previewed. The newest requests run first, because they belong to the
+    rows on screen right now. cancel() drops requests for rows that
+    scrolled away before a worker reached them.
+    """
+
+    def __init__(self, cache: Optional[ThumbnailCache] = None, workers: Optional[int] = None):
+        self.cache = cache or ThumbnailCache()
+        self.workers = workers
+        self._pending: "OrderedDict[Tuple[str, int], List[Callable]]" = OrderedDict()
+        self._failed: Dict[Tuple[str, int], float] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+
+    def _start(self):
+        if self._threads:
+            return
+        for number in range(self.workers or config.THUMBNAIL_WORKERS):
+            thread = threading.Thread(target=self._work_loop, name=f"thumbnail-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def request(self, path: str, callback: Callable[[str, Optional[str]], None], size: Optional[int] = None):
+        size = size or config.THUMBNAIL_SIZE
+        key = (path, size)
+        with self._cond:
+            self._start()
+            callbacks = self._pending.pop(key, [])
+            callbacks.append(callback)
+            self._pending[key] = callbacks
+            self._cond.notify()
+
+    def cancel(self, path: str, size: Optional[int] = None):
+        with self._cond:
+            self._pending.pop((path, size or config.THUMBNAIL_SIZE), None)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def thumbnail(self, path: str, size: Optional[int] = None) -> Optional[str]:
+        """Path of the cached thumbnail for `path`, rendering it first if needed"""
+        size = size or config.THUMBNAIL_SIZE
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if self._failed.get((path, size)) == mtime:
+            return None
+        try:
+            name = ThumbnailCache.name_for(catalog.digest(path), size)
+            cached = self.cache.get(name)
+            if cached:
+                CACHE_HITS.inc()
+                return cached
+            CACHE_MISSES.inc()
+            started = time.perf_counter()
+            data = render(path, size)
+            RENDER_TIME.observe(time.perf_counter() - started)
+            return self.cache.put(name, data)
+        except Exception as e:
+            # Not an image after all, truncated, too large for Pillow's
+            # decompression-bomb guard or unreadable: don't try again
+            # until the file changes
+            self._failed[(path, size)] = mtime
+            log.debug(f"No preview for {os.path.basename(path)}: {str(e)}")
+            return None
+
+    def _work_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                (path, size), callbacks = self._pending.popitem(last=True)
+            result = self.thumbnail(path, size)
+            for callback in callbacks:
+                callback(path, result)
+
+# Global thumbnail service
+thumbnails = ThumbnailService()
@@ -0,0 +1,782 @@
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import deque, OrderedDict
+from typing import Optional, Tuple, Dict
+from config import config
+from metrics import metrics
+
+# Packet types
+_SYN, _SYNACK, _DATA, _ACK, _PARITY, _RST = range(1, 7)
+# Flag on a DATA packet: the sender has nothing more to send
+_FIN = 0x01
+
+# type, flags, parity group size, connection id, sequence number, timestamp.
+# An ACK carries the next expected sequence number and echoes the timestamp
+# of the packet that triggered it, which gives the sender its RTT samples.
+_HEADER = struct.Struct(">BBHIId")
+# Receive window in packets and the number of SACK ranges that follow
+_ACK_INFO = struct.Struct(">IH")
+_RANGE = struct.Struct(">II")
+# Length and flags of one data packet, the unit parity is computed over
+_BODY = struct.Struct(">HB")
+_MAX_SACK_RANGES = 32
+
+PACKETS_SENT = metrics.counter("p2p_udp_packets_total", "UDP transport packets", direction="sent")
+PACKETS_RECEIVED = metrics.counter("p2p_udp_packets_total", "UDP transport packets", direction="received")
+RETRANSMITS = metrics.counter("p2p_udp_retransmits_total", "UDP data packets sent again after a loss")
+TIMEOUTS = metrics.counter("p2p_udp_timeouts_total", "UDP retransmission timeouts")
+FEC_RECOVERED = metrics.counter("p2p_udp_fec_recovered_total", "Lost UDP packets rebuilt from parity")
+REFUSED = metrics.counter("p2p_udp_refused_total", "UDP connection attempts refused at the connection limits")
+
+def _tune(sock: socket.socket):
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, config.UDP_SOCKET_BUFFER)
+        except OSError:
+            pass
+    # Lets the reader threads notice close()
+    sock.settimeout(0.5)
+
+def _parse(data: bytes):
+    if len(data) < _HEADER.size:
+        return None
+    return _HEADER.unpack_from(data) + (memoryview(data)[_HEADER.size:],)
+
+class UdpConnection:
+    """Reliable, ordered byte stream over UDP, used like the TCP socket it replaces.
+
+    Data is cut into numbered packets of UDP_PAYLOAD_SIZE bytes. The
+    receiver acknowledges them cumulatively plus selective (SACK) ranges,
+    so only packets that were really lost are sent again. Sending is paced
+    at one congestion window per RTT, and the window follows queueing
+    delay (Vegas style): it grows while the RTT stays near its minimum and
+    shrinks when a queue builds. Loss alone only shrinks it when delay is
+    also rising or the loss rate is too high to be link noise, so a lossy
+    long-haul link keeps its rate. With UDP_FEC_GROUP set, every group of
+    packets is followed by an XOR parity packet that rebuilds one lost
+    packet without waiting for a retransmission.
+    """
+
+    def __init__(self, sock: socket.socket, address: Tuple[str, int], conn_id: int,
+                 owner: Optional["UdpListener"] = None):
+        self._sock = sock
+        self.address = address
+        self.conn_id = conn_id
+        self._owner = owner
+        self._cond = threading.Condition()
+        self._timeout = None
+        self._error = None
+        self._closed = False
+        self.mss = config.UDP_PAYLOAD_SIZE
+
+        # Sending
+        self._next_seq = 0
+        self._sent_end = 0  # one past the highest sequence number sent so far
+        self._queue = deque()  # (seq, payload, flags) not sent yet
+        self._send_buffered = 0  # bytes queued or in flight
+        self._inflight = OrderedDict()  # seq -> [payload, flags, sent_at, lost]
+        self._lost = deque()
+        self._lost_count = 0
+        self._fin_queued = False
+        self._fin_acked = False
+        self._peer_window = config.UDP_RECV_WINDOW
+        self._last_progress = time.monotonic()
+        # Liveness: a peer that sends nothing for SOCKET_TIMEOUT is gone, so
+        # an idle connection sends an ACK now and then to show it isn't
+        self._last_heard = self._last_progress
+        self._last_sent = self._last_progress
+        self._latest_delivered_sent_at = 0.0
+
+        # Congestion control, windows in packets
+        self.cwnd = float(config.UDP_INITIAL_WINDOW)
+        self.ssthresh = float("inf")
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = 1.0
+        self.min_rtt = None
+        self._min_rtt_at = 0.0
+        # (time, rtt) samples from the last base RTT, rising, so the first is
+        # their minimum
+        self._recent_rtts = deque()
+        self._round_end = 0
+        self._round_acked = 0
+        self._round_lost = 0
+        self._round_backed_off = False
+        self._credit = float(config.UDP_PACING_BURST)
+        self._credit_at = time.monotonic()
+
+        # Parity being built for the current group of sent packets
+        self._fec_group = config.UDP_FEC_GROUP
+        self._fec_width = self.mss + _BODY.size
+        self._parity_start = 0
+        self._parity_count = 0
+        self._parity = 0
+
+        # Receiving
+        self._expected = 0
+        self._out_of_order = {}  # seq -> (payload, flags)
+        self._chunks = deque()
+        self._buffered = 0
+        self._peer_fin = False
+        self._read_shut = False
+        self._ack_pending = 0
+        self._ack_due = None
+        self._echo = 0.0
+        self._advertised = config.UDP_RECV_WINDOW
+        self._bodies = {}  # seq -> body, kept while its parity group may need it
+        self._groups = {}  # group start -> (count, parity bytes)
+
+        self._pump = threading.Thread(target=self._pump_loop, daemon=True)
+        self._pump.start()
+
+    # ==============================================
+    # Socket interface used by file_transfer
+    # ==============================================
+
+    def settimeout(self, timeout: Optional[float]):
+        self._timeout = timeout
+
+    def gettimeout(self) -> Optional[float]:
+        return self._timeout
+
+    def getpeername(self) -> Tuple[str, int]:
+        return self.address
+
+    def _wait(self, ready):
+        """Block on the condition until ready(), honouring the timeout; lock held"""
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while not ready():
+            if self._error:
+                raise self._error
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise socket.timeout("timed out")
+            self._cond.wait(remaining)
+
+    def sendall(self, data):
+        view = memoryview(data).cast("B")
+        with self._cond:
+            if self._fin_queued or self._closed:
+                raise BrokenPipeError("Connection already shut down for sending")
+            for start in range(0, len(view), self.mss):
+                if self._error:
+                    raise self._error
+                if self._send_buffered >= config.UDP_SEND_BUFFER:
+                    self._cond.notify_all()
+                    self._wait(lambda: self._send_buffered < config.UDP_SEND_BUFFER)
+                self._enqueue(bytes(view[start:start + self.mss]), 0)
+            self._cond.notify_all()
+
+    def send(self, data) -> int:
+        self.sendall(data)
+        return len(data)
+
+    def _take(self, limit: int):
+        """Up to `limit` buffered bytes as a list of chunks, blocking until some arrive"""
+        self._wait(lambda: self._buffered or self._peer_fin or self._read_shut)
+        taken, size = [], 0
+        while size < limit and self._chunks:
+            chunk = self._chunks[0]
+            if len(chunk) <= limit - size:
+                taken.append(self._chunks.popleft())
+            else:
+                taken.append(chunk[:limit - size])
+                self._chunks[0] = chunk[limit - size:]
+            size += len(taken[-1])
+        self._buffered -= size
+        # Tell a sender stalled on a full window that there is room again
+        if self._advertised < config.UDP_RECV_WINDOW // 4 and \
+                self._receive_window() >= config.UDP_RECV_WINDOW // 2:
+            self._ack_due = time.monotonic()
+            self._cond.notify_all()
+        return taken
+
+    def recv(self, bufsize: int) -> bytes:
+        with self._cond:
+            return b"".join(self._take(bufsize))
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        view = memoryview(buffer).cast("B")
+        with self._cond:
+            taken = self._take(nbytes or len(view))
+        offset = 0
+        for chunk in taken:
+            view[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        return offset
+
+    def shutdown(self, how: int):
+        with self._cond:
+            if how in (socket.SHUT_WR, socket.SHUT_RDWR) and not self._fin_queued:
+                self._enqueue(b"", _FIN)
+                self._fin_queued = True
+            if how in (socket.SHUT_RD, socket.SHUT_RDWR):
+                self._read_shut = True
+            self._cond.notify_all()
+
+    def close(self):
+        """Send FIN and wait until the peer has everything, up to SOCKET_TIMEOUT"""
+        with self._cond:
+            if self._closed:
+                return
+            if not self._fin_queued:
+                self._enqueue(b"", _FIN)
+                self._fin_queued = True
+            self._cond.notify_all()
+            deadline = time.monotonic() + config.SOCKET_TIMEOUT
+            # Once the peer has finished too, it has acked our data or never will
+            while not self._error and not self._fin_acked and not \
+                    (self._peer_fin and len(self._inflight) + len(self._queue) <= 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._closed = True
+            self._cond.notify_all()
+        self._pump.join(timeout=1)
+        if self._owner:
+            self._owner._forget(self)
+        else:
+            self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ==============================================
+    # Sender
+    # ==============================================
+
+    def _enqueue(self, payload: bytes, flags: int):
+        self._queue.append((self._next_seq, payload, flags))
+        self._next_seq += 1
+        self._send_buffered += len(payload)
+
+    def _data_packet(self, seq: int, payload: bytes, flags: int, now: float) -> bytes:
+        return _HEADER.pack(_DATA, flags, 0, self.conn_id, seq, now) + payload
+
+    def _add_parity(self, seq: int, payload: bytes, flags: int, now: float) -> Optional[bytes]:
+        """Fold a new packet into the current parity group, returning the parity when it is complete"""
+        if not self._parity_count:
+            self._parity_start = seq
+        body = _BODY.pack(len(payload), flags) + payload
+        self._parity ^= int.from_bytes(body.ljust(self._fec_width, b"\0"), "big")
+        self._parity_count += 1
+        # A partial group goes out as soon as the queue runs dry, nobody waits for a full one
+        if self._parity_count < self._fec_group and self._queue:
+            return None
+        packet = _HEADER.pack(_PARITY, 0, self._parity_count, self.conn_id, self._parity_start, now) + \
+            self._parity.to_bytes(self._fec_width, "big")
+        self._parity_count = 0
+        self._parity = 0
+        return packet
+
+    def _window(self) -> float:
+        return min(self.cwnd, self._peer_window)
+
+    def _pipe(self) -> int:
+        return len(self._inflight) - self._lost_count
+
+    def _refill_credit(self, now: float):
+        if self.srtt is None:
+            self._credit = float(config.UDP_PACING_BURST)
+        else:
+            rate = config.UDP_PACING_GAIN * self.cwnd / max(self.srtt, 1e-4)
+            self._credit = min(float(config.UDP_PACING_BURST), self._credit + rate * (now - self._credit_at))
+        self._credit_at = now
+
+    def _take_sendable(self, now: float):
+        """Packets the window and pacing allow right now; lock held"""
+        packets = []
+        self._refill_credit(now)
+        # One probe packet at a time while the peer's window is shut
+        window = max(self._window(), 1 if not self._pipe() else 0)
+        while self._credit >= 1 and (self._lost or self._queue):
+            if self._lost:
+                seq = self._lost.popleft()
+                entry = self._inflight.get(seq)
+                if entry is None or not entry[3]:
+                    continue
+                entry[2] = now
+                entry[3] = False
+                self._lost_count -= 1
+                RETRANSMITS.inc()
+                packets.append(self._data_packet(seq, entry[0], entry[1], now))
+            elif self._pipe() < window:
+                seq, payload, flags = self._queue.popleft()
+                self._inflight[seq] = [payload, flags, now, False]
+                self._sent_end = seq + 1
+                packets.append(self._data_packet(seq, payload, flags, now))
+                if self._fec_group:
+                    parity = self._add_parity(seq, payload, flags, now)
+                    if parity:
+                        packets.append(parity)
+                        self._credit -= 1
+            else:
+                break
+            self._credit -= 1
+        return packets
+
+    def _on_ack(self, cumulative: int, echo: float, info: memoryview):
+        now = time.monotonic()
+        window, count = _ACK_INFO.unpack_from(info)
+        self._peer_window = window
+        delivered = 0
+        highest = cumulative - 1
+
+        while self._inflight:
+            seq = next(iter(self._inflight))
+            if seq >= cumulative:
+                break
+            delivered += self._delivered(self._inflight.pop(seq))
+        for index in range(min(count, _MAX_SACK_RANGES)):
+            start, end = _RANGE.unpack_from(info, _ACK_INFO.size + index * _RANGE.size)
+            highest = max(highest, end - 1)
+            for seq in range(max(start, cumulative), end):
+                entry = self._inflight.pop(seq, None)
+                if entry is not None:
+                    delivered += self._delivered(entry)
+
+        if not delivered:
+            return
+        self._last_progress = now
+        if echo:
+            self._sample_rtt(now - echo, now)
+        self._detect_losses(highest)
+        self._grow(delivered, cumulative)
+        self._cond.notify_all()
+
+    def _delivered(self, entry) -> int:
+        payload, flags, sent_at, lost = entry
+        if lost:
+            self._lost_count -= 1
+        if flags & _FIN:
+            self._fin_acked = True
+        self._send_buffered -= len(payload)
+        self._latest_delivered_sent_at = max(self._latest_delivered_sent_at, sent_at)
+        return 1
+
+    def _sample_rtt(self, rtt: float, now: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, config.UDP_MIN_RTO), 60.0)
+        # Base delay is the minimum over a sliding window, so a route change can raise it
+        if self.min_rtt is None or rtt <= self.min_rtt or now - self._min_rtt_at > config.UDP_MIN_RTT_WINDOW:
+            self.min_rtt = rtt
+            self._min_rtt_at = now
+        while self._recent_rtts and self._recent_rtts[-1][1] >= rtt:
+            self._recent_rtts.pop()
+        self._recent_rtts.append((now, rtt))
+        while now - self._recent_rtts[0][0] > self.min_rtt:
+            self._recent_rtts.popleft()
+
+    def _queued_packets(self) -> float:
+        """Vegas estimate of our packets sitting in queues along the path.
+
+        Uses the fastest sample of the last base RTT rather than srtt, so a
+        burst of ACKs held up by a brief stall doesn't read as a queue.
+        """
+        if not self._recent_rtts or not self.min_rtt:
+            return 0.0
+        return self.cwnd * max(0.0, 1 - self.min_rtt / self._recent_rtts[0][1])
+
+    def _detect_losses(self, highest: int):
+        """A packet is lost once one sent a reordering window after it has arrived"""
+        reorder = max(0.001, (self.min_rtt or 0) / 8)
+        lost = 0
+        for seq, entry in self._inflight.items():
+            if seq > highest:
+                break
+            if not entry[3] and entry[2] + reorder <= self._latest_delivered_sent_at:
+                entry[3] = True
+                self._lost.append(seq)
+                self._lost_count += 1
+                lost += 1
+        if lost:
+            self._round_lost += lost
+            self._on_loss()
+
+    def _on_loss(self):
+        """Back off only for losses that look like congestion, once per round"""
+        if self._round_backed_off:
+            return
+        # A round carries about a window of packets; judging the first loss
+        # against only the few acked so far would make any loss look heavy
+        total = max(self._round_acked + self._round_lost, self.cwnd)
+        noisy = self._round_lost / total <= config.UDP_RANDOM_LOSS
+        if noisy and self._queued_packets() <= config.UDP_VEGAS_BETA:
+            return
+        self._round_backed_off = True
+        self.cwnd = max(self.cwnd * config.UDP_LOSS_BACKOFF, 2.0)
+        self.ssthresh = self.cwnd
+
+    def _grow(self, delivered: int, cumulative: int):
+        self._round_acked += delivered
+        round_done = cumulative >= self._round_end
+        queued = self._queued_packets()
+        if self.cwnd < self.ssthresh:
+            if queued > config.UDP_VEGAS_BETA:
+                self.ssthresh = self.cwnd
+            else:
+                self.cwnd += delivered
+        elif round_done:
+            if queued < config.UDP_VEGAS_ALPHA:
+                self.cwnd += 1
+            elif queued > config.UDP_VEGAS_BETA:
+                self.cwnd -= 1
+        self.cwnd = min(max(self.cwnd, 2.0), float(config.UDP_MAX_WINDOW))
+        if round_done:
+            # A round ends once what has been sent by now is acked; data that
+            # is only queued would stretch it far past one RTT
+            self._round_end = self._sent_end
+            self._round_acked = self._round_lost = 0
+            self._round_backed_off = False
+
+    def _check_timers(self, now: float):
+        oldest = self._oldest_unacked()
+        if oldest is None:
+            return
+        if now - self._last_progress > config.SOCKET_TIMEOUT:
+            self._fail(ConnectionError("Peer stopped responding"))
+            return
+        if now - oldest < self.rto:
+            return
+        # Nothing came back for a whole RTO: resend everything that old
+        TIMEOUTS.inc()
+        for seq, entry in self._inflight.items():
+            if not entry[3] and now - entry[2] >= self.rto:
+                entry[3] = True
+                self._lost.append(seq)
+                self._lost_count += 1
+        self.rto = min(self.rto * 2, 60.0)
+        self.cwnd = max(self.cwnd / 2, 2.0)
+        self.ssthresh = self.cwnd
+
+    def _oldest_unacked(self) -> Optional[float]:
+        for entry in self._inflight.values():
+            if not entry[3]:
+                return entry[2]
+        return None
+
+    # ==============================================
+    # Receiver
+    # ==============================================
+
+    def _receive_window(self) -> int:
+        return max(0, config.UDP_RECV_WINDOW - self._buffered // self.mss - len(self._out_of_order))
+
+    def _accept(self, seq: int, payload, flags: int):
+        if seq == self._expected:
+            self._deliver(payload, flags)
+            self._expected += 1
+            while self._expected in self._out_of_order:
+                self._deliver(*self._out_of_order.pop(self._expected))
+                self._expected += 1
+        else:
+            self._out_of_order[seq] = (payload, flags)
+
+    def _deliver(self, payload, flags: int):
+        if payload:
+            self._chunks.append(payload)
+            self._buffered += len(payload)
+        if flags & _FIN:
+            self._peer_fin = True
+
+    def _on_data(self, seq: int, stamp: float, flags: int, payload: memoryview) -> Optional[bytes]:
+        self._echo = stamp
+        if seq < self._expected or seq in self._out_of_order:
+            # Our ACK was lost, repeat it
+            return self._build_ack()
+        if seq >= self._expected + config.UDP_RECV_WINDOW:
+            return None
+        payload = bytes(payload)
+        in_order = seq == self._expected
+        self._accept(seq, payload, flags)
+        if self._fec_group or self._groups:
+            self._bodies[seq] = _BODY.pack(len(payload), flags) + payload
+            self._recover()
+
+        self._ack_pending += 1
+        if not in_order or self._out_of_order or flags & _FIN or self._ack_pending >= 2:
+            return self._build_ack()
+        if self._ack_due is None:
+            self._ack_due = time.monotonic() + config.UDP_ACK_DELAY
+            self._cond.notify_all()
+        return None
+
+    def _on_parity(self, start: int, count: int, payload: memoryview) -> Optional[bytes]:
+        if start + count <= self._expected:
+            return None
+        self._groups[start] = (count, bytes(payload))
+        recovered = self._recover()
+        return self._build_ack() if recovered else None
+
+    def _recover(self) -> int:
+        """Rebuild the single missing packet of any group whose parity has arrived"""
+        recovered = 0
+        for start, (count, parity) in list(self._groups.items()):
+            missing = [seq for seq in range(start, start + count)
+                       if seq >= self._expected and seq not in self._out_of_order]
+            if len(missing) == 1 and all(seq in self._bodies for seq in range(start, start + count)
+                                         if seq != missing[0]):
+                value = int.from_bytes(parity, "big")
+                for seq in range(start, start + count):
+                    if seq != missing[0]:
+                        value ^= int.from_bytes(self._bodies[seq].ljust(len(parity), b"\0"), "big")
+                body = value.to_bytes(len(parity), "big")
+                length, flags = _BODY.unpack_from(body)
+                payload = body[_BODY.size:_BODY.size + length]
+                self._accept(missing[0], payload, flags)
+                self._bodies[missing[0]] = body[:_BODY.size + length]
+                FEC_RECOVERED.inc()
+                recovered += 1
+                missing = []
+            if not missing:
+                del self._groups[start]
+                for seq in range(start, start + count):
+                    self._bodies.pop(seq, None)
+        # Groups whose parity was lost never complete, forget their packets eventually
+        if len(self._bodies) > 2 * config.UDP_RECV_WINDOW:
+            floor = self._expected - config.UDP_RECV_WINDOW
+            for seq in [seq for seq in self._bodies if seq < floor]:
+                del self._bodies[seq]
+            for start in [start for start in self._groups if start < floor]:
+                del self._groups[start]
+        return recovered
+
+    def _build_ack(self) -> bytes:
+        ranges = []
+        for seq in sorted(self._out_of_order):
+            if ranges and ranges[-1][1] == seq:
+                ranges[-1][1] = seq + 1
+            elif len(ranges) < _MAX_SACK_RANGES:
+                ranges.append([seq, seq + 1])
+            else:
+                break
+        self._ack_pending = 0
+        self._ack_due = None
+        self._advertised = self._receive_window()
+        return (_HEADER.pack(_ACK, 0, 0, self.conn_id, self._expected, self._echo) +
+                _ACK_INFO.pack(self._advertised, len(ranges)) +
+                b"".join(_RANGE.pack(start, end) for start, end in ranges))
+
+    # ==============================================
+    # Packet I/O
+    # ==============================================
+
+    def _fail(self, error: Exception):
+        if self._error is None:
+            self._error = error
+        self._cond.notify_all()
+
+    def _transmit(self, packets):
+        self._last_sent = time.monotonic()
+        try:
+            for packet in packets:
+                if self._owner:
+                    self._sock.sendto(packet, self.address)
+                else:
+                    self._sock.send(packet)
+            PACKETS_SENT.inc(len(packets))
+        except (BlockingIOError, socket.timeout):
+            # Kernel buffer full, the packets count as lost and are resent
+            pass
+        except OSError as e:
+            with self._cond:
+                self._fail(ConnectionError(f"UDP send failed: {str(e)}"))
+
+    def _on_packet(self, kind: int, flags: int, extra: int, seq: int, stamp: float, payload: memoryview):
+        """Handle one packet from the peer, called by the reader thread"""
+        PACKETS_RECEIVED.inc()
+        reply = None
+        with self._cond:
+            self._last_heard = time.monotonic()
+            if kind == _DATA:
+                reply = self._on_data(seq, stamp, flags, payload)
+            elif kind == _ACK:
+                self._on_ack(seq, stamp, payload)
+            elif kind == _PARITY:
+                reply = self._on_parity(seq, extra, payload)
+            elif kind == _RST:
+                self._fail(ConnectionResetError("Peer reset the connection"))
+            self._cond.notify_all()
+        if reply:
+            self._transmit([reply])
+
+    def _keepalive_interval(self) -> float:
+        return config.SOCKET_TIMEOUT / 3
+
+    def _next_wakeup(self, now: float) -> float:
+        deadlines = [self._last_heard + config.SOCKET_TIMEOUT, self._last_sent + self._keepalive_interval()]
+        if self._ack_due is not None:
+            deadlines.append(self._ack_due)
+        oldest = self._oldest_unacked()
+        if oldest is not None:
+            deadlines.append(oldest + self.rto)
+        if self._lost or (self._queue and self._pipe() < self._window()):
+            rate = config.UDP_PACING_GAIN * self.cwnd / max(self.srtt or 1e-4, 1e-4)
+            deadlines.append(now + max(0.0, 1 - self._credit) / rate)
+        return max(min(deadlines) - now, 0.0002)
+
+    def _pump_loop(self):
+        """Sends paced data, delayed ACKs, retransmissions and keepalives"""
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    if self._error:
+                        # Free the listener slot even if nobody ever closes us
+                        if self._owner:
+                            self._owner._forget(self)
+                        return
+                    now = time.monotonic()
+                    if now - self._last_heard > config.SOCKET_TIMEOUT:
+                        # Also catches a SYN from a spoofed address that never sends data
+                        self._fail(ConnectionError("Peer went silent"))
+                        continue
+                    self._check_timers(now)
+                    packets = self._take_sendable(now)
+                    if (self._ack_due is not None and now >= self._ack_due) or \
+                            (not packets and now - self._last_sent >= self._keepalive_interval()):
+                        packets.append(self._build_ack())
+                    if packets:
+                        break
+                    self._cond.wait(self._next_wakeup(now))
+            self._transmit(packets)
+
+def connect(address: Tuple[str, int], timeout: Optional[float] = None) -> UdpConnection:
+    """Open a UDP transport connection, raising TimeoutError or ConnectionRefusedError"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        _tune(sock)
+        sock.connect(address)
+        conn_id = int.from_bytes(os.urandom(4), "big")
+        deadline = time.monotonic() + (config.SOCKET_TIMEOUT if timeout is None else timeout)
+        interval = 0.25
+        while True:
+            sent_at = time.monotonic()
+            sock.send(_HEADER.pack(_SYN, 0, 0, conn_id, 0, sent_at))
+            reply_by = min(deadline, sent_at + interval)
+            while time.monotonic() < reply_by:
+                try:
+                    packet = _parse(sock.recv(65535))
+                except socket.timeout:
+                    continue
+                if packet and packet[0] == _RST and packet[3] == conn_id:
+                    raise ConnectionRefusedError(f"{address[0]}:{address[1]} refused the UDP connection")
+                if packet and packet[0] == _SYNACK and packet[3] == conn_id:
+                    conn = UdpConnection(sock, address, conn_id)
+                    conn._sample_rtt(time.monotonic() - packet[5], time.monotonic())
+                    conn._last_progress = time.monotonic()
+                    conn.settimeout(timeout)
+                    threading.Thread(target=_client_reader, args=(conn,), daemon=True).start()
+                    return conn
+            if time.monotonic() >= deadline:
+                raise socket.timeout(f"No UDP transport answer from {address[0]}:{address[1]}")
+            interval = min(interval * 2, 2.0)
+    except BaseException:
+        sock.close()
+        raise
+
+def _client_reader(conn: UdpConnection):
+    while not conn._closed:
+        try:
+            data = conn._sock.recv(65535)
+        except socket.timeout:
+            continue
+        except ConnectionRefusedError:
+            with conn._cond:
+                conn._fail(ConnectionRefusedError("Peer's UDP port is closed"))
+            return
+        except OSError:
+            return
+        packet = _parse(data)
+        if packet and packet[3] == conn.conn_id:
+            conn._on_packet(packet[0], packet[1], packet[2], packet[4], packet[5], packet[6])
+
+class UdpListener:
+    """Accepts UDP transport connections on one port and hands each packet to its connection"""
+
+    def __init__(self, port: int, host: str = ''):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.sock.bind((host, port))
+        except OSError:
+            self.sock.close()
+            raise
+        _tune(self.sock)
+        self.port = self.sock.getsockname()[1]
+        self._connections: Dict[Tuple, UdpConnection] = {}
+        self._accepted = queue.Queue()
+        # Connections not accepted yet; ones that expire meanwhile leave it
+        self._pending = set()
+        self._closed = False
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def accept(self, timeout: Optional[float] = None) -> Tuple[UdpConnection, Tuple[str, int]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                conn = self._accepted.get(timeout=remaining)
+            except queue.Empty:
+                raise socket.timeout("timed out")
+            self._pending.discard(conn)
+            # Skip connections that went silent before anyone accepted them
+            if conn._error is None:
+                return conn, conn.address
+
+    def _read_loop(self):
+        while not self._closed:
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            packet = _parse(data)
+            if not packet:
+                continue
+            kind, flags, extra, conn_id, seq, stamp, payload = packet
+            conn = self._connections.get((address, conn_id))
+            if kind == _SYN:
+                if conn is None and (len(self._connections) >= config.UDP_MAX_CONNECTIONS or
+                                     len(self._pending) >= config.UDP_MAX_PENDING):
+                    # SYNs are unauthenticated and cheap to spoof, each one
+                    # costs a thread, so refuse rather than queue without limit
+                    REFUSED.inc()
+                    self.sock.sendto(_HEADER.pack(_RST, 0, 0, conn_id, 0, 0.0), address)
+                    continue
+                if conn is None:
+                    conn = UdpConnection(self.sock, address, conn_id, owner=self)
+                    self._connections[(address, conn_id)] = conn
+                    self._pending.add(conn)
+                    self._accepted.put(conn)
+                # Repeated SYNs mean our SYNACK was lost
+                self.sock.sendto(_HEADER.pack(_SYNACK, 0, 0, conn_id, 0, stamp), address)
+            elif conn is not None:
+                conn._on_packet(kind, flags, extra, seq, stamp, payload)
+            elif kind != _RST:
+                self.sock.sendto(_HEADER.pack(_RST, 0, 0, conn_id, 0, 0.0), address)
+
+    def _forget(self, conn: UdpConnection):
+        self._connections.pop((conn.address, conn.conn_id), None)
+        self._pending.discard(conn)
+
+    def close(self):
+        self._closed = True
+        self.sock.close()
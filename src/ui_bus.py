@@ -0,0 +1,74 @@
+from collections import deque
+from typing import Callable, Any
+from config import config
+from metrics import metrics
+from eventlog import get_logger
+
+log = get_logger("ui")
+
+QUEUE_DEPTH = metrics.gauge("p2p_ui_queue_depth", "UI events waiting for the next frame")
+
+class UIEventBus:
+    """Hands work from worker threads to the Tk main loop.
+
+    Workers never touch widgets: they post callables here and the main loop
+    drains them with `root.after` at a fixed frame rate. deque.append/popleft
+    and dict item assignment/pop are atomic, so posting takes no lock.
+    Progress updates are coalesced per key, only the latest value is rendered.
+    """
+
+    def __init__(self):
+        self.root = None
+        self._events = deque()
+        self._progress = {}
+
+    def start(self, root):
+        """Begin draining events on the given Tk root"""
+        self.root = root
+        self.root.after(self._interval(), self._drain)
+
+    def _interval(self) -> int:
+        return max(1, int(1000 / config.UI_FPS))
+
+    def post(self, handler: Callable, *args: Any):
+        """Run handler(*args) on the main loop at the next frame"""
+        self._events.append((handler, args))
+
+    def post_progress(self, key: str, handler: Callable, *args: Any):
+        """Like post, but later updates for the same key replace pending ones"""
+        self._progress[key] = (handler, args)
+
+    def wrap(self, handler: Callable) -> Callable:
+        """Return a thread-safe callback that posts to the bus"""
+        return lambda *args: self.post(handler, *args)
+
+    def pending(self) -> int:
+        return len(self._events) + len(self._progress)
+
+    def _drain(self):
+        QUEUE_DEPTH.set(self.pending())
+        # Only handle what was queued before this frame so a flood of events
+        # can't starve Tk's own redraws
+        for _ in range(len(self._events)):
+            handler, args = self._events.popleft()
+            self._dispatch(handler, args)
+
+        for key in list(self._progress):
+            entry = self._progress.pop(key, None)
+            if entry:
+                self._dispatch(*entry)
+
+        try:
+            self.root.after(self._interval(), self._drain)
+        except Exception:
+            # Root was destroyed, stop draining
+            self.root = None
+
+    def _dispatch(self, handler, args):
+        try:
+            handler(*args)
+        except Exception as e:
+            log.exception(f"⚠️ UI update failed: {str(e)}")
+
+# Global UI bus instance
+ui_bus = UIEventBus()
@@ -1,15 +1,12 @@
 import os
 import socket
-import platform
 import time
 import base64
 import json
-import hashlib
 import random
 from datetime import datetime
 from typing import Optional, Tuple, Dict, Any, List, Callable
 from pathlib import Path
-from cryptography.fernet import Fernet
 
 # ======================
 # NETWORK UTILITIES
@@ -40,6 +37,7 @@ def get_local_ip() -> str:
 
 def get_network_info() -> Dict[str, Any]:
     """Get comprehensive network information about the current machine"""
+    import platform
     return {
         "hostname": socket.gethostname(),
         "local_ip": get_local_ip(),
@@ -77,10 +75,12 @@ def get_available_port(start_port: int = 5000, end_port: int = 6000) -> Optional
 
 def get_file_hash(filepath: str, algorithm: str = "sha256") -> str:
     """Calculate cryptographic hash of a file's contents"""
+    import hashlib
     hash_func = getattr(hashlib, algorithm)()
     try:
         with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            # 1 MB reads: 4 KB reads spent more time in read calls than hashing
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
                 hash_func.update(chunk)
         return hash_func.hexdigest()
     except FileNotFoundError:
@@ -118,13 +118,12 @@ def find_files(directory: str, extensions: List[str] = None) -> List[str]:
         print(f"❌ Directory not found: {directory}")
         return []
     
+    # str.endswith takes a tuple, one call per name instead of a loop per extension
+    suffixes = tuple(ext.lower() for ext in extensions) if extensions else None
     files = []
     for root, _, filenames in os.walk(directory):
         for filename in filenames:
-            if extensions:
-                if any(filename.lower().endswith(ext) for ext in extensions):
-                    files.append(os.path.join(root, filename))
-            else:
+            if suffixes is None or filename.lower().endswith(suffixes):
                 files.append(os.path.join(root, filename))
     return files
 
@@ -134,11 +133,13 @@ def find_files(directory: str, extensions: List[str] = None) -> List[str]:
 
 def generate_key() -> str:
     """Generate a Fernet encryption key for message security"""
+    from cryptography.fernet import Fernet
     return Fernet.generate_key().decode()
 
 def encrypt_message(message: str, key: str) -> str:
     """Encrypt a message using Fernet symmetric encryption"""
     try:
+        from cryptography.fernet import Fernet
         f = Fernet(key.encode())
         return f.encrypt(message.encode()).decode()
     except Exception as e:
@@ -148,6 +149,7 @@ def encrypt_message(message: str, key: str) -> str:
 def decrypt_message(encrypted: str, key: str) -> str:
     """Decrypt a Fernet-encrypted message"""
     try:
+        from cryptography.fernet import Fernet
         f = Fernet(key.encode())
         return f.decrypt(encrypted.encode()).decode()
     except Exception as e:
@@ -156,6 +158,7 @@ def decrypt_message(encrypted: str, key: str) -> str:
 
 def hash_password(password: str, salt: str = None) -> Tuple[str, str]:
     """Securely hash a password with optional salt"""
+    import hashlib
     if not salt:
         salt = os.urandom(16).hex()
     return hashlib.pbkdf2_hmac(
@@ -198,7 +201,11 @@ def time_since(timestamp: float) -> str:
 
 def clear_screen():
     """Clear the terminal/console screen"""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if os.name == 'nt':
+        os.system('cls')
+    else:
+        # ANSI clear + home, avoids spawning a shell for `clear`
+        print("\033[2J\033[H", end="", flush=True)
 
 def display_header():
     """Display ASCII art application header"""
@@ -263,21 +270,120 @@ def apply_theme(widget, theme_type="default"):
 
 def validate_config(config: Dict[str, Any]) -> Tuple[bool, str]:
     """Validate configuration dictionary structure and values"""
+    port = (int, lambda x: 1024 <= x <= 65535)
+    size = (int, lambda x: x >= 1024)
+    count = (int, lambda x: x >= 0)
+    positive = (int, lambda x: x >= 1)
+    seconds = ((int, float), lambda x: x >= 0)
+    interval = ((int, float), lambda x: x > 0)
+    fps = (int, lambda x: 1 <= x <= 240)
+    flag = (bool, lambda x: True)
     required = {
-        'PORT': (int, lambda x: 1024 <= x <= 65535),
-        'CHAT_PORT': (int, lambda x: 1024 <= x <= 65535),
-        'BUFFER_SIZE': (int, lambda x: x >= 1024),
-        'SHARED_FOLDER': (str, lambda x: os.path.exists(x))
+        'PORT': port,
+        'CHAT_PORT': port,
+        'BUFFER_SIZE': size,
     }
-    
-    for key, (type_check, validator) in required.items():
+    # Checked only when present, so partial dicts still validate
+    optional = {
+        'SHARED_FOLDER': (str, lambda x: os.path.exists(x)),
+        'BROWSE_PORT': port,
+        'UDP_PORT': port,
+        'METRICS_PORT': (int, lambda x: x == 0 or 1024 <= x <= 65535),
+        'PIPELINE_BUFFER_SIZE': size,
+        'MMAP_CHUNK_SIZE': size,
+        'SPLICE_CHUNK_SIZE': size,
+        'HASH_READ_SIZE': size,
+        'MAX_FRAME_SIZE': size,
+        'SYNC_BLOCK_SIZE': size,
+        'LOG_FILE_MAX_BYTES': size,
+        'UDP_SEND_BUFFER': size,
+        'UDP_SOCKET_BUFFER': size,
+        'READ_AHEAD_DEPTH': count,
+        'WRITE_BEHIND_DEPTH': count,
+        'HASH_WORKERS': count,
+        'FSYNC_BYTES': count,
+        'LOG_FILE_BACKUPS': count,
+        'CHAT_RECONNECT_ATTEMPTS': count,
+        'ANIMATION_BACKLOG_LIMIT': count,
+        'MAX_RETRIES': positive,
+        'CONSOLE_BURST': positive,
+        'HISTORY_PAGE_SIZE': positive,
+        'CHAT_RETRANSMIT_BUFFER': positive,
+        'CHAT_VIEW_MAX_LINES': positive,
+        'MAX_POPUPS': positive,
+        'UI_FPS': fps,
+        'ANIMATION_FPS': fps,
+        'THUMBNAIL_SIZE': (int, lambda x: 16 <= x <= 1024),
+        'THUMBNAIL_WORKERS': (int, lambda x: x >= 1),
+        'THUMBNAIL_CACHE_BYTES': count,
+        'MMAP_THRESHOLD': count,
+        'PIPELINE_THRESHOLD': count,
+        'SEND_RATE_LIMIT': count,
+        'SPARSE_MIN_HOLE': (int, lambda x: x >= 4096),
+        'SPARSE_MAX_EXTENTS': (int, lambda x: 1 <= x <= 30000),  # the hole map must fit in one frame
+        'CONSOLE_RATE_LIMIT': count,
+        'LOG_QUEUE_SIZE': (int, lambda x: x >= 1),
+        'UDP_PAYLOAD_SIZE': (int, lambda x: 512 <= x <= 65000),
+        'UDP_FEC_GROUP': count,
+        'UDP_INITIAL_WINDOW': positive,
+        'UDP_MAX_WINDOW': positive,
+        'UDP_RECV_WINDOW': positive,
+        'UDP_PACING_BURST': positive,
+        'UDP_MAX_CONNECTIONS': positive,
+        'UDP_MAX_PENDING': positive,
+        'UDP_VEGAS_ALPHA': count,
+        'UDP_VEGAS_BETA': count,
+        'UDP_ACK_DELAY': seconds,
+        'UDP_MIN_RTO': interval,
+        'UDP_MIN_RTT_WINDOW': interval,
+        'UDP_PACING_GAIN': interval,
+        'UDP_LOSS_BACKOFF': ((int, float), lambda x: 0 < x < 1),
+        'UDP_RANDOM_LOSS': ((int, float), lambda x: 0 <= x < 1),
+        'SOCKET_TIMEOUT': interval,
+        'HELLO_TIMEOUT': interval,
+        'RETRY_DELAY': seconds,
+        'PROGRESS_INTERVAL': seconds,
+        'SYNC_RETRY_INTERVAL': interval,
+        'SYNC_POLL_INTERVAL': interval,
+        'SYNC_DEBOUNCE': seconds,
+        'SYNC_MAX_DELAY': seconds,
+        'CATALOG_RESCAN_INTERVAL': seconds,
+        'METRICS_DUMP_INTERVAL': seconds,
+        'CONFIG_RELOAD_INTERVAL': seconds,
+        'IMPORT_BUDGET_MS': interval,
+        'LOG_TO_FILE': flag,
+        'SPARSE_TRANSFER': flag,
+        'RECEIVE_SPLICE': flag,
+        'BROWSE_ENABLED': flag,
+        'CAPABILITY_HELLO': flag,
+        'SYNC_ACCEPT': flag,
+        'LOG_LEVEL': (str, lambda x: x.upper() in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')),
+        'TRANSPORT': (str, lambda x: x in ('tcp', 'udp')),
+        'PROFILE': (str, lambda x: x in ('', 'spans', 'cprofile', 'tracemalloc')),
+        'SYNC_WATCHER': (str, lambda x: x in ('auto', 'inotify', 'poll')),
+    }
+
+    checks = [(key, rule, True) for key, rule in required.items()]
+    checks += [(key, rule, False) for key, rule in optional.items()]
+    for key, (type_check, validator), needed in checks:
         if key not in config:
-            return False, f"Missing config key: {key}"
-        if not isinstance(config[key], type_check):
-            return False, f"Invalid type for {key}, expected {type_check.__name__}"
-        if not validator(config[key]):
-            return False, f"Invalid value for {key}: {config[key]}"
-    
+            if needed:
+                return False, f"Missing config key: {key}"
+            continue
+        value = config[key]
+        types = type_check if isinstance(type_check, tuple) else (type_check,)
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            return False, f"Invalid type for {key}, expected {' or '.join(t.__name__ for t in types)}"
+        if not validator(value):
+            return False, f"Invalid value for {key}: {value}"
+
+    ports = [config[key] for key in ('PORT', 'CHAT_PORT', 'BROWSE_PORT', 'UDP_PORT') if key in config]
+    if len(set(ports)) != len(ports):
+        return False, f"Ports must differ: {ports}"
+    if config.get('UDP_INITIAL_WINDOW', 0) > config.get('UDP_MAX_WINDOW', float('inf')):
+        return False, "UDP_INITIAL_WINDOW can't exceed UDP_MAX_WINDOW"
+    if config.get('UDP_VEGAS_ALPHA', 0) >= config.get('UDP_VEGAS_BETA', float('inf')):
+        return False, "UDP_VEGAS_ALPHA must be below UDP_VEGAS_BETA"
     return True, "Config is valid"
 
 def validate_file_path(path: str) -> bool:
@@ -290,17 +396,16 @@ def validate_file_path(path: str) -> bool:
 
 def check_dependencies() -> bool:
     """Check if required Python packages are installed"""
-    try:
-        import tkinter
-        import PIL
-        import ttkthemes
-        import cryptography
-        return True
-    except ImportError as e:
-        print(f"❌ Missing dependency: {str(e)}")
+    # find_spec only locates the packages, they are imported when first used
+    from importlib.util import find_spec
+    missing = [name for name in ("tkinter", "tkinterdnd2", "sv_ttk", "PIL", "cryptography")
+               if find_spec(name) is None]
+    if missing:
+        print(f"❌ Missing dependency: {', '.join(missing)}")
         print("Please install required packages:")
-        print("pip install pillow ttkthemes sv-ttk cryptography")
+        print("pip install -r requirements.txt")
         return False
+    return True
 
 # ======================
 # MISC UTILITIES